@@ -1,5 +1,6 @@
 import logging
 
+from django.db import transaction
 from django.http import Http404
 from rest_framework import generics
 from rest_framework.decorators import permission_classes
@@ -188,16 +189,17 @@ class BaseAccessRequestView(RetrieveUpdateAPIView):
         serializer.save()
 
         if access_request.status == AccessRequest.Status.ACCEPTED:
-            phone, log = BarrierPhone.create(
-                user=access_request.user,
-                barrier=access_request.barrier,
-                phone=access_request.user.phone,
-                type=BarrierPhone.PhoneType.PRIMARY,
-                name=access_request.user.full_name,
-                author=BarrierActionLog.Author.SYSTEM,
-                reason=BarrierActionLog.Reason.ACCESS_GRANTED,
-            )
-            phone.send_sms_to_create(log)
+            with transaction.atomic():
+                phone, log = BarrierPhone.create(
+                    user=access_request.user,
+                    barrier=access_request.barrier,
+                    phone=access_request.user.phone,
+                    type=BarrierPhone.PhoneType.PRIMARY,
+                    name=access_request.user.full_name,
+                    author=BarrierActionLog.Author.SYSTEM,
+                    reason=BarrierActionLog.Reason.ACCESS_GRANTED,
+                )
+                phone.send_sms_to_create(log)
 
             UserBarrier.create(user=access_request.user, barrier=access_request.barrier, access_request=access_request)
 
@@ -144,15 +144,16 @@ LOG_DIR = os.path.join(BASE_DIR, "logs")
 if not os.path.exists(LOG_DIR):
     os.makedirs(LOG_DIR)
 
+# Level of the console and file handlers, loggers below still filter by their own level
+LOG_HANDLER_LEVEL = os.getenv("DJANGO_LOG_LEVEL", "INFO").upper()
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
     "formatters": {
         "verbose": {
-            "format": '{{"time": "{asctime}", "level": "{levelname}", "module": "{name}", "pid": "{process}", '
-            '"thread": "{thread}", "message": "{message}"}}',
+            "()": "core.logging.JsonFormatter",
             "datefmt": "%Y-%m-%d %H:%M:%S",
-            "style": "{",
         },
         "simple": {
             "format": "[{levelname}] {asctime} {name} (pid={process}, thread={thread}) - {message}",
@@ -161,7 +162,7 @@ LOGGING = {
     },
     "handlers": {
         "file": {
-            "level": "INFO",
+            "level": LOG_HANDLER_LEVEL,
             "class": "logging.handlers.TimedRotatingFileHandler",
             "filename": os.path.join(LOG_DIR, "django.log"),
             "when": "midnight",
@@ -169,7 +170,7 @@ LOGGING = {
             "formatter": "verbose",
         },
         "console": {
-            "level": "INFO",
+            "level": LOG_HANDLER_LEVEL,
             "class": "logging.StreamHandler",
             "formatter": "simple",
         },
@@ -1,5 +1,6 @@
 import logging
 
+from django.db import transaction
 from django.db.models import Q
 from django.http import Http404
 from rest_framework import status
@@ -134,8 +135,9 @@ class LeaveBarrierView(DestroyAPIView):
         logger.info(f"Deleting all phones for user '{user.id}' while leaving barrier '{barrier.id}'")
         phones = BarrierPhone.objects.filter(user=user, barrier=barrier, is_active=True)
         for phone in phones:
-            _, log = phone.remove(author=BarrierActionLog.Author.USER, reason=BarrierActionLog.Reason.BARRIER_EXIT)
-            phone.send_sms_to_delete(log)
+            with transaction.atomic():
+                _, log = phone.remove(author=BarrierActionLog.Author.USER, reason=BarrierActionLog.Reason.BARRIER_EXIT)
+                phone.send_sms_to_delete(log)
 
         return success_response({"message": "Left the barrier successfully."})
 
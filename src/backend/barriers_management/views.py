@@ -1,6 +1,7 @@
 import logging
 from datetime import timedelta
 
+from django.db import transaction
 from django.http import Http404
 from django.shortcuts import get_object_or_404
 from django.utils.timezone import now
@@ -66,16 +67,17 @@ class CreateBarrierView(generics.CreateAPIView):
             access_request=access_request,
         )
 
-        phone, log = BarrierPhone.create(
-            user=self.request.user,
-            barrier=barrier,
-            phone=self.request.user.phone,
-            type=BarrierPhone.PhoneType.PRIMARY,
-            name=self.request.user.full_name,
-            author=BarrierActionLog.Author.SYSTEM,
-            reason=BarrierActionLog.Reason.ACCESS_GRANTED,
-        )
-        phone.send_sms_to_create(log)
+        with transaction.atomic():
+            phone, log = BarrierPhone.create(
+                user=self.request.user,
+                barrier=barrier,
+                phone=self.request.user.phone,
+                type=BarrierPhone.PhoneType.PRIMARY,
+                name=self.request.user.full_name,
+                author=BarrierActionLog.Author.SYSTEM,
+                reason=BarrierActionLog.Reason.ACCESS_GRANTED,
+            )
+            phone.send_sms_to_create(log)
 
     def create(self, request, *args, **kwargs):
         """Use a different serializer for the response"""
@@ -161,8 +163,11 @@ class AdminBarrierView(generics.RetrieveUpdateDestroyAPIView):
 
         phones = BarrierPhone.objects.filter(barrier=barrier, is_active=True)
         for phone in phones:
-            _, log = phone.remove(author=BarrierActionLog.Author.ADMIN, reason=BarrierActionLog.Reason.BARRIER_DELETED)
-            phone.send_sms_to_delete(log)
+            with transaction.atomic():
+                _, log = phone.remove(
+                    author=BarrierActionLog.Author.ADMIN, reason=BarrierActionLog.Reason.BARRIER_DELETED
+                )
+                phone.send_sms_to_delete(log)
             logger.info(
                 f"Deleted phone '{phone.phone}' for user '{phone.user.id}' on barrier '{barrier.id}' "
                 f"while deleting barrier"
@@ -279,8 +284,9 @@ class AdminRemoveUserFromBarrierView(DestroyAPIView):
         logger.info(f"Deleting all phones for user '{user.id}' while leaving barrier '{barrier.id}'")
         phones = BarrierPhone.objects.filter(user=user, barrier=barrier, is_active=True)
         for phone in phones:
-            _, log = phone.remove(author=BarrierActionLog.Author.ADMIN, reason=BarrierActionLog.Reason.BARRIER_EXIT)
-            phone.send_sms_to_delete(log)
+            with transaction.atomic():
+                _, log = phone.remove(author=BarrierActionLog.Author.ADMIN, reason=BarrierActionLog.Reason.BARRIER_EXIT)
+                phone.send_sms_to_delete(log)
 
         return success_response({"message": "User successfully removed from barrier."})
 
@@ -320,15 +326,16 @@ class AdminBarrierSettingsView(APIView):
         setting_key = serializer.validated_data["setting"]
         params = serializer.validated_data["params"]
 
-        log = BarrierActionLog.objects.create(
-            barrier=barrier,
-            phone=None,
-            author=BarrierActionLog.Author.ADMIN,
-            action_type=BarrierActionLog.ActionType.BARRIER_SETTING,
-            old_value=None,
-        )
+        with transaction.atomic():
+            log = BarrierActionLog.objects.create(
+                barrier=barrier,
+                phone=None,
+                author=BarrierActionLog.Author.ADMIN,
+                action_type=BarrierActionLog.ActionType.BARRIER_SETTING,
+                old_value=None,
+            )
 
-        SMSService.send_barrier_setting(barrier, setting_key, params, log)
+            SMSService.send_barrier_setting(barrier, setting_key, params, log)
 
         return Response({"message": "Setting sent successfully.", "action": log.id})
 
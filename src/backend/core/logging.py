@@ -0,0 +1,126 @@
+import copy
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+# The backend and sms_service are built as separate images from their own directories, so they cannot import
+# a common package. src/sms_service/utils/logging.py holds the same filter, queue handler and level helpers,
+# a change to one of them must be made in both files. Only the JSON keys and the setup function differ.
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for Promtail to parse without a regex. Keeps the keys of the former format string."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "module": record.name,
+            "pid": record.process,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets a record logged with extra={"rate_limit": seconds} through at most once per interval for every
+    logger and message template. The next record let through tells how many were dropped meanwhile.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._seen: dict[tuple[str, str], tuple[float, int]] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        interval = getattr(record, "rate_limit", None)
+        if not interval:
+            return True
+
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            last, dropped = self._seen.get(key, (None, 0))
+            if last is not None and now - last < interval:
+                self._seen[key] = (last, dropped + 1)
+                return False
+            self._seen[key] = (now, 0)
+
+        if dropped:
+            record.msg = f"{record.msg} ({dropped} similar messages suppressed)"
+        return True
+
+
+class LogQueueHandler(QueueHandler):
+    """Hands records to the listener thread, only merging the message arguments in the logging thread."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            # Traceback objects keep whole frames alive, the listener only needs the text
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def apply_log_levels(spec: str):
+    """Set logger levels from "name=LEVEL" pairs separated by commas or new lines, "root" names the root logger."""
+
+    for item in spec.replace("\n", ",").split(","):
+        item = item.split("#", 1)[0].strip()
+        if not item:
+            continue
+        name, _, level = item.partition("=")
+        name = name.strip()
+        try:
+            logging.getLogger(None if name == "root" else name).setLevel(level.strip().upper())
+        except ValueError:
+            logging.getLogger(__name__).warning("Unknown log level in %r", item)
+
+
+def reload_log_levels(*args):
+    """Apply the levels of LOG_LEVELS_FILE, called on SIGHUP so levels can be changed without a restart."""
+
+    path = os.getenv("LOG_LEVELS_FILE", "log_levels.conf")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            apply_log_levels(f.read())
+    except FileNotFoundError:
+        return
+    logging.getLogger(__name__).info("Log levels reloaded from %s", path)
+
+
+def start_queue_logging(*logger_names: str) -> QueueListener:
+    """
+    Move the handlers of the given loggers behind a queue served by one listener thread,
+    so consumer threads never wait for the console or the log file. Returns the started listener.
+    """
+
+    loggers = [logging.getLogger(name) for name in logger_names]
+    handlers = []
+    for logger in loggers:
+        for handler in logger.handlers:
+            if handler not in handlers:
+                handlers.append(handler)
+
+    queue_handler = LogQueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(RateLimitFilter())
+    for logger in loggers:
+        if logger.handlers:
+            logger.handlers = [queue_handler]
+
+    listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
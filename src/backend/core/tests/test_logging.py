@@ -0,0 +1,103 @@
+import json
+import logging
+import sys
+
+import pytest
+
+from core.logging import JsonFormatter, RateLimitFilter, apply_log_levels, reload_log_levels, start_queue_logging
+
+
+def make_record(msg, *args, rate_limit=None, exc_info=None):
+    record = logging.LogRecord("message_management.test", logging.INFO, __file__, 1, msg, args, exc_info)
+    if rate_limit is not None:
+        record.rate_limit = rate_limit
+    return record
+
+
+@pytest.fixture
+def restore_levels():
+    loggers = [logging.getLogger(name) for name in ("core.test_a", "core.test_b")]
+    yield loggers
+    for logger in loggers:
+        logger.setLevel(logging.NOTSET)
+
+
+def test_json_formatter_escapes_message():
+    line = JsonFormatter().format(make_record('Content: "%s"', "OK\nsaved"))
+
+    entry = json.loads(line)
+    assert entry["message"] == 'Content: "OK\nsaved"'
+    assert entry["level"] == "INFO"
+    assert entry["module"] == "message_management.test"
+
+
+def test_json_formatter_includes_exception():
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        record = make_record("Failed", exc_info=sys.exc_info())
+
+    entry = json.loads(JsonFormatter().format(record))
+    assert "ValueError: boom" in entry["exception"]
+
+
+def test_rate_limit_filter_drops_repeats_within_interval(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("core.logging.time.monotonic", lambda: now[0])
+    rate_filter = RateLimitFilter()
+
+    assert rate_filter.filter(make_record("No message on %s", "a", rate_limit=60))
+    assert not rate_filter.filter(make_record("No message on %s", "b", rate_limit=60))
+    assert not rate_filter.filter(make_record("No message on %s", "c", rate_limit=60))
+
+    now[0] += 61
+    record = make_record("No message on %s", "d", rate_limit=60)
+    assert rate_filter.filter(record)
+    assert record.getMessage() == "No message on d (2 similar messages suppressed)"
+
+
+def test_rate_limit_filter_passes_records_without_limit():
+    rate_filter = RateLimitFilter()
+
+    assert all(rate_filter.filter(make_record("Processing")) for _ in range(3))
+
+
+def test_apply_log_levels(restore_levels):
+    first, second = restore_levels
+
+    apply_log_levels("core.test_a=debug, core.test_b=WARNING\n# comment\ncore.test_a=nonsense")
+
+    assert first.level == logging.DEBUG
+    assert second.level == logging.WARNING
+
+
+def test_reload_log_levels_reads_file(tmp_path, monkeypatch, restore_levels):
+    path = tmp_path / "log_levels.conf"
+    path.write_text("core.test_a=ERROR\n")
+    monkeypatch.setenv("LOG_LEVELS_FILE", str(path))
+
+    reload_log_levels()
+
+    assert restore_levels[0].level == logging.ERROR
+
+
+def test_start_queue_logging_moves_handlers_behind_queue():
+    logger = logging.getLogger("core.test_queue")
+    logger.propagate = False
+    records = []
+
+    class ListHandler(logging.Handler):
+        def emit(self, record):
+            records.append(record)
+
+    handler = ListHandler()
+    logger.addHandler(handler)
+    listener = start_queue_logging("core.test_queue")
+    try:
+        logger.warning("Queued %s", "record")
+    finally:
+        listener.stop()
+        logger.handlers = []
+        logger.propagate = True
+
+    assert [record.getMessage() for record in records] == ["Queued record"]
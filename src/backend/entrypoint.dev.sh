@@ -32,6 +32,9 @@ EOF
 log info 'Starting Kafka consumers...'
 python manage.py run_sms_consumers & >> /dev/stdout 2>&1 &
 
+log info 'Starting outbox relay...'
+python manage.py relay_outbox & >> /dev/stdout 2>&1 &
+
 log info 'Starting scheduler...'
 python manage.py run_scheduler & >> /dev/stdout 2>&1 &
 
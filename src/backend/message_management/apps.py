@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class MessageManagementConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "message_management"
+
+    def ready(self):
+        from message_management.config_loader import load_barrier_settings, load_phone_commands
+
+        # A broken device config fails the startup instead of the first SMS using it
+        load_phone_commands()
+        load_barrier_settings()
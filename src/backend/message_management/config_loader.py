@@ -1,7 +1,11 @@
 import json
 import logging
 import os
+import re
+import string
+import threading
 
+from django.core.exceptions import ImproperlyConfigured
 from rest_framework.exceptions import NotFound, ValidationError
 
 from message_management.enums import PhoneCommand
@@ -14,9 +18,83 @@ SETTINGS_PATH = os.path.join(BASE_DIR, "configs", "barrier_settings.json")
 logger = logging.getLogger(__name__)
 
 
+def template_fields(template: str) -> set[str]:
+    return {field for _, field, _, _ in string.Formatter().parse(template) if field is not None}
+
+
+def validate_config(config, path: str):
+    """Check the structure shared by the command and settings files, model -> key -> entry."""
+
+    if not isinstance(config, dict):
+        raise ImproperlyConfigured(f"{path}: expected an object of device models")
+    for model, entries in config.items():
+        if not isinstance(entries, dict):
+            raise ImproperlyConfigured(f"{path}: entries of model '{model}' must be an object")
+        for key, entry in entries.items():
+            where = f"{path}: '{model}.{key}'"
+            if not isinstance(entry, dict) or not isinstance(entry.get("template"), str):
+                raise ImproperlyConfigured(f"{where} must have a string template")
+            params = entry.get("params", [])
+            if not isinstance(params, list) or not all(isinstance(param, dict) and "key" in param for param in params):
+                raise ImproperlyConfigured(f"{where} params must be a list of objects with a key")
+            try:
+                fields = template_fields(entry["template"])
+            except ValueError as e:
+                raise ImproperlyConfigured(f"{where} has an invalid template: {e}")
+            undeclared = fields - {param["key"] for param in params}
+            if "params" in entry and undeclared:
+                raise ImproperlyConfigured(f"{where} template uses undeclared params: {', '.join(sorted(undeclared))}")
+            if "response_pattern" in entry:
+                try:
+                    re.compile(entry["response_pattern"])
+                except (re.error, TypeError) as e:
+                    raise ImproperlyConfigured(f"{where} has an invalid response_pattern: {e}")
+
+
+class ConfigRegistry:
+    """
+    JSON config files parsed and validated once, and parsed again when their modification time changes.
+    Response patterns are compiled once per file version.
+    """
+
+    def __init__(self):
+        self._files: dict[str, tuple[tuple[int, int], dict]] = {}
+        self._patterns: dict[tuple[str, str, str], re.Pattern] = {}
+        self._lock = threading.Lock()
+
+    def load(self, path: str) -> dict:
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        cached = self._files.get(path)
+        if cached and cached[0] == version:
+            return cached[1]
+
+        with self._lock:
+            cached = self._files.get(path)
+            if cached and cached[0] == version:
+                return cached[1]
+            with open(path) as f:
+                config = json.load(f)
+            validate_config(config, path)
+            self._files[path] = (version, config)
+            self._patterns = {key: pattern for key, pattern in self._patterns.items() if key[0] != path}
+            if cached:
+                logger.info("Reloaded config %s", path)
+            return config
+
+    def pattern(self, path: str, device_model: str, command: str, source: str) -> re.Pattern:
+        key = (path, device_model, command)
+        pattern = self._patterns.get(key)
+        if pattern is None or pattern.pattern != source:
+            pattern = self._patterns[key] = re.compile(source)
+        return pattern
+
+
+registry = ConfigRegistry()
+
+
 def load_phone_commands():
-    with open(PHONE_COMMANDS_PATH) as f:
-        return json.load(f)
+    return registry.load(PHONE_COMMANDS_PATH)
 
 
 def get_phone_command(device_model: str, command: PhoneCommand) -> dict:
@@ -34,9 +112,15 @@ def get_phone_command(device_model: str, command: PhoneCommand) -> dict:
     return cmd
 
 
+def get_response_pattern(device_model: str, command: PhoneCommand) -> re.Pattern:
+    """Compiled response_pattern of the command, raises like get_phone_command."""
+
+    source = get_phone_command(device_model, command)["response_pattern"]
+    return registry.pattern(PHONE_COMMANDS_PATH, device_model, command.value, source)
+
+
 def load_barrier_settings():
-    with open(SETTINGS_PATH) as f:
-        return json.load(f)
+    return registry.load(SETTINGS_PATH)
 
 
 def get_setting(device_model: str, key: str) -> dict:
@@ -1,3 +1,23 @@
 import os
 
 KAFKA_SERVERS = os.getenv("KAFKA_SERVERS", "kafka:9092")
+
+# Delays of the retry topics a failed message goes through before the dead letter topic
+KAFKA_RETRY_DELAYS_SECONDS = [
+    float(delay) for delay in os.getenv("KAFKA_RETRY_DELAYS_SECONDS", "30,300").split(",") if delay.strip()
+]
+
+# Time the producer keeps trying to deliver a message before its delivery report fails
+KAFKA_DELIVERY_TIMEOUT_MS = int(os.getenv("KAFKA_DELIVERY_TIMEOUT_MS", "30000"))
+
+# Outbox relay: rows published per batch, pause when nothing is pending and retries of failed publishes
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "100"))
+OUTBOX_POLL_INTERVAL_SECONDS = float(os.getenv("OUTBOX_POLL_INTERVAL_SECONDS", "0.5"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5"))
+OUTBOX_RETRY_BASE_SECONDS = float(os.getenv("OUTBOX_RETRY_BASE_SECONDS", "2"))
+OUTBOX_RETRY_MAX_SECONDS = float(os.getenv("OUTBOX_RETRY_MAX_SECONDS", "300"))
+# Time a relay owns the rows it claimed, must exceed the delivery timeout
+OUTBOX_CLAIM_TIMEOUT_SECONDS = float(os.getenv("OUTBOX_CLAIM_TIMEOUT_SECONDS", "120"))
+
+# Messages the backend consumers handle and commit together
+KAFKA_CONSUMER_BATCH_SIZE = int(os.getenv("KAFKA_CONSUMER_BATCH_SIZE", "100"))
@@ -10,6 +10,11 @@ class PhoneCommand(Enum):
         return [(member.value, member.name) for member in cls]
 
 
+class SMSPriority(Enum):
+    INTERACTIVE = "interactive"
+    BULK = "bulk"
+
+
 class KafkaTopic(Enum):
     SMS_CONFIGURATION = "sms_configuration"
     SMS_VERIFICATION = "sms_verification"
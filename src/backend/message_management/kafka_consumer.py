@@ -1,16 +1,18 @@
 import json
 import logging
-import re
 import threading
 import time
 
-from confluent_kafka import Consumer, Message
+from confluent_kafka import Consumer, Message, TopicPartition
+from django.db import transaction
+from django.utils.timezone import now
 
 from action_history.models import BarrierActionLog
 from barriers.models import Barrier
-from message_management.config_loader import get_phone_command
-from message_management.constants import KAFKA_SERVERS
+from message_management.config_loader import get_response_pattern
+from message_management.constants import KAFKA_CONSUMER_BATCH_SIZE, KAFKA_RETRY_DELAYS_SECONDS, KAFKA_SERVERS
 from message_management.enums import KafkaTopic, PhoneCommand
+from message_management.kafka_retry import get_retry_at, retry_topic, route_failure
 from message_management.models import SMSMessage
 from phones.models import BarrierPhone
 
@@ -33,70 +35,56 @@ class SMSMessageHandlers:
             return None, ""
 
     @staticmethod
-    def _load_sms(message_id: int) -> SMSMessage | None:
-        try:
-            return SMSMessage.objects.get(id=message_id)
-        except SMSMessage.DoesNotExist:
-            logger.warning("SMS message %s not found", message_id)
-            return None
+    def _process_phone_command(sms: SMSMessage, content: str) -> BarrierPhone | None:
+        """Set the status of the command and the access state of its phone, returns the phone to save."""
 
-    @staticmethod
-    def _process_phone_command(sms: SMSMessage, content: str):
         content = content.strip().splitlines()[0]
-        logger.info("Content: %s", content)
+        logger.debug("Content: %s", content)
 
         if not sms.log:
             logger.error("SMS %s has no associated log.", sms.id)
             sms.status = SMSMessage.Status.FAILED
-            return
+            return None
 
         phone: BarrierPhone = sms.log.phone
         success = False
-        logger.info(f"Phone: {phone}, log: {sms.log}")
+        logger.debug("Phone: %s, log: %s", phone, sms.log)
 
         try:
             barrier: Barrier = sms.log.barrier
             log_action: BarrierActionLog.ActionType = sms.log.action_type
             phone_command = PhoneCommand(log_action)
-            pattern = get_phone_command(barrier.device_model, phone_command).get("response_pattern")
-            logger.info(f"Barrier: {barrier}, command: {phone_command}, pattern: {pattern}")
+            pattern = get_response_pattern(barrier.device_model, phone_command)
+            logger.debug("Barrier: %s, command: %s, pattern: %s", barrier, phone_command, pattern.pattern)
 
-            if not pattern:
+            if not pattern.pattern:
                 logger.error("No pattern found for model=%s command=%s", barrier.device_model, phone_command)
                 sms.status = SMSMessage.Status.FAILED
-            elif re.match(pattern, content):
+            elif pattern.match(content):
                 sms.status = SMSMessage.Status.SUCCESS
                 success = True
             else:
-                logger.info(f"NO PATTERN MATCHED: {pattern} = {content}")
+                logger.info("No pattern matched: %s = %s", pattern.pattern, content)
                 sms.status = SMSMessage.Status.FAILED
         except Exception as e:
             logger.exception("Error parsing command response for SMS %s: %s", sms.id, e)
             sms.status = SMSMessage.Status.FAILED
 
-        logger.info(f"CHECKING PHONE: {phone}")
+        logger.debug("Checking phone: %s", phone)
         if sms.phone_command_type == SMSMessage.PhoneCommandType.OPEN:
             phone.access_state = BarrierPhone.AccessState.OPEN if success else BarrierPhone.AccessState.ERROR_OPENING
         elif sms.phone_command_type == SMSMessage.PhoneCommandType.CLOSE:
             phone.access_state = BarrierPhone.AccessState.CLOSED if success else BarrierPhone.AccessState.ERROR_CLOSING
-
-        logger.info(f"SAVING PHONE: {phone}")
-        phone.save()
+        return phone
 
     @staticmethod
-    def handle_failed_message(message: Message) -> bool:
-        message_id, content = SMSMessageHandlers._parse_message_data(message)
-        if not message_id:
-            return False
-
-        sms = SMSMessageHandlers._load_sms(message_id)
-        if not sms:
-            return False
+    def apply_failure(sms: SMSMessage, content: str) -> tuple[bool, BarrierPhone | None]:
+        """Mark the SMS as failed, returns whether the SMS changed and the phone to save."""
 
         sms.status = SMSMessage.Status.FAILED
         sms.response_content = content
-        sms.save()
 
+        phone = None
         if sms.message_type == SMSMessage.MessageType.PHONE_COMMAND and sms.log and sms.log.phone:
             phone = sms.log.phone
             logger.info("Marking phone access_state as failed for SMS %s", sms.id)
@@ -106,69 +94,128 @@ class SMSMessageHandlers:
             elif sms.phone_command_type == SMSMessage.PhoneCommandType.CLOSE:
                 phone.access_state = BarrierPhone.AccessState.ERROR_CLOSING
 
-            phone.save()
-
         logger.info("Marked SMS %s as FAILED", sms.id)
-        return True
+        return True, phone
 
     @staticmethod
-    def handle_response_message(message: Message) -> bool:
-        message_id, content = SMSMessageHandlers._parse_message_data(message)
-        if not message_id:
-            return False
-
-        sms = SMSMessageHandlers._load_sms(message_id)
-        if not sms:
-            return False
+    def apply_response(sms: SMSMessage, content: str) -> tuple[bool, BarrierPhone | None]:
+        """Apply the reply to the SMS, returns whether the SMS changed and the phone to save."""
 
         logger.info("Processing response for SMS %s", sms.id)
 
+        phone = None
         if sms.message_type == SMSMessage.MessageType.PHONE_COMMAND:
-            SMSMessageHandlers._process_phone_command(sms, content)
+            phone = SMSMessageHandlers._process_phone_command(sms, content)
 
         elif sms.message_type == SMSMessage.MessageType.BARRIER_SETTING:
             sms.status = SMSMessage.Status.SUCCESS
 
         else:
             logger.info("Ignoring SMS %s of type %s", sms.id, sms.message_type)
-            return True
+            return False, None
 
         sms.response_content = content
-        sms.save()
         logger.info("Updated SMS %s with status %s", sms.id, sms.status)
-        return True
+        return True, phone
+
+    @staticmethod
+    def _handle_batch(messages: list[Message], apply) -> list[str | None]:
+        """
+        Apply a batch of messages with one query for their SMS and one transaction for the updates.
+        Returns the error of every message, None when it was handled.
+        """
+
+        parsed = [SMSMessageHandlers._parse_message_data(message) for message in messages]
+        message_ids = {message_id for message_id, _ in parsed if message_id}
+        sms_by_id = SMSMessage.objects.select_related("log__phone", "log__barrier").in_bulk(message_ids)
+
+        errors: list[str | None] = []
+        changed_sms: dict[int, SMSMessage] = {}
+        changed_phones: dict[int, BarrierPhone] = {}
+        for message_id, content in parsed:
+            sms = sms_by_id.get(message_id) if message_id else None
+            if sms is None:
+                if message_id:
+                    logger.warning("SMS message %s not found", message_id)
+                errors.append("Handler failed")
+                continue
+            try:
+                changed, phone = apply(sms, content)
+            except Exception as e:
+                logger.exception("Error handling SMS %s: %s", message_id, e)
+                errors.append(str(e) or type(e).__name__)
+                continue
+            if changed:
+                changed_sms[sms.id] = sms
+            if phone is not None:
+                # Later messages of the batch win, as if the messages were saved one by one
+                changed_phones.pop(phone.id, None)
+                changed_phones[phone.id] = phone
+            errors.append(None)
+
+        updated_at = now()
+        for instance in [*changed_sms.values(), *changed_phones.values()]:
+            instance.updated_at = updated_at
+        with transaction.atomic():
+            SMSMessage.objects.bulk_update(changed_sms.values(), ["status", "response_content", "updated_at"])
+            BarrierPhone.objects.bulk_update(changed_phones.values(), ["access_state", "updated_at"])
+        return errors
+
+    @staticmethod
+    def handle_failed_messages(messages: list[Message]) -> list[str | None]:
+        return SMSMessageHandlers._handle_batch(messages, SMSMessageHandlers.apply_failure)
+
+    @staticmethod
+    def handle_response_messages(messages: list[Message]) -> list[str | None]:
+        return SMSMessageHandlers._handle_batch(messages, SMSMessageHandlers.apply_response)
 
 
 class KafkaConsumer:
+    """
+    Consumes a topic, or one of its retry topics when retry_hop is set.
+    Messages are consumed in batches of up to batch_size, handled together and committed once.
+    A message the handler fails on is published to the next retry topic or the dead letter topic and committed,
+    so one bad message does not stall the partition. On a retry topic a partition is paused until its next
+    message is due.
+    """
+
     TOPIC_HANDLERS = {
-        KafkaTopic.SMS_RESPONSES: SMSMessageHandlers.handle_response_message,
-        KafkaTopic.FAILED_MESSAGES: SMSMessageHandlers.handle_failed_message,
+        KafkaTopic.SMS_RESPONSES: SMSMessageHandlers.handle_response_messages,
+        KafkaTopic.FAILED_MESSAGES: SMSMessageHandlers.handle_failed_messages,
     }
 
-    def __init__(self, topic: KafkaTopic):
+    def __init__(self, topic: KafkaTopic, retry_hop: int = 0, batch_size: int = KAFKA_CONSUMER_BATCH_SIZE):
         self.topic = topic
+        self.topic_name = retry_topic(topic.value, retry_hop) if retry_hop else topic.value
         self.handler = self.TOPIC_HANDLERS.get(topic)
+        self.batch_size = batch_size
         self.stop_event = threading.Event()
+        self.waiting: dict[int, float] = {}
         self.consumer = self._create_consumer()
 
     def _create_consumer(self) -> Consumer:
         consumer = Consumer(
             {
                 "bootstrap.servers": KAFKA_SERVERS,
-                "group.id": f"sms_handler_{self.topic.value}_group",
+                "group.id": f"sms_handler_{self.topic_name}_group",
                 "auto.offset.reset": "earliest",
                 "enable.auto.commit": False,
             }
         )
-        consumer.subscribe([self.topic.value])
-        logger.info(f"Created consumer and subscribed to topic: {self.topic}")
+        consumer.subscribe([self.topic_name], on_revoke=self._on_revoke)
+        logger.info(f"Created consumer and subscribed to topic: {self.topic_name}")
         return consumer
 
+    def _on_revoke(self, consumer: Consumer, partitions: list[TopicPartition]):
+        for tp in partitions:
+            self.waiting.pop(tp.partition, None)
+
     def _restart(self):
         try:
             self.consumer.close()
         except Exception as e:
             logger.error("Error closing consumer: %s", e)
+        self.waiting.clear()
         time.sleep(5)
         self.consumer = self._create_consumer()
 
@@ -176,23 +223,83 @@ class KafkaConsumer:
         self.stop_event.set()
         logger.info("Stopping Kafka consumer")
 
+    def _resume_due(self):
+        now = time.time()
+        for partition in [partition for partition, retry_at in self.waiting.items() if retry_at <= now]:
+            del self.waiting[partition]
+            self.consumer.resume([TopicPartition(self.topic_name, partition)])
+
+    def _wait_until_due(self, msg: Message) -> bool:
+        """Pause the partition and rewind to the message if its retry is not due yet."""
+
+        retry_at = get_retry_at(msg)
+        if retry_at <= time.time():
+            return False
+
+        partition = TopicPartition(self.topic_name, msg.partition(), msg.offset())
+        self.consumer.pause([partition])
+        self.consumer.seek(partition)
+        self.waiting[msg.partition()] = retry_at
+        logger.debug(f"Message at offset {msg.offset()} on {self.topic_name} is due in {retry_at - time.time():.0f}s")
+        return True
+
+    def _handle(self, messages: list[Message]):
+        try:
+            errors = self.handler(messages)
+        except Exception as e:
+            logger.exception(f"Handler error on topic {self.topic_name}: {e}")
+            errors = [str(e) or type(e).__name__] * len(messages)
+
+        for msg, error in zip(messages, errors):
+            if error is not None:
+                route_failure(msg, error, KAFKA_RETRY_DELAYS_SECONDS)
+
+    def _commit(self, messages: list[Message]):
+        """Commit the offset after the last handled message of every partition."""
+
+        offsets = {}
+        for msg in messages:
+            offsets[msg.partition()] = max(offsets.get(msg.partition(), -1), msg.offset() + 1)
+        self.consumer.commit(
+            offsets=[TopicPartition(self.topic_name, partition, offset) for partition, offset in offsets.items()],
+            asynchronous=False,
+        )
+        logger.debug("Committed %d messages on %s up to offsets %s", len(messages), self.topic_name, offsets)
+
+    def _take_due(self, messages: list[Message]) -> list[Message]:
+        """Drop errors and, on a retry topic, every message from a partition whose next message is not due."""
+
+        due = []
+        waiting = set()
+        for msg in messages:
+            if msg.error():
+                logger.error(f"Error receiving message on {self.topic_name}: {msg.error()}")
+                continue
+            if msg.partition() in waiting:
+                continue
+            if self._wait_until_due(msg):
+                waiting.add(msg.partition())
+                continue
+            due.append(msg)
+        return due
+
     def start(self):
-        logger.info(f"Starting consumer for topic {self.topic}")
+        logger.info(f"Starting consumer for topic {self.topic_name}")
         while not self.stop_event.is_set():
             try:
-                msg: Message = self.consumer.poll(timeout=5.0)
-                if msg is None:
-                    logger.debug(f"No message on {self.topic}. Continuing...")
+                self._resume_due()
+
+                messages = self.consumer.consume(self.batch_size, timeout=1.0 if self.waiting else 5.0)
+                if not messages:
+                    logger.debug("No message on %s. Continuing...", self.topic_name, extra={"rate_limit": 60})
+                    continue
+                messages = self._take_due(messages)
+                if not messages:
                     continue
-                if msg.error():
-                    logger.error(f"Error receiving message on {self.topic}: {msg.error()}")
-                logger.info(f"Received message: {msg.value()} on {self.topic}")
-                if self.handler(msg):
-                    self.consumer.commit(msg)
-                    logger.info(f"Committed message at offset {msg.offset()}")
-                else:
-                    raise Exception("Handler failed")
+                logger.debug("Received %d messages on %s", len(messages), self.topic_name)
+                self._handle(messages)
+                self._commit(messages)
 
             except Exception as e:
-                logger.critical(f"Consumer error on topic {self.topic}: {e}")
+                logger.critical(f"Consumer error on topic {self.topic_name}: {e}")
                 self._restart()
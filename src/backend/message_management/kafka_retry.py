@@ -0,0 +1,78 @@
+import json
+import logging
+import time
+
+from confluent_kafka import Message
+
+from message_management.kafka_producer import get_producer
+
+logger = logging.getLogger(__name__)
+
+ATTEMPT_HEADER = "x-attempt"
+LAST_ERROR_HEADER = "x-last-error"
+ORIGINAL_TOPIC_HEADER = "x-original-topic"
+RETRY_AT_HEADER = "x-retry-at"
+
+
+def retry_topic(topic: str, hop: int) -> str:
+    return f"{topic}_retry_{hop}"
+
+
+def dead_letter_topic(topic: str) -> str:
+    return f"{topic}_dlq"
+
+
+def get_header(message: Message, name: str) -> str | None:
+    for key, value in message.headers() or []:
+        if key == name and value is not None:
+            return value.decode("utf-8") if isinstance(value, bytes) else value
+    return None
+
+
+def get_attempt(message: Message) -> int:
+    """Number of times the message was already handled without success."""
+
+    attempt = get_header(message, ATTEMPT_HEADER)
+    return int(attempt) if attempt else 0
+
+
+def get_retry_at(message: Message) -> float:
+    retry_at = get_header(message, RETRY_AT_HEADER)
+    return float(retry_at) if retry_at else 0.0
+
+
+def get_max_attempts(message: Message, delays: list[float]) -> int:
+    """The retries field of the payload, when present, caps the attempts across all retry hops."""
+
+    max_attempts = len(delays) + 1
+    try:
+        retries = json.loads(message.value().decode("utf-8")).get("retries")
+    except Exception:
+        return max_attempts
+    return min(max_attempts, max(int(retries), 1)) if retries else max_attempts
+
+
+def route_failure(message: Message, error: str, delays: list[float]) -> str:
+    """
+    Publish a failed message to the next retry topic, or to the dead letter topic once its attempts are used up.
+    The attempt count, the last error and the time the retry is due travel in the message headers.
+    Returns the topic the message was published to.
+    """
+
+    topic = get_header(message, ORIGINAL_TOPIC_HEADER) or message.topic()
+    attempt = get_attempt(message) + 1
+    headers = {ATTEMPT_HEADER: str(attempt), LAST_ERROR_HEADER: error[:1000], ORIGINAL_TOPIC_HEADER: topic}
+
+    if attempt < get_max_attempts(message, delays):
+        target = retry_topic(topic, attempt)
+        headers[RETRY_AT_HEADER] = str(time.time() + delays[attempt - 1])
+        logger.warning("Message from %s failed (attempt %d): %s. Retrying through %s", topic, attempt, error, target)
+    else:
+        target = dead_letter_topic(topic)
+        logger.error("Message from %s failed (attempt %d): %s. Moving to %s", topic, attempt, error, target)
+
+    producer = get_producer()
+    producer.produce(topic=target, key=message.key(), value=message.value(), headers=headers)
+    if producer.flush(timeout=5) != 0:
+        raise ConnectionError(f"Failed to deliver message to {target}")
+    return target
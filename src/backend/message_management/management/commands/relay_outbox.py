@@ -0,0 +1,49 @@
+import logging
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from message_management.constants import OUTBOX_BATCH_SIZE, OUTBOX_POLL_INTERVAL_SECONDS
+from message_management.outbox import OutboxRelay
+
+logger = logging.getLogger(__name__)
+stop_event = threading.Event()
+
+
+def signal_handler(signum, frame):
+    logger.info("Received shutdown signal...")
+    stop_event.set()
+
+
+class Command(BaseCommand):
+    help = "Publish the SMS messages of the outbox to Kafka"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=OUTBOX_BATCH_SIZE)
+        parser.add_argument("--interval", type=float, default=OUTBOX_POLL_INTERVAL_SECONDS)
+        parser.add_argument("--once", action="store_true", help="Publish the pending messages and exit")
+
+    def handle(self, *args, **options):
+        signal.signal(signal.SIGINT, signal_handler)
+        signal.signal(signal.SIGTERM, signal_handler)
+
+        relay = OutboxRelay(batch_size=options["batch_size"])
+        logger.info("Starting outbox relay")
+
+        while not stop_event.is_set():
+            close_old_connections()
+            try:
+                handled = relay.relay_batch()
+            except Exception as e:
+                logger.exception("Error while relaying outbox messages: %s", e)
+                handled = 0
+
+            # A full batch means more messages are waiting
+            if handled < relay.batch_size:
+                if options["once"]:
+                    break
+                stop_event.wait(options["interval"])
+
+        logger.info("Outbox relay stopped")
@@ -1,22 +1,17 @@
 import concurrent.futures
 import logging
+import os
 import signal
-import sys
 import threading
 import time
 
 from django.core.management.base import BaseCommand
 
+from core.logging import apply_log_levels, reload_log_levels, start_queue_logging
+from message_management.constants import KAFKA_RETRY_DELAYS_SECONDS
 from message_management.enums import KafkaTopic
 from message_management.kafka_consumer import KafkaConsumer
 
-logging.basicConfig(
-    level=logging.INFO,
-    stream=sys.stdout,
-    format="%(asctime)s | %(levelname)s | %(name)s | [%(threadName)s] | %(message)s",
-)
-
-
 logger = logging.getLogger(__name__)
 stop_event = threading.Event()
 
@@ -32,15 +27,23 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         signal.signal(signal.SIGINT, signal_handler)
         signal.signal(signal.SIGTERM, signal_handler)
+        signal.signal(signal.SIGHUP, reload_log_levels)
+
+        listener = start_queue_logging("message_management", "")
+        apply_log_levels(os.getenv("LOG_LEVELS", ""))
+        reload_log_levels()
 
-        response_consumer = KafkaConsumer(KafkaTopic.SMS_RESPONSES)
-        failed_consumer = KafkaConsumer(KafkaTopic.FAILED_MESSAGES)
+        consumers = [
+            KafkaConsumer(topic, retry_hop=hop)
+            for topic in (KafkaTopic.SMS_RESPONSES, KafkaTopic.FAILED_MESSAGES)
+            for hop in range(len(KAFKA_RETRY_DELAYS_SECONDS) + 1)
+        ]
 
-        with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(consumers)) as executor:
             logger.info("Starting Kafka consumers for SMS")
 
-            executor.submit(response_consumer.start)
-            executor.submit(failed_consumer.start)
+            for consumer in consumers:
+                executor.submit(consumer.start)
 
             logger.info("Consumers started. Waiting for stop signal.")
 
@@ -49,6 +52,7 @@ class Command(BaseCommand):
                     time.sleep(1)
             finally:
                 logger.info("Stopping consumers...")
-                response_consumer.stop()
-                failed_consumer.stop()
+                for consumer in consumers:
+                    consumer.stop()
                 executor.shutdown(wait=True)
+                listener.stop()
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.20 on 2026-10-17 14:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("message_management", "0007_outboxmessage"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="outboxmessage",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Waiting for publishing"),
+                    ("dispatched", "Published to Kafka"),
+                    ("failed", "Failed"),
+                    ("superseded", "Superseded by a newer command"),
+                ],
+                default="pending",
+                max_length=20,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="smsmessage",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("created", "Waiting for sending"),
+                    ("sent", "Sent"),
+                    ("success", "Success"),
+                    ("failed", "Failed"),
+                    ("superseded", "Superseded by a newer command"),
+                ],
+                default="created",
+                max_length=20,
+            ),
+        ),
+    ]
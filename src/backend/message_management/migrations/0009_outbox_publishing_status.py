@@ -0,0 +1,28 @@
+# Generated by Django 4.2.20 on 2026-10-17 14:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("message_management", "0008_superseded_status"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="outboxmessage",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "Waiting for publishing"),
+                    ("publishing", "Claimed by a relay"),
+                    ("dispatched", "Published to Kafka"),
+                    ("failed", "Failed"),
+                    ("superseded", "Superseded by a newer command"),
+                ],
+                default="pending",
+                max_length=20,
+            ),
+        ),
+    ]
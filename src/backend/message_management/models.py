@@ -1,7 +1,8 @@
 from django.db import models
+from django.utils.timezone import now
 
 from action_history.models import BarrierActionLog
-from core.constants import CHOICE_MAX_LENGTH, PHONE_MAX_LENGTH
+from core.constants import CHOICE_MAX_LENGTH, PHONE_MAX_LENGTH, STRING_MAX_LENGTH
 from core.validators import PhoneNumberValidator
 
 
@@ -24,6 +25,7 @@ class SMSMessage(models.Model):
         SENT = "sent", "Sent"
         SUCCESS = "success", "Success"
         FAILED = "failed", "Failed"
+        SUPERSEDED = "superseded", "Superseded by a newer command"
 
     phone = models.CharField(
         max_length=PHONE_MAX_LENGTH,
@@ -54,3 +56,35 @@ class SMSMessage(models.Model):
         related_name="sms_messages",
         help_text="Action that triggered this message, if applicable.",
     )
+
+
+class OutboxMessage(models.Model):
+    """
+    Kafka message written in the same transaction as the SMS it publishes.
+    The relay_outbox command claims pending rows, publishes them and marks them dispatched.
+    A claimed row is due again at next_attempt_at, so a relay that died while publishing does not lose it.
+    """
+
+    class Meta:
+        db_table = "sms_outbox"
+        indexes = [models.Index(fields=["status", "next_attempt_at"])]
+
+    class Status(models.TextChoices):
+        PENDING = "pending", "Waiting for publishing"
+        PUBLISHING = "publishing", "Claimed by a relay"
+        DISPATCHED = "dispatched", "Published to Kafka"
+        FAILED = "failed", "Failed"
+        SUPERSEDED = "superseded", "Superseded by a newer command"
+
+    message = models.ForeignKey(SMSMessage, on_delete=models.CASCADE, related_name="outbox_messages")
+    topic = models.CharField(max_length=STRING_MAX_LENGTH)
+    key = models.CharField(max_length=PHONE_MAX_LENGTH)
+    payload = models.JSONField()
+    status = models.CharField(max_length=CHOICE_MAX_LENGTH, choices=Status.choices, default=Status.PENDING)
+
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(null=True, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=now)
+    dispatched_at = models.DateTimeField(null=True, blank=True)
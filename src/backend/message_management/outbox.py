@@ -0,0 +1,225 @@
+import json
+import logging
+from datetime import datetime, timedelta
+from functools import partial
+
+from confluent_kafka import KafkaException, Producer
+from django.db import transaction
+from django.utils.timezone import now
+
+from message_management.constants import (
+    KAFKA_DELIVERY_TIMEOUT_MS,
+    KAFKA_SERVERS,
+    OUTBOX_BATCH_SIZE,
+    OUTBOX_CLAIM_TIMEOUT_SECONDS,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_RETRY_BASE_SECONDS,
+    OUTBOX_RETRY_MAX_SECONDS,
+)
+from message_management.enums import KafkaTopic, SMSPriority
+from message_management.kafka_producer import build_payload, mark_failed
+from message_management.models import OutboxMessage, SMSMessage
+
+logger = logging.getLogger(__name__)
+
+
+def supersede_pending_commands(message: SMSMessage, retry_of: SMSMessage | None = None) -> int:
+    """
+    Cancel the unpublished commands for the same device slot and phone number as the given phone command,
+    only the newest one decides the final state of the slot. Returns the number of cancelled commands.
+    A retry only cancels the commands older than the command it retries, the newer ones were decided after it.
+    """
+
+    phone = message.log.phone if message.log else None
+    if message.message_type != SMSMessage.MessageType.PHONE_COMMAND or phone is None:
+        return 0
+
+    # Rows claimed by a relay are being published, they can no longer be cancelled
+    pending = (
+        OutboxMessage.objects.select_for_update(skip_locked=True, of=("self",))
+        .filter(
+            status=OutboxMessage.Status.PENDING,
+            message__message_type=SMSMessage.MessageType.PHONE_COMMAND,
+            message__log__phone__barrier_id=phone.barrier_id,
+            message__log__phone__device_serial_number=phone.device_serial_number,
+            message__log__phone__phone=phone.phone,
+        )
+        .exclude(message=message)
+    )
+    if retry_of is not None:
+        pending = pending.filter(message_id__lt=retry_of.id)
+    outbox_ids = list(pending.values_list("id", flat=True))
+    if not outbox_ids:
+        return 0
+
+    OutboxMessage.objects.filter(id__in=outbox_ids).update(status=OutboxMessage.Status.SUPERSEDED)
+    superseded = SMSMessage.objects.filter(outbox_messages__id__in=outbox_ids).update(
+        status=SMSMessage.Status.SUPERSEDED,
+        failure_reason=f"Superseded by SMS {message.id}",
+        updated_at=now(),
+    )
+    logger.info("SMS %s superseded %d pending commands for slot %s", message.id, superseded, phone.device_serial_number)
+    return superseded
+
+
+def enqueue_sms(
+    topic: KafkaTopic,
+    message: SMSMessage,
+    priority: SMSPriority | None = None,
+    retry_of: SMSMessage | None = None,
+) -> OutboxMessage:
+    """
+    Write the message to the outbox, it is published by the relay once the surrounding transaction commits.
+    Older pending commands the message makes redundant are cancelled, for a retry older than the retried command.
+    The priority, if given, picks the send lane of the message in the SMS service.
+    """
+
+    supersede_pending_commands(message, retry_of)
+    return OutboxMessage.objects.create(
+        message=message,
+        topic=topic.value,
+        key=message.phone,
+        payload=build_payload(message, priority),
+    )
+
+
+class OutboxRelay:
+    """Publishes pending outbox rows to Kafka in batches and retries the failed ones with backoff."""
+
+    def __init__(
+        self,
+        batch_size: int = OUTBOX_BATCH_SIZE,
+        max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+        retry_base_seconds: float = OUTBOX_RETRY_BASE_SECONDS,
+        retry_max_seconds: float = OUTBOX_RETRY_MAX_SECONDS,
+        claim_timeout_seconds: float = OUTBOX_CLAIM_TIMEOUT_SECONDS,
+        producer: Producer | None = None,
+    ):
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.claim_timeout_seconds = claim_timeout_seconds
+        self.producer = producer or self._create_producer()
+
+    @staticmethod
+    def _create_producer() -> Producer:
+        # Not the shared producer, its delivery reports must be served by this relay's flush
+        return Producer(
+            {"bootstrap.servers": KAFKA_SERVERS, "message.timeout.ms": KAFKA_DELIVERY_TIMEOUT_MS, "linger.ms": 5}
+        )
+
+    def retry_delay(self, attempts: int) -> float:
+        return min(self.retry_base_seconds * 2 ** (attempts - 1), self.retry_max_seconds)
+
+    def relay_batch(self) -> int:
+        """
+        Publish one batch of due rows, returns the number of rows handled.
+        No transaction is open while waiting for Kafka, the rows are claimed before and recorded after.
+        """
+
+        rows, claimed_until = self._claim()
+        if not rows:
+            return 0
+
+        errors = self._publish(rows)
+        self._record(rows, errors, claimed_until)
+        return len(rows)
+
+    def _claim(self) -> tuple[list[OutboxMessage], datetime]:
+        """Mark a batch of due rows as publishing, including the rows of a relay whose claim expired."""
+
+        claimed_at = now()
+        claimed_until = claimed_at + timedelta(seconds=self.claim_timeout_seconds)
+        with transaction.atomic():
+            # Locked rows are being claimed by another relay, they are skipped instead of published twice
+            rows = list(
+                OutboxMessage.objects.select_for_update(skip_locked=True)
+                .filter(
+                    status__in=[OutboxMessage.Status.PENDING, OutboxMessage.Status.PUBLISHING],
+                    next_attempt_at__lte=claimed_at,
+                )
+                .order_by("id")[: self.batch_size]
+            )
+            for row in rows:
+                if row.status == OutboxMessage.Status.PUBLISHING:
+                    logger.warning("Claim of outbox message %s expired, publishing it again", row.id)
+                row.status = OutboxMessage.Status.PUBLISHING
+                row.next_attempt_at = claimed_until
+            OutboxMessage.objects.bulk_update(rows, ["status", "next_attempt_at"])
+        return rows, claimed_until
+
+    def _publish(self, rows: list[OutboxMessage]) -> dict[int, str | None]:
+        """Produce the rows and wait for their delivery reports, returns the error of every row or None."""
+
+        errors = {}
+
+        def on_delivery(row_id, err, msg):
+            errors[row_id] = str(err) if err is not None else None
+
+        for row in rows:
+            try:
+                self.producer.produce(
+                    topic=row.topic,
+                    key=row.key,
+                    value=json.dumps(row.payload),
+                    on_delivery=partial(on_delivery, row.id),
+                )
+            except (BufferError, KafkaException) as e:
+                errors[row.id] = str(e) or type(e).__name__
+
+        remaining = self.producer.flush(KAFKA_DELIVERY_TIMEOUT_MS / 1000)
+        if remaining:
+            logger.error("%d outbox messages are still waiting for their delivery report", remaining)
+        for row in rows:
+            errors.setdefault(row.id, "No delivery report from Kafka")
+        return errors
+
+    def _record(self, rows: list[OutboxMessage], errors: dict[int, str | None], claimed_until: datetime):
+        dispatched_at = now()
+
+        with transaction.atomic():
+            # A row claimed again after this relay's claim expired now belongs to the other relay
+            owned = set(
+                OutboxMessage.objects.select_for_update()
+                .filter(
+                    id__in=[row.id for row in rows],
+                    status=OutboxMessage.Status.PUBLISHING,
+                    next_attempt_at=claimed_until,
+                )
+                .values_list("id", flat=True)
+            )
+            rows = [row for row in rows if row.id in owned]
+            delivered = []
+            failed = []
+
+            for row in rows:
+                error = errors[row.id]
+                if error is None:
+                    row.status = OutboxMessage.Status.DISPATCHED
+                    row.dispatched_at = dispatched_at
+                    delivered.append(row.message_id)
+                    continue
+
+                row.attempts += 1
+                row.last_error = error
+                if row.attempts >= self.max_attempts:
+                    row.status = OutboxMessage.Status.FAILED
+                    failed.append(row.message_id)
+                else:
+                    row.status = OutboxMessage.Status.PENDING
+                    row.next_attempt_at = dispatched_at + timedelta(seconds=self.retry_delay(row.attempts))
+                logger.warning("Outbox message %s not published (attempt %d): %s", row.id, row.attempts, error)
+
+            OutboxMessage.objects.bulk_update(
+                rows, ["status", "attempts", "last_error", "next_attempt_at", "dispatched_at"]
+            )
+            # A reply can only come after the publish, but never overwrite a later status
+            SMSMessage.objects.filter(id__in=delivered, status=SMSMessage.Status.CREATED).update(
+                status=SMSMessage.Status.SENT, updated_at=dispatched_at
+            )
+            for message in SMSMessage.objects.filter(id__in=failed).select_related("log__phone"):
+                mark_failed(message, "Cannot connect to Kafka")
+
+        if delivered:
+            logger.info("Published %d outbox messages to Kafka", len(delivered))
@@ -1,14 +1,15 @@
 import logging
 import os
 
+from django.db import transaction
 from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
 
 from action_history.models import BarrierActionLog
 from barriers.models import Barrier
 from message_management.config_loader import build_message, get_phone_command, get_setting, load_barrier_settings
-from message_management.enums import KafkaTopic, PhoneCommand
-from message_management.kafka_producer import send_sms_to_kafka
+from message_management.enums import KafkaTopic, PhoneCommand, SMSPriority
 from message_management.models import SMSMessage
+from message_management.outbox import enqueue_sms
 from phones.models import BarrierPhone
 from verifications.models import Verification
 
@@ -23,20 +24,21 @@ class SMSService:
 
     @staticmethod
     def send_verification(verification: Verification):
-        message = SMSMessage.objects.create(
-            message_type=SMSMessage.MessageType.VERIFICATION_CODE,
-            content=f"CODE: {verification.code}",
-            phone=verification.phone,
-        )
-        send_sms_to_kafka(KafkaTopic.SMS_VERIFICATION, message)
+        with transaction.atomic():
+            message = SMSMessage.objects.create(
+                message_type=SMSMessage.MessageType.VERIFICATION_CODE,
+                content=f"CODE: {verification.code}",
+                phone=verification.phone,
+            )
+            enqueue_sms(KafkaTopic.SMS_VERIFICATION, message)
 
     @staticmethod
-    def send_add_phone_command(phone: BarrierPhone, log: BarrierActionLog):
-        SMSService._send_phone_command(phone, PhoneCommand.ADD, log)
+    def send_add_phone_command(phone: BarrierPhone, log: BarrierActionLog, priority: SMSPriority | None = None):
+        SMSService._send_phone_command(phone, PhoneCommand.ADD, log, priority)
 
     @staticmethod
-    def send_delete_phone_command(phone: BarrierPhone, log: BarrierActionLog):
-        SMSService._send_phone_command(phone, PhoneCommand.DELETE, log)
+    def send_delete_phone_command(phone: BarrierPhone, log: BarrierActionLog, priority: SMSPriority | None = None):
+        SMSService._send_phone_command(phone, PhoneCommand.DELETE, log, priority)
 
     @staticmethod
     def get_available_barrier_settings(barrier: Barrier) -> dict:
@@ -60,17 +62,20 @@ class SMSService:
             raise ValidationError({"detail": f"Missing required parameters for barrier setting: {', '.join(missing)}"})
         content = build_message(setting["template"], params)
 
-        message = SMSMessage.objects.create(
-            message_type=SMSMessage.MessageType.BARRIER_SETTING,
-            content=content,
-            phone=barrier.device_phone,
-            metadata=params,
-            log=log,
-        )
-        send_sms_to_kafka(KafkaTopic.SMS_CONFIGURATION, message)
+        with transaction.atomic():
+            message = SMSMessage.objects.create(
+                message_type=SMSMessage.MessageType.BARRIER_SETTING,
+                content=content,
+                phone=barrier.device_phone,
+                metadata=params,
+                log=log,
+            )
+            enqueue_sms(KafkaTopic.SMS_CONFIGURATION, message)
 
     @staticmethod
-    def _send_phone_command(phone: BarrierPhone, command: PhoneCommand, log: BarrierActionLog):
+    def _send_phone_command(
+        phone: BarrierPhone, command: PhoneCommand, log: BarrierActionLog, priority: SMSPriority | None = None
+    ):
         barrier = phone.barrier
 
         command_config = get_phone_command(barrier.device_model, command)
@@ -84,15 +89,16 @@ class SMSService:
             SMSMessage.PhoneCommandType.OPEN if command == PhoneCommand.ADD else SMSMessage.PhoneCommandType.CLOSE
         )
 
-        message = SMSMessage.objects.create(
-            message_type=SMSMessage.MessageType.PHONE_COMMAND,
-            content=content,
-            phone=barrier.device_phone,
-            metadata=params,
-            phone_command_type=phone_command_type,
-            log=log,
-        )
-        send_sms_to_kafka(KafkaTopic.SMS_CONFIGURATION, message)
+        with transaction.atomic():
+            message = SMSMessage.objects.create(
+                message_type=SMSMessage.MessageType.PHONE_COMMAND,
+                content=content,
+                phone=barrier.device_phone,
+                metadata=params,
+                phone_command_type=phone_command_type,
+                log=log,
+            )
+            enqueue_sms(KafkaTopic.SMS_CONFIGURATION, message, priority)
 
     @staticmethod
     def send_balance_check():
@@ -103,33 +109,35 @@ class SMSService:
 
         logger.info("Sending balance check")
 
-        message = SMSMessage.objects.create(
-            message_type=SMSMessage.MessageType.BALANCE_CHECK,
-            content=BALANCE_CHECK_CONTENT,  # this will not be used
-            phone=BALANCE_CHECK_PHONE,  # this will not be used
-        )
-        send_sms_to_kafka(KafkaTopic.SMS_BALANCE, message)
+        with transaction.atomic():
+            message = SMSMessage.objects.create(
+                message_type=SMSMessage.MessageType.BALANCE_CHECK,
+                content=BALANCE_CHECK_CONTENT,  # this will not be used
+                phone=BALANCE_CHECK_PHONE,  # this will not be used
+            )
+            enqueue_sms(KafkaTopic.SMS_BALANCE, message)
 
     @staticmethod
     def retry_sms(original: SMSMessage) -> SMSMessage:
         if original.message_type in [SMSMessage.MessageType.VERIFICATION_CODE, SMSMessage.MessageType.BALANCE_CHECK]:
             raise PermissionDenied("Cannot retry verification messages.")
 
-        message = SMSMessage.objects.create(
-            phone=original.phone,
-            message_type=original.message_type,
-            phone_command_type=original.phone_command_type,
-            content=original.content,
-            metadata=original.metadata,
-            log=original.log,
-        )
-
-        if message.message_type in [SMSMessage.MessageType.BARRIER_SETTING, SMSMessage.MessageType.PHONE_COMMAND]:
-            topic = KafkaTopic.SMS_CONFIGURATION
-        else:
-            raise PermissionDenied("Unsupported SMS type for retry.")
-
-        logger.info(f"Retrying SMS message {message.id} of type {message.message_type}")
-        send_sms_to_kafka(topic, message)
+        with transaction.atomic():
+            message = SMSMessage.objects.create(
+                phone=original.phone,
+                message_type=original.message_type,
+                phone_command_type=original.phone_command_type,
+                content=original.content,
+                metadata=original.metadata,
+                log=original.log,
+            )
+
+            if message.message_type in [SMSMessage.MessageType.BARRIER_SETTING, SMSMessage.MessageType.PHONE_COMMAND]:
+                topic = KafkaTopic.SMS_CONFIGURATION
+            else:
+                raise PermissionDenied("Unsupported SMS type for retry.")
+
+            logger.info(f"Retrying SMS message {message.id} of type {message.message_type}")
+            enqueue_sms(topic, message, retry_of=original)
 
         return message
@@ -1,12 +1,16 @@
 import json
+import os
+import re
 
 import pytest
+from django.core.exceptions import ImproperlyConfigured
 from rest_framework.exceptions import NotFound, ValidationError
 
 from barriers.models import Barrier
 from message_management.config_loader import (
     build_message,
     get_phone_command,
+    get_response_pattern,
     get_setting,
     load_barrier_settings,
     load_phone_commands,
@@ -84,6 +88,58 @@ class TestGetPhoneCommand:
             get_phone_command(Barrier.Model.RTU5025, PhoneCommand.ADD)
 
 
+@pytest.fixture
+def phone_config(tmp_path, monkeypatch):
+    path = tmp_path / "phone_commands.json"
+    monkeypatch.setattr("message_management.config_loader.PHONE_COMMANDS_PATH", str(path))
+
+    def write(command: dict, mtime: int = 1_000_000):
+        path.write_text(json.dumps({Barrier.Model.RTU5025: {PhoneCommand.ADD.value: command}}))
+        os.utime(path, (mtime, mtime))
+
+    return write
+
+
+class TestConfigRegistry:
+    def test_config_is_parsed_once(self, phone_config):
+        phone_config({"template": "{phone}", "response_pattern": "^OK"})
+
+        assert load_phone_commands() is load_phone_commands()
+
+    def test_changed_file_is_reloaded(self, phone_config):
+        phone_config({"template": "OLD {phone}", "response_pattern": "^OK"})
+        assert get_phone_command(Barrier.Model.RTU5025, PhoneCommand.ADD)["template"] == "OLD {phone}"
+
+        phone_config({"template": "NEW {phone}", "response_pattern": "^DONE"}, mtime=2_000_000)
+
+        assert get_phone_command(Barrier.Model.RTU5025, PhoneCommand.ADD)["template"] == "NEW {phone}"
+        assert get_response_pattern(Barrier.Model.RTU5025, PhoneCommand.ADD).pattern == "^DONE"
+
+    def test_response_pattern_is_compiled_once(self, phone_config):
+        phone_config({"template": "{phone}", "response_pattern": r"^\d{3}:OK"})
+
+        pattern = get_response_pattern(Barrier.Model.RTU5025, PhoneCommand.ADD)
+
+        assert isinstance(pattern, re.Pattern)
+        assert pattern.match("001:OK")
+        assert get_response_pattern(Barrier.Model.RTU5025, PhoneCommand.ADD) is pattern
+
+    @pytest.mark.parametrize(
+        "command, error",
+        [
+            ({"response_pattern": "^OK"}, "must have a string template"),
+            ({"template": "{phone", "response_pattern": "^OK"}, "invalid template"),
+            ({"template": "{phone}", "response_pattern": "(OK"}, "invalid response_pattern"),
+            ({"template": "{pwd}{phone}", "params": [{"key": "phone"}]}, "undeclared params: pwd"),
+        ],
+    )
+    def test_invalid_config_is_rejected(self, phone_config, command, error):
+        phone_config(command)
+
+        with pytest.raises(ImproperlyConfigured, match=error):
+            load_phone_commands()
+
+
 @pytest.mark.django_db
 class TestLoadBarrierSettings:
     def test_success(self):
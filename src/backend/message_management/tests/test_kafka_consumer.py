@@ -0,0 +1,151 @@
+import re
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from message_management.enums import KafkaTopic
+from message_management.kafka_consumer import KafkaConsumer, SMSMessageHandlers
+from message_management.kafka_retry import ATTEMPT_HEADER, RETRY_AT_HEADER
+from message_management.models import SMSMessage
+from message_management.tests.test_kafka_retry import make_message
+from phones.models import BarrierPhone
+
+
+@pytest.fixture
+def create_command(barrier_phone):
+    phone, log = barrier_phone
+
+    def _create_command(command_type=SMSMessage.PhoneCommandType.OPEN):
+        return SMSMessage.objects.create(
+            message_type=SMSMessage.MessageType.PHONE_COMMAND,
+            content="COMMAND",
+            phone=phone.barrier.device_phone,
+            phone_command_type=command_type,
+            log=log,
+        )
+
+    return _create_command
+
+
+@pytest.fixture
+def response_pattern():
+    with patch("message_management.kafka_consumer.get_response_pattern", return_value=re.compile("^OK")):
+        yield
+
+
+@pytest.mark.django_db
+class TestHandleBatch:
+    def test_responses_are_applied_with_few_queries(
+        self, create_command, response_pattern, django_assert_max_num_queries
+    ):
+        commands = [create_command() for _ in range(5)]
+        messages = [make_message({"message_id": sms.id, "content": "OK"}, offset=i) for i, sms in enumerate(commands)]
+
+        # One fetch and the two bulk updates, independent of the batch size
+        with django_assert_max_num_queries(5):
+            errors = SMSMessageHandlers.handle_response_messages(messages)
+
+        assert errors == [None] * 5
+        for sms in commands:
+            sms.refresh_from_db()
+            assert sms.status == SMSMessage.Status.SUCCESS
+            assert sms.response_content == "OK"
+        commands[0].log.phone.refresh_from_db()
+        assert commands[0].log.phone.access_state == BarrierPhone.AccessState.OPEN
+
+    def test_later_message_of_batch_wins_for_phone(self, create_command, response_pattern):
+        opened = create_command(SMSMessage.PhoneCommandType.OPEN)
+        closed = create_command(SMSMessage.PhoneCommandType.CLOSE)
+        messages = [
+            make_message({"message_id": opened.id, "content": "OK"}, offset=0),
+            make_message({"message_id": closed.id, "content": "OK"}, offset=1),
+        ]
+
+        SMSMessageHandlers.handle_response_messages(messages)
+
+        phone = BarrierPhone.objects.get(id=opened.log.phone.id)
+        assert phone.access_state == BarrierPhone.AccessState.CLOSED
+
+    def test_unknown_message_fails_alone(self, create_command, response_pattern):
+        sms = create_command()
+        messages = [
+            make_message({"message_id": 999999, "content": "OK"}, offset=0),
+            make_message({"message_id": sms.id, "content": "OK"}, offset=1),
+        ]
+
+        errors = SMSMessageHandlers.handle_response_messages(messages)
+
+        assert errors == ["Handler failed", None]
+        sms.refresh_from_db()
+        assert sms.status == SMSMessage.Status.SUCCESS
+
+    def test_failed_messages_mark_sms_and_phone(self, create_command):
+        sms = create_command(SMSMessage.PhoneCommandType.CLOSE)
+
+        errors = SMSMessageHandlers.handle_failed_messages([make_message({"message_id": sms.id, "content": "timeout"})])
+
+        assert errors == [None]
+        sms.refresh_from_db()
+        assert sms.status == SMSMessage.Status.FAILED
+        assert sms.response_content == "timeout"
+        sms.log.phone.refresh_from_db()
+        assert sms.log.phone.access_state == BarrierPhone.AccessState.ERROR_CLOSING
+
+
+class TestKafkaConsumerBatches:
+    @pytest.fixture
+    def consumer_mock(self):
+        with patch.object(KafkaConsumer, "_create_consumer") as mock_create_consumer:
+            yield mock_create_consumer.return_value
+
+    def run_once(self, consumer: KafkaConsumer, messages):
+        def consume(num_messages, timeout):
+            consumer.stop_event.set()
+            return messages
+
+        consumer.consumer.consume.side_effect = consume
+        consumer.start()
+
+    @patch("message_management.kafka_consumer.route_failure")
+    def test_batch_is_handled_together_and_committed_once(self, mock_route_failure, consumer_mock):
+        consumer = KafkaConsumer(KafkaTopic.SMS_RESPONSES, batch_size=10)
+        consumer.handler = MagicMock(return_value=[None, "Handler failed", None])
+        messages = [make_message({"message_id": i}, offset=i) for i in (4, 5, 6)]
+        messages[2].partition.return_value = 1
+
+        self.run_once(consumer, messages)
+
+        consumer.handler.assert_called_once_with(messages)
+        assert consumer_mock.consume.call_args.args[0] == 10
+        mock_route_failure.assert_called_once()
+        assert mock_route_failure.call_args.args[0] is messages[1]
+        consumer_mock.commit.assert_called_once()
+        offsets = consumer_mock.commit.call_args.kwargs["offsets"]
+        assert sorted((tp.partition, tp.offset) for tp in offsets) == [(0, 6), (1, 7)]
+
+    @patch("message_management.kafka_consumer.route_failure")
+    def test_handler_error_routes_whole_batch(self, mock_route_failure, consumer_mock):
+        consumer = KafkaConsumer(KafkaTopic.SMS_RESPONSES)
+        consumer.handler = MagicMock(side_effect=RuntimeError("database is down"))
+        messages = [make_message({"message_id": i}, offset=i) for i in (1, 2)]
+
+        self.run_once(consumer, messages)
+
+        assert [call.args[1] for call in mock_route_failure.call_args_list] == ["database is down"] * 2
+        consumer_mock.commit.assert_called_once()
+
+    def test_retry_batch_stops_at_first_message_not_due(self, consumer_mock):
+        consumer = KafkaConsumer(KafkaTopic.SMS_RESPONSES, retry_hop=1)
+        consumer.handler = MagicMock(return_value=[None])
+        due = make_message({"message_id": 1}, topic="sms_responses_retry_1", offset=3)
+        not_due_headers = {ATTEMPT_HEADER: "1", RETRY_AT_HEADER: str(time.time() + 60)}
+        not_due = make_message({"message_id": 2}, topic="sms_responses_retry_1", headers=not_due_headers, offset=4)
+        after = make_message({"message_id": 3}, topic="sms_responses_retry_1", offset=5)
+
+        self.run_once(consumer, [due, not_due, after])
+
+        consumer.handler.assert_called_once_with([due])
+        assert consumer_mock.seek.call_args.args[0].offset == 4
+        offsets = consumer_mock.commit.call_args.kwargs["offsets"]
+        assert [(tp.partition, tp.offset) for tp in offsets] == [(0, 4)]
@@ -1,88 +1,80 @@
-import json
-from unittest.mock import patch
-
 import pytest
-from confluent_kafka import KafkaException
 from django.utils import timezone
-from rest_framework.exceptions import APIException
 
-from message_management.enums import KafkaTopic
-from message_management.kafka_producer import send_sms_to_kafka
+from action_history.models import BarrierActionLog
+from message_management.enums import SMSPriority
+from message_management.kafka_producer import build_payload, mark_failed
 from message_management.models import SMSMessage
 from phones.models import BarrierPhone
 
 
-@pytest.mark.django_db
-class TestKafkaProducer:
-
-    @pytest.fixture
-    def sms_message(self):
-        return SMSMessage.objects.create(
-            message_type=SMSMessage.MessageType.VERIFICATION_CODE,
-            content="Test message",
-            phone="+71234567890",
-        )
+@pytest.fixture
+def sms_message():
+    return SMSMessage.objects.create(
+        message_type=SMSMessage.MessageType.VERIFICATION_CODE,
+        content="Test message",
+        phone="+71234567890",
+    )
 
-    @patch("message_management.kafka_producer.get_producer")
-    def test_send_sms_success(self, mock_get_producer, sms_message):
-        producer_mock = mock_get_producer.return_value
-        producer_mock.flush.return_value = 0
 
-        send_sms_to_kafka(KafkaTopic.SMS_VERIFICATION, sms_message)
+@pytest.fixture
+def open_command(barrier_phone):
+    phone, log = barrier_phone
+    return SMSMessage.objects.create(
+        message_type=SMSMessage.MessageType.PHONE_COMMAND,
+        content="OPEN GATE",
+        phone=phone.barrier.device_phone,
+        phone_command_type=SMSMessage.PhoneCommandType.OPEN,
+        log=log,
+    )
 
-        sms_message.refresh_from_db()
-        assert sms_message.status == SMSMessage.Status.SENT
-        assert sms_message.updated_at <= timezone.now()
 
-        producer_mock.produce.assert_called_once()
-        args, kwargs = producer_mock.produce.call_args
+@pytest.mark.django_db
+class TestBuildPayload:
 
-        assert kwargs["topic"] == KafkaTopic.SMS_VERIFICATION.value
-        assert kwargs["key"] == sms_message.phone
-        payload = json.loads(kwargs["value"])
-        assert payload == {
+    def test_payload(self, sms_message):
+        assert build_payload(sms_message) == {
             "message_id": sms_message.id,
             "phone": sms_message.phone,
             "content": sms_message.content,
             "retries": 5,
         }
 
-        producer_mock.flush.assert_called_once()
+    def test_payload_includes_device_model(self, sms_message, barrier):
+        sms_message.log = BarrierActionLog.objects.create(
+            barrier=barrier,
+            author=BarrierActionLog.Author.ADMIN,
+            action_type=BarrierActionLog.ActionType.ADD_PHONE,
+            reason=BarrierActionLog.Reason.MANUAL,
+        )
+        sms_message.save()
+
+        assert build_payload(sms_message)["device_model"] == barrier.device_model
 
-    @patch("message_management.kafka_producer.get_producer")
-    def test_send_sms_flush_fails(self, mock_get_producer, sms_message):
-        mock_get_producer.return_value.flush.return_value = 1
+    def test_payload_includes_priority(self, sms_message):
+        assert "priority" not in build_payload(sms_message)
+        assert build_payload(sms_message, SMSPriority.BULK)["priority"] == "bulk"
 
-        with pytest.raises(APIException) as exc_info:
-            send_sms_to_kafka(KafkaTopic.SMS_VERIFICATION, sms_message)
+
+@pytest.mark.django_db
+class TestMarkFailed:
+
+    def test_marks_message_failed(self, sms_message):
+        mark_failed(sms_message, "Cannot connect to Kafka")
 
         sms_message.refresh_from_db()
         assert sms_message.status == SMSMessage.Status.FAILED
         assert sms_message.failure_reason == "Cannot connect to Kafka"
-        assert "Cannot send SMS" in str(exc_info.value)
-
-    @patch("message_management.kafka_producer.get_producer")
-    def test_status_update_on_open_command(self, mock_get_producer, barrier_phone):
-        phone, log = barrier_phone
-        mock_get_producer.return_value.flush.return_value = 1
-        sms = SMSMessage.objects.create(
-            message_type=SMSMessage.MessageType.PHONE_COMMAND,
-            content="OPEN GATE",
-            phone=phone.barrier.device_phone,
-            phone_command_type=SMSMessage.PhoneCommandType.OPEN,
-            log=log,
-        )
+        assert sms_message.updated_at <= timezone.now()
 
-        with pytest.raises(Exception):
-            send_sms_to_kafka(KafkaTopic.SMS_CONFIGURATION, sms)
+    def test_status_update_on_open_command(self, open_command):
+        mark_failed(open_command, "Cannot connect to Kafka")
 
-        phone.refresh_from_db()
-        assert phone.access_state == BarrierPhone.AccessState.ERROR_OPENING
+        open_command.log.phone.refresh_from_db()
+        assert open_command.log.phone.access_state == BarrierPhone.AccessState.ERROR_OPENING
 
-    @patch("message_management.kafka_producer.get_producer")
-    def test_status_update_on_close_command(self, mock_get_producer, barrier_phone):
+    def test_status_update_on_close_command(self, barrier_phone):
         phone, log = barrier_phone
-        mock_get_producer.return_value.flush.return_value = 1
         sms = SMSMessage.objects.create(
             message_type=SMSMessage.MessageType.PHONE_COMMAND,
             content="CLOSE GATE",
@@ -91,35 +83,7 @@ class TestKafkaProducer:
             log=log,
         )
 
-        with pytest.raises(Exception):
-            send_sms_to_kafka(KafkaTopic.SMS_CONFIGURATION, sms)
+        mark_failed(sms, "Cannot connect to Kafka")
 
         phone.refresh_from_db()
         assert phone.access_state == BarrierPhone.AccessState.ERROR_CLOSING
-
-    @patch("message_management.kafka_producer.get_producer")
-    def test_producer_buffer_error(self, mock_get_producer, sms_message):
-        producer_mock = mock_get_producer.return_value
-        producer_mock.produce.side_effect = BufferError("Queue full")
-
-        send_sms_to_kafka(KafkaTopic.SMS_VERIFICATION, sms_message)
-
-        producer_mock.flush.assert_not_called()
-
-    @patch("message_management.kafka_producer.get_producer")
-    def test_producer_kafka_exception(self, mock_get_producer, sms_message):
-        producer_mock = mock_get_producer.return_value
-        producer_mock.produce.side_effect = KafkaException("Kafka down")
-
-        send_sms_to_kafka(KafkaTopic.SMS_VERIFICATION, sms_message)
-
-        producer_mock.flush.assert_not_called()
-
-    @patch("message_management.kafka_producer.get_producer")
-    def test_producer_unexpected_exception(self, mock_get_producer, sms_message):
-        producer_mock = mock_get_producer.return_value
-        producer_mock.produce.side_effect = RuntimeError("Unexpected error")
-
-        send_sms_to_kafka(KafkaTopic.SMS_VERIFICATION, sms_message)
-
-        producer_mock.flush.assert_not_called()
@@ -0,0 +1,147 @@
+import json
+import time
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from message_management.enums import KafkaTopic
+from message_management.kafka_consumer import KafkaConsumer
+from message_management.kafka_retry import (
+    ATTEMPT_HEADER,
+    LAST_ERROR_HEADER,
+    ORIGINAL_TOPIC_HEADER,
+    RETRY_AT_HEADER,
+    get_attempt,
+    route_failure,
+)
+
+
+def make_message(payload: dict, topic: str = "sms_responses", headers: dict | None = None, offset: int = 0):
+    message = MagicMock()
+    message.value.return_value = json.dumps(payload).encode("utf-8")
+    message.key.return_value = b"+71234567890"
+    message.topic.return_value = topic
+    message.partition.return_value = 0
+    message.offset.return_value = offset
+    message.error.return_value = None
+    message.headers.return_value = [(key, value.encode("utf-8")) for key, value in (headers or {}).items()]
+    return message
+
+
+@pytest.fixture
+def producer():
+    with patch("message_management.kafka_retry.get_producer") as mock_get_producer:
+        producer_mock = mock_get_producer.return_value
+        producer_mock.flush.return_value = 0
+        yield producer_mock
+
+
+class TestRouteFailure:
+    def test_first_failure_goes_to_first_retry_topic(self, producer):
+        message = make_message({"message_id": 1})
+
+        target = route_failure(message, "Handler failed", [30, 300])
+
+        assert target == "sms_responses_retry_1"
+        kwargs = producer.produce.call_args.kwargs
+        assert kwargs["topic"] == "sms_responses_retry_1"
+        assert kwargs["value"] == message.value()
+        assert kwargs["headers"][ATTEMPT_HEADER] == "1"
+        assert kwargs["headers"][LAST_ERROR_HEADER] == "Handler failed"
+        assert kwargs["headers"][ORIGINAL_TOPIC_HEADER] == "sms_responses"
+        assert float(kwargs["headers"][RETRY_AT_HEADER]) >= time.time() + 29
+
+    def test_retry_message_goes_to_next_retry_topic(self, producer):
+        headers = {ATTEMPT_HEADER: "1", ORIGINAL_TOPIC_HEADER: "sms_responses"}
+        message = make_message({"message_id": 1}, topic="sms_responses_retry_1", headers=headers)
+
+        assert get_attempt(message) == 1
+        assert route_failure(message, "Handler failed", [30, 300]) == "sms_responses_retry_2"
+        assert producer.produce.call_args.kwargs["headers"][ATTEMPT_HEADER] == "2"
+
+    def test_last_attempt_goes_to_dead_letter_topic(self, producer):
+        headers = {ATTEMPT_HEADER: "2", ORIGINAL_TOPIC_HEADER: "sms_responses"}
+        message = make_message({"message_id": 1}, topic="sms_responses_retry_2", headers=headers)
+
+        assert route_failure(message, "Handler failed", [30, 300]) == "sms_responses_dlq"
+        assert RETRY_AT_HEADER not in producer.produce.call_args.kwargs["headers"]
+
+    def test_payload_retries_cap_attempts(self, producer):
+        message = make_message({"message_id": 1, "retries": 1})
+
+        assert route_failure(message, "Handler failed", [30, 300]) == "sms_responses_dlq"
+
+    def test_undelivered_failure_raises(self, producer):
+        producer.flush.return_value = 1
+
+        with pytest.raises(ConnectionError):
+            route_failure(make_message({"message_id": 1}), "Handler failed", [30, 300])
+
+
+class TestKafkaConsumerRetries:
+    @pytest.fixture
+    def consumer_mock(self):
+        with patch.object(KafkaConsumer, "_create_consumer") as mock_create_consumer:
+            yield mock_create_consumer.return_value
+
+    def run_once(self, consumer: KafkaConsumer, message):
+        def consume(num_messages, timeout):
+            consumer.stop_event.set()
+            return [message]
+
+        consumer.consumer.consume.side_effect = consume
+        consumer.start()
+
+    @staticmethod
+    def committed_offsets(consumer_mock) -> list[tuple[int, int]]:
+        consumer_mock.commit.assert_called_once()
+        return [(tp.partition, tp.offset) for tp in consumer_mock.commit.call_args.kwargs["offsets"]]
+
+    @patch("message_management.kafka_consumer.route_failure")
+    def test_failed_message_is_routed_and_committed(self, mock_route_failure, consumer_mock):
+        consumer = KafkaConsumer(KafkaTopic.SMS_RESPONSES)
+        consumer.handler = MagicMock(return_value=["Handler failed"])
+        message = make_message({"message_id": 1})
+
+        self.run_once(consumer, message)
+
+        mock_route_failure.assert_called_once()
+        assert mock_route_failure.call_args.args[:2] == (message, "Handler failed")
+        assert self.committed_offsets(consumer_mock) == [(0, 1)]
+
+    @patch("message_management.kafka_consumer.route_failure")
+    def test_handler_exception_is_routed_with_error(self, mock_route_failure, consumer_mock):
+        consumer = KafkaConsumer(KafkaTopic.SMS_RESPONSES)
+        consumer.handler = MagicMock(side_effect=ValueError("bad payload"))
+        message = make_message({"message_id": 1})
+
+        self.run_once(consumer, message)
+
+        assert mock_route_failure.call_args.args[1] == "bad payload"
+        assert self.committed_offsets(consumer_mock) == [(0, 1)]
+
+    @patch("message_management.kafka_consumer.route_failure")
+    def test_successful_message_is_committed_without_retry(self, mock_route_failure, consumer_mock):
+        consumer = KafkaConsumer(KafkaTopic.SMS_RESPONSES)
+        consumer.handler = MagicMock(return_value=[None])
+        message = make_message({"message_id": 1})
+
+        self.run_once(consumer, message)
+
+        mock_route_failure.assert_not_called()
+        assert self.committed_offsets(consumer_mock) == [(0, 1)]
+
+    def test_retry_consumer_waits_until_message_is_due(self, consumer_mock):
+        consumer = KafkaConsumer(KafkaTopic.SMS_RESPONSES, retry_hop=1)
+        consumer.handler = MagicMock(return_value=[None])
+        headers = {ATTEMPT_HEADER: "1", RETRY_AT_HEADER: str(time.time() + 60)}
+        message = make_message({"message_id": 1}, topic="sms_responses_retry_1", headers=headers, offset=7)
+
+        self.run_once(consumer, message)
+
+        assert consumer.topic_name == "sms_responses_retry_1"
+        consumer.handler.assert_not_called()
+        consumer_mock.commit.assert_not_called()
+        consumer_mock.pause.assert_called_once()
+        assert consumer_mock.seek.call_args.args[0].offset == 7
+        assert 0 in consumer.waiting
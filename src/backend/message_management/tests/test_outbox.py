@@ -0,0 +1,293 @@
+import json
+from datetime import timedelta
+
+import pytest
+from confluent_kafka import KafkaError, KafkaException
+from django.core.management import call_command
+from django.utils import timezone
+
+from action_history.models import BarrierActionLog
+from message_management.enums import KafkaTopic
+from message_management.models import OutboxMessage, SMSMessage
+from message_management.outbox import OutboxRelay, enqueue_sms
+from message_management.services import SMSService
+from phones.models import BarrierPhone
+
+
+class FakeProducer:
+    """Serves the delivery reports on flush, failing the keys listed in fail_keys."""
+
+    def __init__(self, fail_keys=(), produce_error=None):
+        self.fail_keys = set(fail_keys)
+        self.produce_error = produce_error
+        self.produced = []
+        self.pending = []
+
+    def produce(self, topic, key, value, on_delivery):
+        if self.produce_error:
+            raise self.produce_error
+        self.produced.append((topic, key, json.loads(value)))
+        self.pending.append((key, on_delivery))
+
+    def flush(self, timeout=None):
+        for key, on_delivery in self.pending:
+            on_delivery(KafkaError(KafkaError._MSG_TIMED_OUT) if key in self.fail_keys else None, None)
+        self.pending = []
+        return 0
+
+
+@pytest.fixture
+def sms_message():
+    return SMSMessage.objects.create(
+        message_type=SMSMessage.MessageType.VERIFICATION_CODE,
+        content="CODE: 1234",
+        phone="+71234567890",
+    )
+
+
+@pytest.fixture
+def open_command(barrier_phone):
+    phone, log = barrier_phone
+    return SMSMessage.objects.create(
+        message_type=SMSMessage.MessageType.PHONE_COMMAND,
+        content="OPEN GATE",
+        phone=phone.barrier.device_phone,
+        phone_command_type=SMSMessage.PhoneCommandType.OPEN,
+        log=log,
+    )
+
+
+@pytest.mark.django_db
+class TestEnqueueSms:
+    def test_enqueue_writes_payload(self, sms_message):
+        row = enqueue_sms(KafkaTopic.SMS_VERIFICATION, sms_message)
+
+        assert row.status == OutboxMessage.Status.PENDING
+        assert row.topic == KafkaTopic.SMS_VERIFICATION.value
+        assert row.key == sms_message.phone
+        assert row.payload == {
+            "message_id": sms_message.id,
+            "phone": sms_message.phone,
+            "content": sms_message.content,
+            "retries": 5,
+        }
+
+    def test_service_writes_outbox_with_message(self, create_verification):
+        SMSService.send_verification(create_verification())
+
+        message = SMSMessage.objects.get(message_type=SMSMessage.MessageType.VERIFICATION_CODE)
+        row = OutboxMessage.objects.get()
+        assert row.message == message
+        assert message.status == SMSMessage.Status.CREATED
+
+
+@pytest.mark.django_db
+class TestOutboxRelay:
+    def test_relay_publishes_and_marks_dispatched(self, sms_message):
+        enqueue_sms(KafkaTopic.SMS_VERIFICATION, sms_message)
+        producer = FakeProducer()
+
+        assert OutboxRelay(producer=producer).relay_batch() == 1
+
+        [(topic, key, payload)] = producer.produced
+        assert (topic, key) == (KafkaTopic.SMS_VERIFICATION.value, sms_message.phone)
+        assert payload["message_id"] == sms_message.id
+        row = OutboxMessage.objects.get()
+        assert row.status == OutboxMessage.Status.DISPATCHED
+        assert row.dispatched_at is not None
+        sms_message.refresh_from_db()
+        assert sms_message.status == SMSMessage.Status.SENT
+
+    def test_relay_publishes_in_batches(self, sms_message):
+        for _ in range(3):
+            enqueue_sms(KafkaTopic.SMS_VERIFICATION, sms_message)
+        relay = OutboxRelay(batch_size=2, producer=FakeProducer())
+
+        assert relay.relay_batch() == 2
+        assert relay.relay_batch() == 1
+        assert relay.relay_batch() == 0
+        assert not OutboxMessage.objects.filter(status=OutboxMessage.Status.PENDING).exists()
+
+    def test_failed_publish_is_retried_later(self, sms_message):
+        enqueue_sms(KafkaTopic.SMS_VERIFICATION, sms_message)
+        relay = OutboxRelay(retry_base_seconds=10, producer=FakeProducer(fail_keys={sms_message.phone}))
+
+        relay.relay_batch()
+
+        row = OutboxMessage.objects.get()
+        assert row.status == OutboxMessage.Status.PENDING
+        assert row.attempts == 1
+        assert row.last_error
+        assert row.next_attempt_at > timezone.now() + timedelta(seconds=5)
+        assert relay.relay_batch() == 0
+        sms_message.refresh_from_db()
+        assert sms_message.status == SMSMessage.Status.CREATED
+
+    def test_produce_error_counts_as_failed_attempt(self, sms_message):
+        enqueue_sms(KafkaTopic.SMS_VERIFICATION, sms_message)
+
+        OutboxRelay(producer=FakeProducer(produce_error=BufferError("Queue full"))).relay_batch()
+
+        row = OutboxMessage.objects.get()
+        assert row.attempts == 1
+        assert row.last_error == "Queue full"
+
+    def test_last_attempt_fails_message_and_phone(self, open_command):
+        row = enqueue_sms(KafkaTopic.SMS_CONFIGURATION, open_command)
+        OutboxMessage.objects.filter(id=row.id).update(attempts=4)
+
+        OutboxRelay(max_attempts=5, producer=FakeProducer(produce_error=KafkaException("Kafka down"))).relay_batch()
+
+        row.refresh_from_db()
+        assert row.status == OutboxMessage.Status.FAILED
+        open_command.refresh_from_db()
+        assert open_command.status == SMSMessage.Status.FAILED
+        assert open_command.failure_reason == "Cannot connect to Kafka"
+        open_command.log.phone.refresh_from_db()
+        assert open_command.log.phone.access_state == BarrierPhone.AccessState.ERROR_OPENING
+
+    def test_delivery_keeps_later_status(self, sms_message):
+        enqueue_sms(KafkaTopic.SMS_VERIFICATION, sms_message)
+        SMSMessage.objects.filter(id=sms_message.id).update(status=SMSMessage.Status.SUCCESS)
+
+        OutboxRelay(producer=FakeProducer()).relay_batch()
+
+        sms_message.refresh_from_db()
+        assert sms_message.status == SMSMessage.Status.SUCCESS
+
+    def test_rows_are_claimed_while_publishing(self, sms_message):
+        row = enqueue_sms(KafkaTopic.SMS_VERIFICATION, sms_message)
+        statuses = []
+
+        class ClaimCheckingProducer(FakeProducer):
+            def flush(self, timeout=None):
+                statuses.append(OutboxMessage.objects.get(id=row.id).status)
+                return super().flush(timeout)
+
+        OutboxRelay(producer=ClaimCheckingProducer()).relay_batch()
+
+        assert statuses == [OutboxMessage.Status.PUBLISHING]
+        assert OutboxMessage.objects.get().status == OutboxMessage.Status.DISPATCHED
+
+    def test_claimed_rows_are_not_relayed_twice(self, sms_message):
+        row = enqueue_sms(KafkaTopic.SMS_VERIFICATION, sms_message)
+        relay = OutboxRelay(producer=FakeProducer())
+
+        relay._claim()
+
+        assert relay.relay_batch() == 0
+        assert OutboxMessage.objects.get(id=row.id).status == OutboxMessage.Status.PUBLISHING
+
+    def test_expired_claim_is_relayed_again(self, sms_message):
+        enqueue_sms(KafkaTopic.SMS_VERIFICATION, sms_message)
+        OutboxRelay(claim_timeout_seconds=-1, producer=FakeProducer())._claim()
+        producer = FakeProducer()
+
+        assert OutboxRelay(producer=producer).relay_batch() == 1
+
+        assert len(producer.produced) == 1
+        assert OutboxMessage.objects.get().status == OutboxMessage.Status.DISPATCHED
+
+    def test_result_of_expired_claim_is_not_recorded(self, sms_message):
+        row = enqueue_sms(KafkaTopic.SMS_VERIFICATION, sms_message)
+        relay = OutboxRelay(producer=FakeProducer())
+        rows, claimed_until = relay._claim()
+        OutboxMessage.objects.filter(id=row.id).update(next_attempt_at=claimed_until + timedelta(seconds=1))
+
+        relay._record(rows, {row.id: None}, claimed_until)
+
+        assert OutboxMessage.objects.get().status == OutboxMessage.Status.PUBLISHING
+        sms_message.refresh_from_db()
+        assert sms_message.status == SMSMessage.Status.CREATED
+
+    def test_command_relays_once(self, sms_message, monkeypatch):
+        enqueue_sms(KafkaTopic.SMS_VERIFICATION, sms_message)
+        monkeypatch.setattr(OutboxRelay, "_create_producer", staticmethod(FakeProducer))
+        monkeypatch.setattr("message_management.management.commands.relay_outbox.signal.signal", lambda *args: None)
+
+        call_command("relay_outbox", "--once")
+
+        assert OutboxMessage.objects.get().status == OutboxMessage.Status.DISPATCHED
+
+
+@pytest.mark.django_db
+class TestSupersedePendingCommands:
+    def test_newer_command_supersedes_pending_one(self, barrier_phone):
+        phone, log = barrier_phone
+        SMSService.send_add_phone_command(phone, log)
+        SMSService.send_delete_phone_command(phone, log)
+
+        opened, closed = SMSMessage.objects.order_by("id")
+        assert opened.status == SMSMessage.Status.SUPERSEDED
+        assert opened.failure_reason == f"Superseded by SMS {closed.id}"
+        assert closed.status == SMSMessage.Status.CREATED
+
+        producer = FakeProducer()
+        OutboxRelay(producer=producer).relay_batch()
+
+        assert [payload["message_id"] for _, _, payload in producer.produced] == [closed.id]
+        assert OutboxMessage.objects.get(message=opened).status == OutboxMessage.Status.SUPERSEDED
+
+    def test_claimed_command_is_not_superseded(self, barrier_phone):
+        phone, log = barrier_phone
+        SMSService.send_add_phone_command(phone, log)
+        OutboxRelay(producer=FakeProducer())._claim()
+
+        SMSService.send_delete_phone_command(phone, log)
+
+        assert not SMSMessage.objects.filter(status=SMSMessage.Status.SUPERSEDED).exists()
+
+    def test_published_command_is_not_superseded(self, barrier_phone):
+        phone, log = barrier_phone
+        SMSService.send_add_phone_command(phone, log)
+        OutboxRelay(producer=FakeProducer()).relay_batch()
+
+        SMSService.send_delete_phone_command(phone, log)
+
+        opened, closed = SMSMessage.objects.order_by("id")
+        assert opened.status == SMSMessage.Status.SENT
+        assert closed.status == SMSMessage.Status.CREATED
+
+    def test_retry_keeps_newer_pending_command(self, barrier_phone):
+        phone, log = barrier_phone
+        SMSService.send_add_phone_command(phone, log)
+        opened = SMSMessage.objects.get()
+        OutboxMessage.objects.filter(message=opened).update(status=OutboxMessage.Status.FAILED)
+        SMSMessage.objects.filter(id=opened.id).update(status=SMSMessage.Status.FAILED)
+        SMSService.send_delete_phone_command(phone, log)
+
+        retried = SMSService.retry_sms(opened)
+
+        closed = SMSMessage.objects.get(phone_command_type=SMSMessage.PhoneCommandType.CLOSE)
+        assert closed.status == SMSMessage.Status.CREATED
+        assert OutboxMessage.objects.get(message=closed).status == OutboxMessage.Status.PENDING
+        assert OutboxMessage.objects.get(message=retried).status == OutboxMessage.Status.PENDING
+
+    def test_other_phone_on_same_slot_is_kept(self, barrier_phone):
+        phone, log = barrier_phone
+        SMSService.send_delete_phone_command(phone, log)
+        other = BarrierPhone.objects.create(
+            user=phone.user,
+            barrier=phone.barrier,
+            phone="+79990000000",
+            type=phone.type,
+            device_serial_number=phone.device_serial_number,
+        )
+        other_log = BarrierActionLog.objects.create(
+            phone=other,
+            barrier=other.barrier,
+            author=log.author,
+            action_type=log.action_type,
+            reason=log.reason,
+        )
+
+        SMSService.send_add_phone_command(other, other_log)
+
+        assert not SMSMessage.objects.filter(status=SMSMessage.Status.SUPERSEDED).exists()
+        assert OutboxMessage.objects.filter(status=OutboxMessage.Status.PENDING).count() == 2
+
+    def test_other_messages_are_not_coalesced(self, sms_message):
+        enqueue_sms(KafkaTopic.SMS_VERIFICATION, sms_message)
+        enqueue_sms(KafkaTopic.SMS_VERIFICATION, sms_message)
+
+        assert OutboxMessage.objects.filter(status=OutboxMessage.Status.PENDING).count() == 2
@@ -11,7 +11,7 @@ from message_management.services import BALANCE_CHECK_CONTENT, BALANCE_CHECK_PHO
 
 @pytest.mark.django_db
 class TestSendVerification:
-    @patch("message_management.services.send_sms_to_kafka")
+    @patch("message_management.services.enqueue_sms")
     def test_send_verification_success(self, mock_send_sms, create_verification):
         verification = create_verification()
         SMSService.send_verification(verification)
@@ -24,7 +24,7 @@ class TestSendVerification:
 
 @pytest.mark.django_db
 class TestSendAddPhoneCommand:
-    @patch("message_management.services.send_sms_to_kafka")
+    @patch("message_management.services.enqueue_sms")
     @patch("message_management.services.build_message", return_value="ADD_COMMAND")
     @patch("message_management.services.get_phone_command")
     def test_send_add_phone_command_success(self, mock_get_command, mock_build_message, mock_send_sms, barrier_phone):
@@ -35,7 +35,7 @@ class TestSendAddPhoneCommand:
 
         message = SMSMessage.objects.get(message_type=SMSMessage.MessageType.PHONE_COMMAND)
 
-        mock_send_sms.assert_called_once_with(KafkaTopic.SMS_CONFIGURATION, message)
+        mock_send_sms.assert_called_once_with(KafkaTopic.SMS_CONFIGURATION, message, None)
         mock_get_command.assert_called_once_with(phone.barrier.device_model, PhoneCommand.ADD)
         mock_build_message.assert_called_once()
         assert message.content == "ADD_COMMAND"
@@ -45,7 +45,7 @@ class TestSendAddPhoneCommand:
 
 @pytest.mark.django_db
 class TestSendDeletePhoneCommand:
-    @patch("message_management.services.send_sms_to_kafka")
+    @patch("message_management.services.enqueue_sms")
     @patch("message_management.services.build_message", return_value="DEL_COMMAND")
     @patch("message_management.services.get_phone_command")
     def test_send_delete_phone_command_success(
@@ -58,7 +58,7 @@ class TestSendDeletePhoneCommand:
 
         message = SMSMessage.objects.get(message_type=SMSMessage.MessageType.PHONE_COMMAND)
 
-        mock_send_sms.assert_called_once_with(KafkaTopic.SMS_CONFIGURATION, message)
+        mock_send_sms.assert_called_once_with(KafkaTopic.SMS_CONFIGURATION, message, None)
         mock_get_command.assert_called_once_with(phone.barrier.device_model, PhoneCommand.DELETE)
         mock_build_message.assert_called_once()
         assert message.content == "DEL_COMMAND"
@@ -89,7 +89,7 @@ class TestSendBarrierSetting:
             action_type=BarrierActionLog.ActionType.BARRIER_SETTING,
         )
 
-    @patch("message_management.services.send_sms_to_kafka")
+    @patch("message_management.services.enqueue_sms")
     @patch("message_management.services.get_setting")
     def test_send_barrier_setting_success(self, mock_get_setting, mock_send_sms, barrier, log_entry):
         mock_get_setting.return_value = {"template": "{pwd}CMD", "params": [{"key": "pwd"}]}
@@ -121,7 +121,7 @@ class TestSendBarrierSetting:
 
 @pytest.mark.django_db
 class TestSendBalanceCheck:
-    @patch("message_management.services.send_sms_to_kafka")
+    @patch("message_management.services.enqueue_sms")
     def test_send_balance_check_success(self, mock_send_sms):
         SMSService.send_balance_check()
 
@@ -147,7 +147,6 @@ class TestRetrySMSMessage:
             log=sms_log,
         )
 
-    @patch("message_management.services.send_sms_to_kafka")
     @pytest.fixture
     def sms_log(self, barrier):
         return BarrierActionLog.objects.create(
@@ -156,7 +155,7 @@ class TestRetrySMSMessage:
             action_type=BarrierActionLog.ActionType.ADD_PHONE,
         )
 
-    @patch("message_management.services.send_sms_to_kafka")
+    @patch("message_management.services.enqueue_sms")
     def test_retry_phone_command_success(self, mock_send_sms, original_sms):
         new_sms = SMSService.retry_sms(original_sms)
 
@@ -168,7 +167,7 @@ class TestRetrySMSMessage:
         assert new_sms.log == original_sms.log
         assert new_sms.phone_command_type == original_sms.phone_command_type
 
-        mock_send_sms.assert_called_once_with(KafkaTopic.SMS_CONFIGURATION, new_sms)
+        mock_send_sms.assert_called_once_with(KafkaTopic.SMS_CONFIGURATION, new_sms, retry_of=original_sms)
 
     def test_retry_verification_forbidden(self):
         sms = SMSMessage(message_type=SMSMessage.MessageType.VERIFICATION_CODE)
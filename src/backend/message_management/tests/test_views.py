@@ -256,7 +256,7 @@ class TestRetrySMSMessageView:
             return reverse("admin_sms_retry", kwargs={"id": sms_id})
         return reverse("user_sms_retry", kwargs={"id": sms_id})
 
-    @patch("message_management.services.send_sms_to_kafka")
+    @patch("message_management.services.enqueue_sms")
     def test_retry_sms_success_for_admin(self, mock_send, authenticated_admin_client, barrier, create_barrier_phone):
         from message_management.models import SMSMessage
 
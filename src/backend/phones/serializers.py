@@ -1,6 +1,7 @@
 import logging
 from datetime import date, datetime, timedelta
 
+from django.db import transaction
 from django.utils.timezone import now
 from rest_framework import serializers
 from rest_framework.exceptions import NotFound, PermissionDenied
@@ -133,19 +134,20 @@ class CreateBarrierPhoneSerializer(serializers.ModelSerializer):
         as_admin = self.context.get("as_admin", False)
 
         schedule_data = validated_data.pop("schedule", None)
-        phone, log = BarrierPhone.create(
-            user=validated_data["user"],
-            barrier=validated_data["barrier"],
-            phone=validated_data["phone"],
-            type=validated_data["type"],
-            name=validated_data.get("name", ""),
-            author=BarrierActionLog.Author.ADMIN if as_admin else BarrierActionLog.Author.USER,
-            reason=BarrierActionLog.Reason.MANUAL,
-            start_time=validated_data.get("start_time"),
-            end_time=validated_data.get("end_time"),
-            schedule=schedule_data,
-        )
-        phone.send_sms_to_create(log)
+        with transaction.atomic():
+            phone, log = BarrierPhone.create(
+                user=validated_data["user"],
+                barrier=validated_data["barrier"],
+                phone=validated_data["phone"],
+                type=validated_data["type"],
+                name=validated_data.get("name", ""),
+                author=BarrierActionLog.Author.ADMIN if as_admin else BarrierActionLog.Author.USER,
+                reason=BarrierActionLog.Reason.MANUAL,
+                start_time=validated_data.get("start_time"),
+                end_time=validated_data.get("end_time"),
+                schedule=schedule_data,
+            )
+            phone.send_sms_to_create(log)
         return phone
 
 
@@ -182,23 +184,24 @@ class UpdateBarrierPhoneSerializer(serializers.ModelSerializer):
         as_admin = self.context.get("as_admin", False)
         old_value = phone.describe_phone_params()
 
-        for attr, value in validated_data.items():
-            setattr(phone, attr, value)
-        phone.save()
+        with transaction.atomic():
+            for attr, value in validated_data.items():
+                setattr(phone, attr, value)
+            phone.save()
 
-        new_value = phone.describe_phone_params()
+            new_value = phone.describe_phone_params()
 
-        log = BarrierActionLog.objects.create(
-            phone=phone,
-            barrier=phone.barrier,
-            author=BarrierActionLog.Author.ADMIN if as_admin else BarrierActionLog.Author.USER,
-            action_type=BarrierActionLog.ActionType.UPDATE_PHONE,
-            old_value=old_value,
-            new_value=new_value,
-        )
+            log = BarrierActionLog.objects.create(
+                phone=phone,
+                barrier=phone.barrier,
+                author=BarrierActionLog.Author.ADMIN if as_admin else BarrierActionLog.Author.USER,
+                action_type=BarrierActionLog.ActionType.UPDATE_PHONE,
+                old_value=old_value,
+                new_value=new_value,
+            )
 
-        if phone.type == BarrierPhone.PhoneType.TEMPORARY:
-            PhoneTaskManager(phone, log).edit_tasks()
+            if phone.type == BarrierPhone.PhoneType.TEMPORARY:
+                PhoneTaskManager(phone, log).edit_tasks()
 
         return phone
 
@@ -210,20 +213,21 @@ class UpdatePhoneScheduleSerializer(ScheduleSerializer):
         as_admin = self.context.get("as_admin", False)
         old_value = phone.describe_phone_params()
 
-        validate_schedule_phone(phone.type, validated_data, phone.barrier)
-        ScheduleTimeInterval.replace_schedule(phone, validated_data)
-
-        new_value = phone.describe_phone_params()
-        log = BarrierActionLog.objects.create(
-            phone=phone,
-            barrier=phone.barrier,
-            author=BarrierActionLog.Author.ADMIN if as_admin else BarrierActionLog.Author.USER,
-            action_type=BarrierActionLog.ActionType.UPDATE_PHONE,
-            reason=BarrierActionLog.Reason.SCHEDULE_UPDATE,
-            old_value=old_value,
-            new_value=new_value,
-        )
-
-        PhoneTaskManager(phone, log).edit_tasks()
+        with transaction.atomic():
+            validate_schedule_phone(phone.type, validated_data, phone.barrier)
+            ScheduleTimeInterval.replace_schedule(phone, validated_data)
+
+            new_value = phone.describe_phone_params()
+            log = BarrierActionLog.objects.create(
+                phone=phone,
+                barrier=phone.barrier,
+                author=BarrierActionLog.Author.ADMIN if as_admin else BarrierActionLog.Author.USER,
+                action_type=BarrierActionLog.ActionType.UPDATE_PHONE,
+                reason=BarrierActionLog.Reason.SCHEDULE_UPDATE,
+                old_value=old_value,
+                new_value=new_value,
+            )
+
+            PhoneTaskManager(phone, log).edit_tasks()
 
         return phone
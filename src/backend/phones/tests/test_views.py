@@ -3,6 +3,7 @@ from datetime import time
 from unittest.mock import patch
 
 import pytest
+from django.db import DatabaseError
 from django.urls import reverse
 from rest_framework import status
 
@@ -269,6 +270,20 @@ class TestBarrierPhoneDetailViews:
         assert log.reason == BarrierActionLog.Reason.MANUAL
         assert log.author == BarrierActionLog.Author.USER
 
+    @patch.object(BarrierPhone, "send_sms_to_delete", side_effect=DatabaseError("outbox unavailable"))
+    def test_failed_sms_rolls_back_delete(self, mock_send_sms, authenticated_client, barrier_phone):
+        barrier_phone, _ = barrier_phone
+        url = reverse(self.base_url, args=[barrier_phone.id])
+
+        with pytest.raises(DatabaseError):
+            authenticated_client.delete(url)
+
+        barrier_phone.refresh_from_db()
+        assert barrier_phone.is_active
+        assert not BarrierActionLog.objects.filter(
+            phone=barrier_phone, action_type=BarrierActionLog.ActionType.DELETE_PHONE
+        ).exists()
+
     def test_user_cannot_delete_primary_phone(self, authenticated_client, barrier, user, create_barrier_phone):
         phone, _ = create_barrier_phone(user, barrier, phone=user.phone, type=BarrierPhone.PhoneType.PRIMARY)
         url = reverse(self.base_url, args=[phone.id])
@@ -1,3 +1,4 @@
+from django.db import transaction
 from django.http import Http404
 from django.shortcuts import get_object_or_404
 from rest_framework import generics
@@ -203,8 +204,9 @@ class BaseBarrierPhoneDetailView(RetrieveUpdateDestroyAPIView):
             raise PermissionDenied("Primary phone number cannot be deleted.")
         author = BarrierActionLog.Author.ADMIN if self.as_admin else BarrierActionLog.Author.USER
 
-        _, log = phone.remove(author=author, reason=BarrierActionLog.Reason.MANUAL)
-        phone.send_sms_to_delete(log)
+        with transaction.atomic():
+            _, log = phone.remove(author=author, reason=BarrierActionLog.Reason.MANUAL)
+            phone.send_sms_to_delete(log)
         return deleted_response()
 
 
@@ -1,6 +1,7 @@
 import logging
 
 from action_history.models import BarrierActionLog
+from message_management.enums import SMSPriority
 from message_management.services import SMSService
 from phones.models import BarrierPhone
 
@@ -9,12 +10,12 @@ logger = logging.getLogger(__name__)
 
 def send_open_sms(phone: BarrierPhone, log: BarrierActionLog):
     logger.info(f"Sending scheduled OPEN SMS for phone {phone.id} in barrier {phone.barrier.id}")
-    SMSService.send_add_phone_command(phone, log)
+    SMSService.send_add_phone_command(phone, log, SMSPriority.BULK)
 
 
 def send_close_sms(phone: BarrierPhone, log: BarrierActionLog):
     logger.info(f"Sending scheduled CLOSE SMS for phone {phone.id} in barrier {phone.barrier.id}")
-    SMSService.send_delete_phone_command(phone, log)
+    SMSService.send_delete_phone_command(phone, log, SMSPriority.BULK)
 
 
 def send_delete_phone(phone: BarrierPhone, *args):
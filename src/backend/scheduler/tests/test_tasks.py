@@ -3,6 +3,8 @@ from unittest.mock import patch
 import pytest
 
 from action_history.models import BarrierActionLog
+from message_management.enums import SMSPriority
+from message_management.models import OutboxMessage, SMSMessage
 from scheduler.tasks import send_close_sms, send_delete_phone, send_open_sms
 
 
@@ -12,7 +14,7 @@ def test_send_open_sms_calls_add_command(mock_send_add, barrier_phone):
     phone, log = barrier_phone
     send_open_sms(phone, log)
 
-    mock_send_add.assert_called_once_with(phone, log)
+    mock_send_add.assert_called_once_with(phone, log, SMSPriority.BULK)
 
 
 @pytest.mark.django_db
@@ -21,7 +23,17 @@ def test_send_close_sms_calls_delete_command(mock_send_delete, barrier_phone):
     phone, log = barrier_phone
     send_close_sms(phone, log)
 
-    mock_send_delete.assert_called_once_with(phone, log)
+    mock_send_delete.assert_called_once_with(phone, log, SMSPriority.BULK)
+
+
+@pytest.mark.django_db
+@pytest.mark.parametrize("task", [send_open_sms, send_close_sms])
+def test_scheduled_command_payload_is_bulk(task, barrier_phone):
+    phone, log = barrier_phone
+    task(phone, log)
+
+    message = SMSMessage.objects.filter(message_type=SMSMessage.MessageType.PHONE_COMMAND).latest("id")
+    assert OutboxMessage.objects.get(message=message).payload["priority"] == SMSPriority.BULK.value
 
 
 @pytest.mark.django_db
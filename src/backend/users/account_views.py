@@ -1,5 +1,6 @@
 import logging
 
+from django.db import transaction
 from rest_framework.decorators import permission_classes
 from rest_framework.exceptions import MethodNotAllowed, PermissionDenied
 from rest_framework.generics import RetrieveUpdateDestroyAPIView
@@ -72,8 +73,9 @@ class UserAccountView(RetrieveUpdateDestroyAPIView):
 
         phones = BarrierPhone.objects.filter(user=user, is_active=True)
         for phone in phones:
-            _, log = phone.remove(author=BarrierActionLog.Author.USER, reason=BarrierActionLog.Reason.USER_DELETED)
-            phone.send_sms_to_delete(log)
+            with transaction.atomic():
+                _, log = phone.remove(author=BarrierActionLog.Author.USER, reason=BarrierActionLog.Reason.USER_DELETED)
+                phone.send_sms_to_delete(log)
             logger.info(
                 f"Deleted phone {phone.phone} for user '{user.id}' from barrier '{phone.barrier.id}' "
                 f"while deleting user"
@@ -101,21 +103,22 @@ class ChangePhoneView(APIView):
         for old_phone_entry in old_phones:
             barrier = old_phone_entry.barrier
 
-            _, log = old_phone_entry.remove(
-                author=BarrierActionLog.Author.SYSTEM, reason=BarrierActionLog.Reason.PRIMARY_PHONE_CHANGE
-            )
-            old_phone_entry.send_sms_to_delete(log)
-
-            new_phone_entry, log = BarrierPhone.create(
-                user=user,
-                barrier=barrier,
-                phone=new_phone,
-                type=BarrierPhone.PhoneType.PRIMARY,
-                name=user.get_full_name(),
-                author=BarrierActionLog.Author.SYSTEM,
-                reason=BarrierActionLog.Reason.PRIMARY_PHONE_CHANGE,
-            )
-            new_phone_entry.send_sms_to_create(log)
+            with transaction.atomic():
+                _, log = old_phone_entry.remove(
+                    author=BarrierActionLog.Author.SYSTEM, reason=BarrierActionLog.Reason.PRIMARY_PHONE_CHANGE
+                )
+                old_phone_entry.send_sms_to_delete(log)
+
+                new_phone_entry, log = BarrierPhone.create(
+                    user=user,
+                    barrier=barrier,
+                    phone=new_phone,
+                    type=BarrierPhone.PhoneType.PRIMARY,
+                    name=user.get_full_name(),
+                    author=BarrierActionLog.Author.SYSTEM,
+                    reason=BarrierActionLog.Reason.PRIMARY_PHONE_CHANGE,
+                )
+                new_phone_entry.send_sms_to_create(log)
 
     def patch(self, request):
         serializer = ChangePhoneSerializer(data=request.data)
@@ -24,6 +24,11 @@ log "Kafka is up. Creating topics..."
 
 TOPICS=("sms_configuration" "sms_verification" "sms_balance" "sms_responses" "failed_messages")
 
+# Retry and dead letter topics of the consumed topics, one retry topic per configured retry delay
+for topic in "sms_configuration" "sms_verification" "sms_responses" "failed_messages"; do
+  TOPICS+=("${topic}_retry_1" "${topic}_retry_2" "${topic}_dlq")
+done
+
 for topic in "${TOPICS[@]}"; do
   log "Checking topic: $topic"
 
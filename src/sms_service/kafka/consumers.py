@@ -1,14 +1,23 @@
+import asyncio
 import logging
 import threading
 import time
+from collections import deque
+from concurrent.futures import Future, wait
+from typing import Callable, List
 
 from confluent_kafka import Consumer, Message, TopicPartition
 
 from config import KAFKA_SERVERS
-from modem.huawei_modem_client import HuaweiModemClient
+from kafka.dispatcher import AsyncKeyedDispatcher, KeyedDispatcher
+from kafka.retry import get_retry_at
+from modem.health import ModemHealthMonitor
+from utils.metrics import CONSUMER_LAG, MESSAGES_IN_FLIGHT, forget_partition
 
 logger = logging.getLogger(__name__)
 
+SHUTDOWN_DELIVERY_TIMEOUT_SECONDS = 5
+
 
 def create_consumer(topic: str) -> Consumer:
     return Consumer(
@@ -17,57 +26,313 @@ def create_consumer(topic: str) -> Consumer:
             "group.id": f"{topic}_group",
             "auto.offset.reset": "earliest",
             "enable.auto.commit": False,
+            # Only the moved partitions are revoked on a rebalance, the others keep being handled
+            "partition.assignment.strategy": "cooperative-sticky",
         }
     )
 
 
-def initialize_consumer(topic_name: str, partition_id: int) -> Consumer:
-    consumer = create_consumer(topic_name)
-    consumer.assign([TopicPartition(topic_name, partition_id)])
-    logger.debug(f"Assigned partition id: {partition_id} in topic: {topic_name}")
-    return consumer
+def commit_done(consumer: Consumer, pending: deque[tuple[Message, Future]], asynchronous: bool = True):
+    """
+    Commit the longest prefix of handled messages whose produced replies were all delivered.
+    A message is committed only when every earlier message on the partition is done, so nothing is skipped
+    when the consumer is recreated. Raises on the first failed message after committing the prefix before it.
+    """
 
+    last_done = None
+    error = None
+    while pending and pending[0][1].done():
+        msg, handled = pending[0]
+        if handled.exception():
+            error = f"Handler failure for message at offset {msg.offset()}: {handled.exception()}"
+            break
+        deliveries: List[Future] = handled.result()
+        if not all(delivery.done() for delivery in deliveries):
+            break
+        if any(delivery.exception() for delivery in deliveries):
+            error = f"Replies of message at offset {msg.offset()} were not delivered"
+            break
+        last_done = pending.popleft()[0]
 
-def consume_loop(handler, partition_id: int, topic_name: str, modem: HuaweiModemClient, stop_event: threading.Event):
-    """Continuously listen for messages from a specific partition."""
+    if last_done is not None:
+        consumer.commit(message=last_done, asynchronous=asynchronous)
+        log_mgs = "Commited successfully handled message from topic %s from partition %s at offset %s."
+        logger.debug(log_mgs, last_done.topic(), last_done.partition(), last_done.offset())
 
-    while not stop_event.is_set():
-        try:
-            consumer = initialize_consumer(topic_name, partition_id)
-
-            while not stop_event.is_set():
-                msg: Message = consumer.poll(timeout=10.0)
-                if msg is None:
-                    logger.debug(f"No new message in topic {topic_name} on partition {partition_id}. Waiting...")
-                    continue
-                if msg.error():
-                    logger.error("Consumer error: %s", msg.error())
-                    continue
-
-                log_mgs = "Handling message %s from topic %s from partition %s at offset %s"
-                logger.info(log_mgs, msg.value(), topic_name, partition_id, msg.offset())
-
-                success = handler(modem, msg)
-                if not success:
-                    log_mgs = (
-                        "Handler returned failure for message %s for topic %s for partition %s at offset %s. "
-                        "Will recreate consumer."
-                    )
-                    logger.error(log_mgs, msg.value(), topic_name, partition_id, msg.offset())
-                    raise Exception("Handler failure")
-
-                consumer.commit(message=msg)
-                log_mgs = "Commited successfully handled message from topic %s from partition %s at offset %s."
-                logger.info(log_mgs, topic_name, partition_id, msg.offset())
+    if error:
+        raise Exception(error)
+
+
+def wait_handled(pending: deque[tuple[Message, Future]], timeout: float | None = None):
+    """Wait until the handlers of the pending messages finish and their replies are delivered."""
+
+    wait([handled for _, handled in pending])
+    deliveries = [delivery for _, handled in pending if not handled.exception() for delivery in handled.result()]
+    wait(deliveries, timeout=timeout)
+
+
+class TopicConsumer:
+    """
+    Consumes a topic as a member of the topic consumer group and hands the messages to the dispatcher.
+    Partitions are assigned by the group, so several service instances share them without handling a message
+    twice. Before a partition is revoked its in-flight messages are finished and committed.
+    On a retry topic (delayed=True) a partition is paused until its next message is due.
+    While the modem circuit is open every partition is paused and resumed once the modem recovers.
+    """
+
+    def __init__(
+        self,
+        handler,
+        topic_name: str,
+        dispatcher: KeyedDispatcher | AsyncKeyedDispatcher,
+        stop_event: threading.Event,
+        max_in_flight: int = 100,
+        on_assign: Callable[[List[int]], None] | None = None,
+        delayed: bool = False,
+        health: ModemHealthMonitor | None = None,
+    ):
+        self.handler = handler
+        self.topic_name = topic_name
+        self.dispatcher = dispatcher
+        self.stop_event = stop_event
+        self.max_in_flight = max_in_flight
+        self.on_assign = on_assign
+        self.delayed = delayed
+        self.health = health
+        self.consumer: Consumer | None = None
+        # Handled but not yet committed messages per partition, in offset order
+        self.pending: dict[int, deque[tuple[Message, Future]]] = {}
+        # Partitions paused because of too many unfinished messages, and until which time for a delayed retry
+        self.paused: set[int] = set()
+        self.waiting: dict[int, float] = {}
+        # Partitions paused because every modem is down
+        self.suspended: set[int] = set()
+        self.modem_down = False
+
+    def _on_assign(self, consumer: Consumer, partitions: List[TopicPartition]):
+        assigned = [tp.partition for tp in partitions]
+        logger.info("Assigned partitions %s of topic %s", assigned, self.topic_name)
+        for partition in assigned:
+            self.pending.setdefault(partition, deque())
+        if self.on_assign and assigned:
+            try:
+                self.on_assign(assigned)
+            except Exception as e:
+                logger.error("Error in assign callback of topic %s: %s", self.topic_name, e)
+
+    def _on_revoke(self, consumer: Consumer, partitions: List[TopicPartition]):
+        logger.info("Revoking partitions %s of topic %s", [tp.partition for tp in partitions], self.topic_name)
+        for tp in partitions:
+            self.paused.discard(tp.partition)
+            self.waiting.pop(tp.partition, None)
+            self.suspended.discard(tp.partition)
+            forget_partition(self.topic_name, tp.partition)
+            pending = self.pending.pop(tp.partition, None)
+            if not pending:
+                continue
+            # Finish and commit what was already taken, so the next owner does not send it again
+            wait_handled(pending, timeout=SHUTDOWN_DELIVERY_TIMEOUT_SECONDS)
+            try:
+                commit_done(consumer, pending, asynchronous=False)
+            except Exception as e:
+                logger.error("Error committing revoked partition %s of topic %s: %s", tp.partition, self.topic_name, e)
+
+    def _on_lost(self, consumer: Consumer, partitions: List[TopicPartition]):
+        logger.warning("Lost partitions %s of topic %s", [tp.partition for tp in partitions], self.topic_name)
+        for tp in partitions:
+            # The partitions already belong to another member, their offsets can not be committed anymore
+            self.paused.discard(tp.partition)
+            self.waiting.pop(tp.partition, None)
+            self.suspended.discard(tp.partition)
+            forget_partition(self.topic_name, tp.partition)
+            self.pending.pop(tp.partition, None)
+
+    def _is_paused(self, partition: int) -> bool:
+        return partition in self.paused or partition in self.waiting or partition in self.suspended
+
+    def _pause(self, partition: int):
+        if not self._is_paused(partition):
+            self.consumer.pause([TopicPartition(self.topic_name, partition)])
+
+    def _resume(self, partition: int):
+        if not self._is_paused(partition):
+            self.consumer.resume([TopicPartition(self.topic_name, partition)])
+
+    def _suspend(self, partition: int):
+        self._pause(partition)
+        self.suspended.add(partition)
+
+    def _check_health(self):
+        """Pause every partition when the modem circuit opens and resume them when it closes."""
+
+        if self.health is None or self.health.is_open == self.modem_down:
+            return
+
+        self.modem_down = self.health.is_open
+        if self.modem_down:
+            logger.warning("Modem is down, pausing topic %s", self.topic_name)
+            for tp in self.consumer.assignment():
+                self._suspend(tp.partition)
+            return
+
+        logger.info("Modem is up again, resuming topic %s", self.topic_name)
+        suspended, self.suspended = self.suspended, set()
+        for partition in suspended:
+            self._resume(partition)
+
+    def _rewind(self, msg: Message):
+        self.consumer.seek(TopicPartition(self.topic_name, msg.partition(), msg.offset()))
+
+    def _commit(self):
+        for partition, pending in self.pending.items():
+            commit_done(self.consumer, pending)
+            MESSAGES_IN_FLIGHT.labels(self.topic_name, str(partition)).set(len(pending))
+
+            if partition in self.paused and len(pending) < self.max_in_flight:
+                self.paused.discard(partition)
+                self._resume(partition)
+
+        now = time.time()
+        for partition in [partition for partition, retry_at in self.waiting.items() if retry_at <= now]:
+            del self.waiting[partition]
+            self._resume(partition)
 
+    def _wait_until_due(self, msg: Message) -> bool:
+        """Pause the partition and rewind to the message if its retry is not due yet."""
+
+        retry_at = get_retry_at(msg)
+        if retry_at <= time.time():
+            return False
+
+        self._pause(msg.partition())
+        self.waiting[msg.partition()] = retry_at
+        self._rewind(msg)
+        logger.debug(
+            "Message at offset %s of %s is due in %.0f seconds", msg.offset(), self.topic_name, retry_at - time.time()
+        )
+        return True
+
+    def _observe_lag(self, msg: Message):
+        # The cached high watermark is refreshed with every fetch, so this does not query the broker
+        try:
+            _, high = self.consumer.get_watermark_offsets(TopicPartition(self.topic_name, msg.partition()), cached=True)
         except Exception as e:
-            log_mgs = "Error in consumer loop for topic %s on partition %s. Error: %s. Restarting in 5s..."
-            logger.critical(log_mgs, topic_name, partition_id, e)
+            logger.debug("No watermark for partition %s of topic %s: %s", msg.partition(), self.topic_name, e)
+            return
+        if high >= 0:
+            CONSUMER_LAG.labels(self.topic_name, str(msg.partition())).set(max(high - msg.offset() - 1, 0))
+
+    def _dispatch(self, msg: Message):
+        pending = self.pending.setdefault(msg.partition(), deque())
+        pending.append((msg, self.dispatcher.submit(self.handler, msg)))
+        self._observe_lag(msg)
+
+        if len(pending) >= self.max_in_flight:
+            # Too far ahead of the oldest unfinished message, stop fetching the partition until it catches up
+            self._pause(msg.partition())
+            self.paused.add(msg.partition())
+
+    def _subscribe(self):
+        self.consumer = create_consumer(self.topic_name)
+        self.consumer.subscribe(
+            [self.topic_name], on_assign=self._on_assign, on_revoke=self._on_revoke, on_lost=self._on_lost
+        )
+        logger.debug(f"Subscribed to topic: {self.topic_name}")
+
+    def _poll_timeout(self) -> float:
+        # Poll often while messages are in flight or delayed so their commits and resumes are not late
+        return 1.0 if any(self.pending.values()) or self.waiting or self.modem_down else 10.0
+
+    def _process(self, msg: Message | None):
+        if msg is None:
+            if not any(self.pending.values()):
+                logger.debug("No new message in topic %s. Waiting...", self.topic_name, extra={"rate_limit": 60})
+            return
+        if msg.error():
+            logger.error("Consumer error: %s", msg.error())
+            return
+        if self.modem_down:
+            # Fetched before the partition was paused, or from a partition assigned meanwhile
+            self._suspend(msg.partition())
+            self._rewind(msg)
+            return
+        if self.delayed and self._wait_until_due(msg):
+            return
+
+        log_mgs = "Handling message %s from topic %s from partition %s at offset %s"
+        logger.debug(log_mgs, msg.value(), self.topic_name, msg.partition(), msg.offset())
+
+        self._dispatch(msg)
+
+    def _consume(self):
+        self._subscribe()
+
+        while not self.stop_event.is_set():
+            self._commit()
+            self._check_health()
+            self._process(self.consumer.poll(timeout=self._poll_timeout()))
+
+    def _close(self):
+        # Leaving the group revokes the partitions, which finishes and commits the in-flight messages
+        try:
+            self.consumer.close()
+            logger.debug("Consumer closed successfully.")
+        except Exception as close_error:
+            logger.error("Error closing consumer: %s", close_error)
+            for pending in self.pending.values():
+                wait_handled(pending)
+        for partition in self.pending:
+            forget_partition(self.topic_name, partition)
+        self.pending.clear()
+        self.paused.clear()
+        self.waiting.clear()
+        self.suspended.clear()
+        self.modem_down = False
+
+    def run(self):
+        """Continuously consume the topic, recreating the consumer after errors."""
+
+        while not self.stop_event.is_set():
+            try:
+                self._consume()
+            except Exception as e:
+                log_mgs = "Error in consumer loop for topic %s. Error: %s. Restarting in 5s..."
+                logger.critical(log_mgs, self.topic_name, e)
+                if self.consumer is not None:
+                    self._close()
+                time.sleep(5)  # delay before reconnecting
+                continue
+
+            self._close()
+
+
+class AsyncTopicConsumer(TopicConsumer):
+    """
+    TopicConsumer running on an event loop with an AsyncKeyedDispatcher.
+    The blocking polls run in a worker thread, so rebalance callbacks can wait for the messages handled
+    on the loop.
+    """
+
+    async def _consume_async(self):
+        self._subscribe()
+
+        while not self.stop_event.is_set():
+            self._commit()
+            self._check_health()
+            self._process(await asyncio.to_thread(self.consumer.poll, self._poll_timeout()))
+
+    async def run_async(self):
+        """Continuously consume the topic, recreating the consumer after errors."""
 
+        while not self.stop_event.is_set():
             try:
-                consumer.close()
-                logger.debug("Consumer closed successfully.")
-            except Exception as close_error:
-                logger.error("Error closing consumer: %s", close_error)
+                await self._consume_async()
+            except Exception as e:
+                log_mgs = "Error in consumer loop for topic %s. Error: %s. Restarting in 5s..."
+                logger.critical(log_mgs, self.topic_name, e)
+                if self.consumer is not None:
+                    await asyncio.to_thread(self._close)
+                await asyncio.sleep(5)  # delay before reconnecting
+                continue
 
-            time.sleep(5)  # delay before reconnecting
+            await asyncio.to_thread(self._close)
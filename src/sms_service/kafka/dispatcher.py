@@ -0,0 +1,175 @@
+import asyncio
+import json
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Awaitable, Callable, List
+
+from confluent_kafka import Message
+
+from kafka.producer import track_deliveries
+from modem.modem_pool import ModemPool
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[ModemPool, Message], bool]
+AsyncHandler = Callable[[ModemPool, Message], Awaitable[bool]]
+FailureHandler = Callable[[Message, str], Future]
+
+
+def get_message_key(msg: Message) -> str:
+    """Messages are keyed by the destination phone, older producers only put it into the payload."""
+
+    key = msg.key()
+    if key:
+        return key.decode("utf-8") if isinstance(key, bytes) else key
+    try:
+        return json.loads(msg.value().decode("utf-8"))["phone"]
+    except Exception:
+        return ""
+
+
+class DispatchedMessage:
+    def __init__(self, handler: Handler, msg: Message):
+        self.handler = handler
+        self.msg = msg
+        # Resolves to the delivery futures of the produced replies, or fails if the handler failed
+        self.done: Future = Future()
+
+
+def complete(
+    task: DispatchedMessage, key: str, error: str | None, deliveries: List[Future], on_failure: FailureHandler | None
+):
+    """Resolve a handled message, publishing it for a retry when the handler failed."""
+
+    if error is None:
+        task.done.set_result(deliveries)
+        return
+    if on_failure is None:
+        task.done.set_exception(Exception(error))
+        return
+
+    try:
+        on_failure(task.msg, error)
+        task.done.set_result(deliveries)
+    except Exception as e:
+        logger.error("Error while publishing failed message for %s: %s", key, e)
+        task.done.set_exception(e)
+
+
+class KeyedDispatcher:
+    """
+    Runs message handlers on a bounded worker pool, in parallel across devices and serially per device.
+    Messages with the same key (the device phone) wait in a per-key queue, so the commands of a device are sent
+    one after another in partition order, while unrelated devices sharing a partition do not wait on each other.
+    A handler returns once its SMS is sent, so several commands of a device may be awaiting their replies,
+    the reply matcher assigns the replies to them in send order.
+    Failed messages are passed to on_failure, which publishes them for a later retry, so the partition goes on.
+    """
+
+    def __init__(self, modem: ModemPool, workers: int = 8, on_failure: FailureHandler | None = None):
+        self.modem = modem
+        self.on_failure = on_failure
+        self._executor = ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="SmsWorker")
+        self._queues: dict[str, deque[DispatchedMessage]] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, handler: Handler, msg: Message) -> Future:
+        task = DispatchedMessage(handler, msg)
+        key = get_message_key(msg)
+
+        with self._lock:
+            queue = self._queues.get(key)
+            if queue is not None:
+                # A message for this device is being handled, run after it
+                queue.append(task)
+                return task.done
+            self._queues[key] = deque()
+
+        self._executor.submit(self._run, key, task)
+        return task.done
+
+    def _handle(self, key: str, task: DispatchedMessage):
+        with track_deliveries() as deliveries:
+            try:
+                error = None if task.handler(self.modem, task.msg) else "Handler failure"
+            except Exception as e:
+                logger.exception("Unexpected error while handling message for %s: %s", key, e)
+                error = str(e) or type(e).__name__
+            complete(task, key, error, deliveries, self.on_failure)
+
+    def _run(self, key: str, task: DispatchedMessage):
+        self._handle(key, task)
+
+        with self._lock:
+            queue = self._queues[key]
+            if not queue:
+                del self._queues[key]
+                return
+            next_task = queue.popleft()
+
+        # Submitted again instead of looping, so a busy device does not hold a worker from other devices
+        try:
+            self._executor.submit(self._run, key, next_task)
+        except RuntimeError:
+            # The pool is shutting down, finish the queue of this device here
+            self._run(key, next_task)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+class AsyncKeyedDispatcher:
+    """
+    asyncio counterpart of KeyedDispatcher for coroutine handlers.
+    A message waiting for the modem holds no thread, so the number of messages in flight is bounded
+    by max_in_flight instead of the number of worker threads.
+    """
+
+    def __init__(self, modem: ModemPool, max_in_flight: int = 1000, on_failure: FailureHandler | None = None):
+        self.modem = modem
+        self.on_failure = on_failure
+        self._semaphore = asyncio.Semaphore(max(max_in_flight, 1))
+        self._queues: dict[str, deque[DispatchedMessage]] = {}
+        self._runners: set[asyncio.Task] = set()
+
+    def submit(self, handler: AsyncHandler, msg: Message) -> Future:
+        """Must be called from the event loop."""
+
+        task = DispatchedMessage(handler, msg)
+        key = get_message_key(msg)
+
+        queue = self._queues.get(key)
+        if queue is not None:
+            # A message for this device is being handled, run after it
+            queue.append(task)
+            return task.done
+        self._queues[key] = deque()
+
+        runner = asyncio.create_task(self._run(key, task))
+        self._runners.add(runner)
+        runner.add_done_callback(self._runners.discard)
+        return task.done
+
+    async def _handle(self, key: str, task: DispatchedMessage):
+        with track_deliveries() as deliveries:
+            try:
+                error = None if await task.handler(self.modem, task.msg) else "Handler failure"
+            except Exception as e:
+                logger.exception("Unexpected error while handling message for %s: %s", key, e)
+                error = str(e) or type(e).__name__
+            complete(task, key, error, deliveries, self.on_failure)
+
+    async def _run(self, key: str, task: DispatchedMessage):
+        while task is not None:
+            async with self._semaphore:
+                await self._handle(key, task)
+
+            queue = self._queues[key]
+            task = queue.popleft() if queue else None
+        del self._queues[key]
+
+    async def shutdown(self):
+        while self._runners:
+            await asyncio.gather(*self._runners)
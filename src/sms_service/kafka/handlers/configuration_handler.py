@@ -1,3 +1,4 @@
+import asyncio
 import json
 import logging
 import time
@@ -5,77 +6,132 @@ import time
 from confluent_kafka import Message
 
 from config import MESSAGE_RESPONSE_TIMEOUT_SECONDS
-from kafka.producer import send_to_failed, send_to_responses
-from modem.huawei_modem_client import HuaweiModemClient
+from kafka.handlers.sending import send_with_retries, send_with_retries_async
+from kafka.producer import send_to_failed
+from modem.modem_pool import ModemPool
+from modem.send_queue import PrioritySendQueue, SendLane
+from storage.pending_replies import PendingReplyStore
+from storage.send_ledger import SendLedger
 
 logger = logging.getLogger("__name__")
 
 MAX_DELAY_SECONDS = 3600
 
 
-def wait_for_reply_from_phone(modem: HuaweiModemClient, phone: str, start_ts: float):
-    """Wait for an incoming SMS reply from the given phone number, after a specific time within the timeout."""
+def get_lane(data: dict) -> SendLane:
+    """Scheduled commands are marked with "priority": "bulk" and are sent after interactive ones."""
 
-    logger.debug("Waiting for reply from phone: %s", phone)
+    return SendLane.BULK if data.get("priority") == "bulk" else SendLane.INTERACTIVE
 
-    start = time.time()
-    while time.time() - start < MESSAGE_RESPONSE_TIMEOUT_SECONDS:
-        reply = modem.get_reply_from_phone_since(phone, start_ts)
-        if reply:
-            logger.info("Received reply from phone: %s", phone)
-            return reply
-        time.sleep(10)
 
-    logger.warning("Timeout waiting for reply from phone: %s", phone)
-    return None
+def prepare_configuration(message: Message, pending_replies: PendingReplyStore, send_ledger: SendLedger) -> dict | bool:
+    """Return the message data if it has to be sent, or the handling result if it does not."""
 
+    value = message.value()
+    if value is None:
+        logger.warning("Received message with no value.")
+        return False
 
-def handle_sms_configuration(modem: HuaweiModemClient, message: Message) -> bool:
-    try:
-        value = message.value()
-        if value is None:
-            logger.warning("Received message with no value.")
-            return False
-
-        data = json.loads(value.decode("utf-8"))
-        phone = data["phone"]
-        content = data["content"]
-        retries = data["retries"]
-        message_id = data["message_id"]
-        created_at = data.get("timestamp")
-
-        logger.info("Handling configuration SMS for phone: %s", phone)
-
-        if created_at:
-            age = time.time() - created_at
-            if age > MAX_DELAY_SECONDS:
-                logger.warning("Skipping SMS to %s: message too old (%d seconds)", phone, age)
-                send_to_failed({"message_id": message_id, "phone": phone, "content": "Too old"}, phone)
-                return True
-
-        for attempt in range(retries):
-            logger.debug("Attempt %d to send configuration SMS to %s", attempt + 1, phone)
-            success = modem.send_sms(phone, content)
-            sent_ts = time.time()
-            if success:
-                logger.info("Configuration SMS sent to %s, now waiting for reply...", phone)
-                break  # Exit cycle after successful send
-            logger.error("Failed to send configuration SMS to %s, attempt %d", phone, attempt + 1)
-        else:
-            # <-- Error after all attempts
-            logger.error("All attempts to send SMS failed for phone: %s, sending to failed_messages topic", phone)
-            send_to_failed(data, phone)
-            return False
-
-        reply = wait_for_reply_from_phone(modem, phone, start_ts=sent_ts)
-        if reply:
-            logger.info("Reply received from %s, sending to responses topic", phone)
-            send_to_responses({"message_id": message_id, "phone": phone, "content": reply}, phone)
+    data = json.loads(value.decode("utf-8"))
+    phone = data["phone"]
+    message_id = data["message_id"]
+    created_at = data.get("timestamp")
+
+    logger.info("Handling configuration SMS for phone: %s", phone)
+
+    if created_at:
+        age = time.time() - created_at
+        if age > MAX_DELAY_SECONDS:
+            logger.warning("Skipping SMS to %s: message too old (%d seconds)", phone, age)
+            send_to_failed({"message_id": message_id, "phone": phone, "content": "Too old"}, phone)
             return True
-        else:
-            logger.warning("No reply received from phone: %s", phone)
-            send_to_failed(data, phone)
-            return False
+
+    sent = send_ledger.get(message_id)
+    if sent:
+        logger.info("Configuration SMS %s was already sent to %s, waiting for its reply", message_id, phone)
+        pending_replies.add(
+            message_id,
+            phone,
+            data,
+            sent_at=sent["sent_at"],
+            deadline=sent["sent_at"] + MESSAGE_RESPONSE_TIMEOUT_SECONDS,
+            modem=sent["modem"],
+            replace=False,
+        )
+        return True
+
+    return data
+
+
+def finish_configuration(
+    data: dict, modem_name: str | None, pending_replies: PendingReplyStore, send_ledger: SendLedger
+) -> bool:
+    """Record the SMS as sent by the given modem, the one its reply arrives on, or fail it if no modem sent it."""
+
+    phone = data["phone"]
+    if modem_name is None:
+        # <-- Error after all attempts, retried later through the retry topics
+        logger.error("All attempts to send SMS failed for phone: %s", phone)
+        return False
+
+    sent_ts = send_ledger.record_sent(data["message_id"], phone, modem_name)
+    logger.info("Configuration SMS sent to %s, now waiting for reply...", phone)
+    pending_replies.add(
+        data["message_id"],
+        phone,
+        data,
+        sent_at=sent_ts,
+        deadline=sent_ts + MESSAGE_RESPONSE_TIMEOUT_SECONDS,
+        modem=modem_name,
+    )
+    logger.info("Configuration SMS to %s is awaiting reply", phone)
+    return True
+
+
+def handle_sms_configuration(
+    modem: ModemPool,
+    message: Message,
+    pending_replies: PendingReplyStore,
+    send_queue: PrioritySendQueue,
+    send_ledger: SendLedger,
+) -> bool:
+    """
+    Send a configuration SMS and store it as awaiting a reply.
+    The reply is matched later by the reply matcher, so the partition is not held while the device answers.
+    A redelivered message which was already sent is not sent again, it only waits for its reply.
+    """
+
+    try:
+        data = prepare_configuration(message, pending_replies, send_ledger)
+        if not isinstance(data, dict):
+            return data
+
+        modem_name = send_with_retries(send_queue, data["phone"], data["content"], data["retries"], get_lane(data))
+        return finish_configuration(data, modem_name, pending_replies, send_ledger)
+
+    except Exception as e:
+        logger.exception("Unexpected error while handling configuration SMS: %s", e)
+        return False  # <-- Any unexpected error
+
+
+async def handle_sms_configuration_async(
+    modem: ModemPool,
+    message: Message,
+    pending_replies: PendingReplyStore,
+    send_queue: PrioritySendQueue,
+    send_ledger: SendLedger,
+) -> bool:
+    """Same as handle_sms_configuration, without holding a thread while the SMS waits for the modem."""
+
+    try:
+        data = await asyncio.to_thread(prepare_configuration, message, pending_replies, send_ledger)
+        if not isinstance(data, dict):
+            return data
+
+        modem_name = await send_with_retries_async(
+            send_queue, data["phone"], data["content"], data["retries"], get_lane(data)
+        )
+        return await asyncio.to_thread(finish_configuration, data, modem_name, pending_replies, send_ledger)
 
     except Exception as e:
         logger.exception("Unexpected error while handling configuration SMS: %s", e)
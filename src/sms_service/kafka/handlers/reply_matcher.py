@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+from kafka.producer import send_to_failed, send_to_responses
+from modem.huawei_modem_client import HuaweiModemClient
+from modem.modem_pool import ModemPool
+from storage.pending_replies import PendingReplyStore
+from utils.metrics import REPLIES, REPLY_WAIT_SECONDS
+
+logger = logging.getLogger(__name__)
+
+MIN_DEADLINE_WAIT_SECONDS = 0.5
+
+
+class ReplyMatcher:
+    """
+    Single modem inbox poller which resolves the pending replies of sent configuration commands.
+    Once per tick syncs the inbox of every modem with commands awaiting a reply, publishes matched replies
+    to the responses topic and expired commands to the failed topic.
+    Commands to the same phone take replies in send order and every incoming message answers one command only.
+    A pending reply is marked resolved only after Kafka confirms the delivery, so nothing is lost on a crash.
+    """
+
+    def __init__(
+        self,
+        modem_pool: ModemPool,
+        pending_replies: PendingReplyStore,
+        stop_event: threading.Event,
+        interval: float = 10,
+    ):
+        self.modem_pool = modem_pool
+        self.pending_replies = pending_replies
+        self.stop_event = stop_event
+        self.interval = interval
+        # Message ids already checked against the whole store, later ticks only look at new messages for them
+        self._checked: set[int] = set()
+        # Message ids whose outcome is being published, they are resolved in the store once Kafka confirms delivery
+        self._publishing: set[int] = set()
+        # Modem indexes of the replies being published, by (modem, phone), until the store records them
+        self._claimed: dict[tuple[str, str], set[int]] = {}
+        self._publishing_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._async_wake: asyncio.Event | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="ReplyMatcher", daemon=True)
+        self._thread.start()
+        logger.debug("Reply matcher started with interval %s seconds", self.interval)
+
+    def wake(self):
+        """Run the next match right away instead of waiting for the interval."""
+
+        self._wake.set()
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._async_wake.set)
+            except RuntimeError:
+                pass  # The loop is already closed
+
+    def join(self, timeout: float | None = None):
+        self.wake()
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _publish(
+        self,
+        message_id: int,
+        delivery: Future,
+        resolve: Callable[[], None],
+        claim: tuple[tuple[str, str], int] | None = None,
+    ):
+        with self._publishing_lock:
+            self._publishing.add(message_id)
+            if claim:
+                self._claimed.setdefault(claim[0], set()).add(claim[1])
+
+        def on_delivered(delivery: Future):
+            try:
+                if delivery.exception() is None:
+                    resolve()
+                else:
+                    logger.error("Outcome of message %s was not delivered: %s", message_id, delivery.exception())
+            except Exception as e:
+                logger.error("Error while resolving pending reply for message %s: %s", message_id, e)
+            finally:
+                # Released after the store has recorded the reply, or to be matched again if it has not
+                with self._publishing_lock:
+                    self._publishing.discard(message_id)
+                    if claim:
+                        claimed = self._claimed[claim[0]]
+                        claimed.discard(claim[1])
+                        if not claimed:
+                            del self._claimed[claim[0]]
+
+        delivery.add_done_callback(on_delivered)
+
+    def _get_taken_replies(self, modem: HuaweiModemClient, phone: str) -> set[int]:
+        """Replies of the phone already matched to a command, recorded in the store or still being published."""
+
+        taken = self.pending_replies.get_reply_indexes(phone, modem.name)
+        with self._publishing_lock:
+            return taken | self._claimed.get((modem.name, phone), set())
+
+    @staticmethod
+    def _observe(pending: dict, outcome: str, now: float):
+        REPLY_WAIT_SECONDS.labels(outcome).observe(now - pending["sent_at"])
+        REPLIES.labels(pending["payload"].get("device_model", "unknown"), outcome).inc()
+
+    def _resolve(
+        self, modem: HuaweiModemClient, pending: dict, now: float, new_phones: set[str], taken: set[int]
+    ) -> bool:
+        message_id, phone = pending["message_id"], pending["phone"]
+
+        if message_id not in self._checked or phone in new_phones:
+            reply = modem.find_reply(phone, pending["sent_at"], exclude=taken)
+            self._checked.add(message_id)
+            if reply:
+                reply_index, content = reply
+                # Not available to the later commands to this phone, even before the store records it
+                taken.add(reply_index)
+                self._observe(pending, "replied", now)
+                logger.info("Reply received from %s for message %s, sending to responses topic", phone, message_id)
+                delivery = send_to_responses({"message_id": message_id, "phone": phone, "content": content}, phone)
+                self._publish(
+                    message_id,
+                    delivery,
+                    lambda: self.pending_replies.mark_replied(message_id, content, reply_index),
+                    claim=((modem.name, phone), reply_index),
+                )
+                return True
+
+        if now >= pending["deadline"]:
+            self._observe(pending, "expired", now)
+            logger.warning("No reply received from phone %s for message %s", phone, message_id)
+            delivery = send_to_failed(pending["payload"], phone)
+            self._publish(message_id, delivery, lambda: self.pending_replies.mark_expired(message_id))
+            return True
+
+        return False
+
+    def match_once(self):
+        """Sync the inboxes once and resolve every pending reply that got an answer or expired."""
+
+        modems = {self.modem_pool.get(pending["modem"]) for pending in self.pending_replies.get_awaiting()}
+        if not modems:
+            return
+
+        new_phones = {}
+        for modem in modems:
+            try:
+                new_phones[modem.name] = {msg["Phone"] for msg in modem.sync_inbox()}
+            except Exception as e:
+                logger.error("Error while syncing inbox of modem %s: %s", modem.name, e)
+                new_phones[modem.name] = set()
+        now = time.time()
+
+        # Loaded after the sync so that commands stored during the sync are checked against the whole store.
+        # Oldest first, so the first reply of a phone goes to the oldest command still waiting for one.
+        taken = {}
+        for pending in self.pending_replies.get_awaiting():
+            with self._publishing_lock:
+                if pending["message_id"] in self._publishing:
+                    continue
+            modem = self.modem_pool.get(pending["modem"])
+            try:
+                key = (modem.name, pending["phone"])
+                if key not in taken:
+                    taken[key] = self._get_taken_replies(modem, pending["phone"])
+                if self._resolve(modem, pending, now, new_phones.get(modem.name, set()), taken[key]):
+                    self._checked.discard(pending["message_id"])
+            except Exception as e:
+                logger.error("Error while resolving pending reply for message %s: %s", pending["message_id"], e)
+
+    def run(self):
+        while not self.stop_event.is_set():
+            started = time.time()
+            try:
+                self.match_once()
+            except Exception as e:
+                logger.error("Error while matching replies: %s", e)
+            logger.debug("Reply matching took %.2f seconds", time.time() - started)
+
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    async def run_async(self):
+        """
+        Event loop variant of run. Besides the polling interval, a timer fires at the nearest reply deadline,
+        so expired commands are reported on time however many are outstanding.
+        """
+
+        self._loop = asyncio.get_running_loop()
+        self._async_wake = asyncio.Event()
+        try:
+            await self._match_until_stopped()
+        finally:
+            self._loop = None
+
+    async def _match_until_stopped(self):
+        while not self.stop_event.is_set():
+            started = time.time()
+            try:
+                await asyncio.to_thread(self.match_once)
+                with self._publishing_lock:
+                    publishing = set(self._publishing)
+                # Commands whose outcome is being published wait for the delivery, not for their deadline
+                next_deadline = await asyncio.to_thread(self.pending_replies.get_next_deadline, publishing)
+            except Exception as e:
+                logger.error("Error while matching replies: %s", e)
+                next_deadline = None
+            logger.debug("Reply matching took %.2f seconds", time.time() - started)
+
+            timeout = self.interval
+            if next_deadline is not None:
+                # Not below a floor, so deadlines that passed during the match do not spin the loop
+                timeout = min(timeout, max(next_deadline - time.time(), MIN_DEADLINE_WAIT_SECONDS))
+            try:
+                await asyncio.wait_for(self._async_wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._async_wake.clear()
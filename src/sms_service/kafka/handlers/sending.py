@@ -0,0 +1,64 @@
+import asyncio
+import logging
+import time
+
+from config import SEND_RETRY_BASE_SECONDS, SEND_RETRY_MAX_SECONDS
+from modem.rate_limiter import backoff_delay
+from modem.send_queue import PrioritySendQueue, SendLane
+from utils.metrics import SEND_RETRIES
+
+logger = logging.getLogger(__name__)
+
+
+def send_with_retries(
+    send_queue: PrioritySendQueue, phone: str, content: str, retries: int, lane: SendLane
+) -> str | None:
+    """
+    Send an SMS through the given priority lane, retrying failed attempts with exponential backoff and jitter.
+    The backoff is spent outside of the queue, so other messages are sent meanwhile.
+    Returns the name of the modem that sent it, or None if every attempt failed.
+    """
+
+    for attempt in range(retries):
+        logger.debug("Attempt %d to send SMS to %s", attempt + 1, phone)
+        if attempt:
+            SEND_RETRIES.labels(lane.name.lower()).inc()
+        try:
+            sent, modem_name = send_queue.send_sms(phone, content, lane)
+            if sent:
+                return modem_name
+            logger.error("Failed to send SMS to %s, attempt %d", phone, attempt + 1)
+        except Exception as e:
+            logger.error("Error while sending SMS to %s, attempt %d: %s", phone, attempt + 1, e)
+
+        if attempt + 1 < retries:
+            delay = backoff_delay(attempt, SEND_RETRY_BASE_SECONDS, SEND_RETRY_MAX_SECONDS)
+            logger.debug("Retrying SMS to %s in %.2f seconds", phone, delay)
+            time.sleep(delay)
+
+    return None
+
+
+async def send_with_retries_async(
+    send_queue: PrioritySendQueue, phone: str, content: str, retries: int, lane: SendLane
+) -> str | None:
+    """Same as send_with_retries, awaiting the send queue and the backoff instead of blocking a thread."""
+
+    for attempt in range(retries):
+        logger.debug("Attempt %d to send SMS to %s", attempt + 1, phone)
+        if attempt:
+            SEND_RETRIES.labels(lane.name.lower()).inc()
+        try:
+            sent, modem_name = await asyncio.wrap_future(send_queue.submit(phone, content, lane))
+            if sent:
+                return modem_name
+            logger.error("Failed to send SMS to %s, attempt %d", phone, attempt + 1)
+        except Exception as e:
+            logger.error("Error while sending SMS to %s, attempt %d: %s", phone, attempt + 1, e)
+
+        if attempt + 1 < retries:
+            delay = backoff_delay(attempt, SEND_RETRY_BASE_SECONDS, SEND_RETRY_MAX_SECONDS)
+            logger.debug("Retrying SMS to %s in %.2f seconds", phone, delay)
+            await asyncio.sleep(delay)
+
+    return None
@@ -1,50 +1,95 @@
+import asyncio
 import json
 import logging
 import time
 
 from confluent_kafka import Message
 
+from kafka.handlers.sending import send_with_retries, send_with_retries_async
 from kafka.producer import send_to_failed
-from modem.huawei_modem_client import HuaweiModemClient
+from modem.modem_pool import ModemPool
+from modem.send_queue import PrioritySendQueue, SendLane
+from storage.send_ledger import SendLedger
 
 logger = logging.getLogger("__name__")
 
 MAX_DELAY_SECONDS = 300
 
 
-def handle_sms_verification(modem: HuaweiModemClient, message: Message) -> bool:
+def prepare_verification(message: Message, send_ledger: SendLedger) -> dict | bool:
+    """Return the message data if it has to be sent, or the handling result if it does not."""
+
+    value = message.value()
+    if value is None:
+        logger.warning("Received message with no value.")
+        return False
+
+    data = json.loads(value.decode("utf-8"))
+    phone = data["phone"]
+    message_id = data.get("message_id")
+    created_at = data.get("timestamp")
+
+    # The content is the verification code, it is never logged
+    logger.info("Handling verification SMS %s for phone: %s", message_id, phone)
+
+    if created_at:
+        age = time.time() - created_at
+        if age > MAX_DELAY_SECONDS:
+            logger.warning("Skipping SMS to %s: message too old (%d seconds)", phone, age)
+            return True
+
+    if message_id is not None and send_ledger.get(message_id):
+        logger.info("Verification SMS %s was already sent to %s, skipping", message_id, phone)
+        return True
+
+    return data
+
+
+def finish_verification(data: dict, modem_name: str | None, send_ledger: SendLedger) -> bool:
+    phone = data["phone"]
+    message_id = data.get("message_id")
+
+    if modem_name is not None:
+        logger.debug("Verification SMS sent to %s", phone)
+        if message_id is not None:
+            send_ledger.record_sent(message_id, phone, modem_name)
+        return True  # <-- Success
+
+    logger.error("All attempts failed for phone: %s, sending to failed_messages topic", phone)
+    send_to_failed(data, phone)
+    return True  # <-- Error after all attempts
+
+
+def handle_sms_verification(
+    modem: ModemPool, message: Message, send_queue: PrioritySendQueue, send_ledger: SendLedger
+) -> bool:
+    try:
+        data = prepare_verification(message, send_ledger)
+        if not isinstance(data, dict):
+            return data
+
+        modem_name = send_with_retries(
+            send_queue, data["phone"], data["content"], data["retries"], SendLane.VERIFICATION
+        )
+        return finish_verification(data, modem_name, send_ledger)
+
+    except Exception as e:
+        logger.error("Unexpected error while handling SMS: %s", e)
+        return False  # <-- Any unexpected error
+
+
+async def handle_sms_verification_async(
+    modem: ModemPool, message: Message, send_queue: PrioritySendQueue, send_ledger: SendLedger
+) -> bool:
     try:
-        value = message.value()
-        if value is None:
-            logger.warning("Received message with no value.")
-            return False
-
-        data = json.loads(value.decode("utf-8"))
-        phone = data["phone"]
-        content = data["content"]
-        retries = data["retries"]
-        created_at = data.get("timestamp")
-
-        logger.info("Handling verification SMS for phone: %s, data: %s", phone, data)
-
-        if created_at:
-            age = time.time() - created_at
-            if age > MAX_DELAY_SECONDS:
-                logger.warning("Skipping SMS to %s: message too old (%d seconds)", phone, age)
-                return True
-
-        for attempt in range(retries):
-            logger.debug("Attempt %d to send verification SMS to %s", attempt + 1, phone)
-            success = modem.send_sms(phone, content)
-            if success:
-                logger.debug("Verification SMS sent to %s", phone)
-                return True  # <-- Success
-
-            logger.error("Failed to send verification SMS to %s, attempt %d", phone, attempt + 1)
-
-        logger.error("All attempts failed for phone: %s, sending to failed_messages topic", phone)
-        send_to_failed(data, phone)
-        return True  # <-- Error after all attempts
+        data = await asyncio.to_thread(prepare_verification, message, send_ledger)
+        if not isinstance(data, dict):
+            return data
+
+        modem_name = await send_with_retries_async(
+            send_queue, data["phone"], data["content"], data["retries"], SendLane.VERIFICATION
+        )
+        return await asyncio.to_thread(finish_verification, data, modem_name, send_ledger)
 
     except Exception as e:
         logger.error("Unexpected error while handling SMS: %s", e)
@@ -1,24 +1,164 @@
+import heapq
+import itertools
 import json
 import logging
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List
 
-from confluent_kafka import Producer
+from confluent_kafka import KafkaError, Message, Producer
 
-from config import KAFKA_SERVERS, KafkaTopic
+from config import (
+    KAFKA_PRODUCER_BATCH_SIZE,
+    KAFKA_PRODUCER_LINGER_MS,
+    KAFKA_RETRY_DELAYS_SECONDS,
+    KAFKA_SERVERS,
+    KafkaTopic,
+)
+from utils.metrics import FAILED_MESSAGES
 
 logger = logging.getLogger(__name__)
 
-producer = Producer({"bootstrap.servers": KAFKA_SERVERS})
+producer = Producer(
+    {
+        "bootstrap.servers": KAFKA_SERVERS,
+        "enable.idempotence": True,
+        "acks": "all",
+        "linger.ms": KAFKA_PRODUCER_LINGER_MS,
+        "batch.num.messages": KAFKA_PRODUCER_BATCH_SIZE,
+    }
+)
 
+# Delivery futures collected by track_deliveries, per thread and per asyncio task
+_deliveries: ContextVar[List[Future] | None] = ContextVar("deliveries", default=None)
+_closing = threading.Event()
 
-def send_to_responses(payload: dict, phone: str) -> None:
-    logger.debug("Sending message to sms_responses topic for phone: %s", phone)
-    producer.produce(KafkaTopic.SMS_RESPONSES.value, key=phone, value=json.dumps(payload))
-    producer.flush()
-    logger.info("Message sent to sms_responses for phone: %s", phone)
+# Failed messages waiting to be produced again, as (due, order, _produce arguments)
+_retries: list[tuple[float, int, tuple]] = []
+_retries_lock = threading.Lock()
+_retry_order = itertools.count()
 
 
-def send_to_failed(payload: dict, phone: str) -> None:
-    logger.debug("Sending message to failed_messages topic for phone: %s", phone)
-    producer.produce(KafkaTopic.FAILED_MESSAGES.value, key=phone, value=json.dumps(payload))
-    producer.flush()
-    logger.info("Message sent to failed_messages for phone: %s", phone)
+@contextmanager
+def track_deliveries() -> Iterator[List[Future]]:
+    """Collect the delivery futures of every message produced by the current thread or task inside the block."""
+
+    deliveries = []
+    token = _deliveries.set(deliveries)
+    try:
+        yield deliveries
+    finally:
+        _deliveries.reset(token)
+
+
+def _produce(topic: str, value: str | bytes, key: str, delivery: Future, headers: dict | None = None, attempt: int = 0):
+    """Produce one attempt of a message, its delivery report resolves the future or schedules the next attempt."""
+
+    def on_delivery(err: KafkaError | None, msg: Message):
+        if err is None:
+            logger.debug("Message delivered to %s [%s] at offset %s", msg.topic(), msg.partition(), msg.offset())
+            delivery.set_result(True)
+        elif _closing.is_set() or attempt >= len(KAFKA_RETRY_DELAYS_SECONDS):
+            # Failing the future lets the consumer restart from the message instead of waiting for it forever
+            logger.error(
+                "Failed to deliver message to %s for phone %s after %d attempts: %s", topic, key, attempt + 1, err
+            )
+            delivery.set_exception(Exception(str(err)))
+        else:
+            # Runs in the thread serving delivery reports, the message is produced again by the poll loop
+            delay = KAFKA_RETRY_DELAYS_SECONDS[attempt]
+            logger.error(
+                "Failed to deliver message to %s for phone %s: %s. Retrying in %.0f seconds", topic, key, err, delay
+            )
+            _schedule_retry(time.monotonic() + delay, (topic, value, key, delivery, headers, attempt + 1))
+
+    producer.produce(topic, key=key, value=value, headers=headers, on_delivery=on_delivery)
+
+
+def _schedule_retry(due: float, args: tuple):
+    with _retries_lock:
+        heapq.heappush(_retries, (due, next(_retry_order), args))
+
+
+def _produce_due_retries():
+    """Produce the failed messages whose retry delay passed, a full producer queue leaves them for the next poll."""
+
+    now = time.monotonic()
+    while True:
+        with _retries_lock:
+            if not _retries or _retries[0][0] > now:
+                return
+            due, order, args = heapq.heappop(_retries)
+
+        try:
+            _produce(*args)
+        except BufferError:
+            with _retries_lock:
+                heapq.heappush(_retries, (due, order, args))
+            return
+        except Exception as e:
+            logger.error("Cannot produce message to %s for phone %s again: %s", args[0], args[2], e)
+            args[3].set_exception(e)
+
+
+def send_raw(topic: str, value: str | bytes, key: str, headers: dict | None = None) -> Future:
+    """Queue a message for delivery without waiting for the broker. The returned future resolves on delivery."""
+
+    delivery = Future()
+    while True:
+        try:
+            _produce(topic, value, key, delivery, headers)
+            break
+        except BufferError:
+            logger.warning("Kafka producer queue is full, waiting for deliveries...")
+            producer.poll(1)
+
+    deliveries = _deliveries.get()
+    if deliveries is not None:
+        deliveries.append(delivery)
+    producer.poll(0)
+    return delivery
+
+
+def send(topic: KafkaTopic, payload: dict, phone: str) -> Future:
+    logger.debug("Sending message to %s topic for phone: %s", topic.value, phone)
+    return send_raw(topic.value, json.dumps(payload), phone)
+
+
+def send_to_responses(payload: dict, phone: str) -> Future:
+    delivery = send(KafkaTopic.SMS_RESPONSES, payload, phone)
+    logger.info("Message queued to sms_responses for phone: %s", phone)
+    return delivery
+
+
+def send_to_failed(payload: dict, phone: str) -> Future:
+    delivery = send(KafkaTopic.FAILED_MESSAGES, payload, phone)
+    FAILED_MESSAGES.inc()
+    logger.info("Message queued to failed_messages for phone: %s", phone)
+    return delivery
+
+
+def poll_deliveries(stop_event: threading.Event):
+    """Serve delivery reports and produce the failed messages again until the service stops."""
+
+    while not stop_event.is_set():
+        producer.poll(0.5)
+        _produce_due_retries()
+
+
+def flush(timeout: float) -> int:
+    """Deliver every queued message before shutdown, returns the number of messages still not delivered."""
+
+    remaining = producer.flush(timeout)
+    _closing.set()
+    with _retries_lock:
+        retries, _retries[:] = list(_retries), []
+    for _, _, args in retries:
+        args[3].set_exception(Exception("Kafka producer closed before the message could be retried"))
+        remaining += 1
+    if remaining:
+        logger.error("%d messages were not delivered to Kafka before shutdown", remaining)
+    return remaining
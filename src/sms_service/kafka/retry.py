@@ -0,0 +1,86 @@
+import json
+import logging
+import time
+from concurrent.futures import Future
+from typing import Callable, List
+
+from confluent_kafka import Message
+
+from kafka.producer import send_raw
+from utils.metrics import DEAD_LETTER_MESSAGES, RETRIED_MESSAGES
+
+logger = logging.getLogger(__name__)
+
+ATTEMPT_HEADER = "x-attempt"
+LAST_ERROR_HEADER = "x-last-error"
+ORIGINAL_TOPIC_HEADER = "x-original-topic"
+RETRY_AT_HEADER = "x-retry-at"
+
+
+def retry_topic(topic: str, hop: int) -> str:
+    return f"{topic}_retry_{hop}"
+
+
+def dead_letter_topic(topic: str) -> str:
+    return f"{topic}_dlq"
+
+
+def get_header(msg: Message, name: str) -> str | None:
+    for key, value in msg.headers() or []:
+        if key == name and value is not None:
+            return value.decode("utf-8") if isinstance(value, bytes) else value
+    return None
+
+
+def get_attempt(msg: Message) -> int:
+    """Number of times the message was already handled without success."""
+
+    attempt = get_header(msg, ATTEMPT_HEADER)
+    return int(attempt) if attempt else 0
+
+
+def get_retry_at(msg: Message) -> float:
+    retry_at = get_header(msg, RETRY_AT_HEADER)
+    return float(retry_at) if retry_at else 0.0
+
+
+def get_max_attempts(msg: Message, delays: List[float]) -> int:
+    """The retries field of the payload caps the attempts across all retry hops."""
+
+    max_attempts = len(delays) + 1
+    try:
+        retries = json.loads(msg.value().decode("utf-8")).get("retries")
+    except Exception:
+        return max_attempts
+    return min(max_attempts, max(int(retries), 1)) if retries else max_attempts
+
+
+def route_failure(
+    msg: Message,
+    error: str,
+    delays: List[float],
+    on_dead_letter: Callable[[Message], None] | None = None,
+) -> Future:
+    """
+    Publish a failed message to the next retry topic, or to the dead letter topic once its attempts are used up.
+    The attempt count, the last error and the time the retry is due travel in the message headers.
+    """
+
+    topic = get_header(msg, ORIGINAL_TOPIC_HEADER) or msg.topic()
+    attempt = get_attempt(msg) + 1
+    headers = {ATTEMPT_HEADER: str(attempt), LAST_ERROR_HEADER: error[:1000], ORIGINAL_TOPIC_HEADER: topic}
+
+    if attempt < get_max_attempts(msg, delays):
+        target = retry_topic(topic, attempt)
+        headers[RETRY_AT_HEADER] = str(time.time() + delays[attempt - 1])
+        RETRIED_MESSAGES.labels(topic).inc()
+        logger.warning("Message from %s failed (attempt %d): %s. Retrying through %s", topic, attempt, error, target)
+    else:
+        target = dead_letter_topic(topic)
+        DEAD_LETTER_MESSAGES.labels(topic).inc()
+        logger.error("Message from %s failed (attempt %d): %s. Moving to %s", topic, attempt, error, target)
+        if on_dead_letter:
+            on_dead_letter(msg)
+
+    key = msg.key().decode("utf-8") if isinstance(msg.key(), bytes) else msg.key()
+    return send_raw(target, msg.value(), key, headers)
@@ -1,30 +1,108 @@
+import asyncio
 import concurrent.futures
+import functools
+import json
 import logging
+import os
 import signal
 import threading
 import time
 
+from confluent_kafka import Message
+
 from config import (
+    ASYNC_MAX_IN_FLIGHT,
+    ASYNC_WORKER_THREADS,
     DB_PATH,
+    DESTINATION_MIN_INTERVAL_SECONDS,
+    HANDLER_WORKERS,
+    KAFKA_FLUSH_TIMEOUT_SECONDS,
+    KAFKA_RETRY_DELAYS_SECONDS,
+    MAX_IN_FLIGHT_PER_PARTITION,
+    METRICS_PORT,
+    MODEM_COOLDOWN_SECONDS,
+    MODEM_DELETE_AFTER_SECONDS,
+    MODEM_INCREMENTAL_SYNC,
+    MODEM_MAX_FAILURES,
     MODEM_PASSWORD,
-    MODEM_URL,
+    MODEM_PROBE_BASE_SECONDS,
+    MODEM_PROBE_MAX_SECONDS,
+    MODEM_SESSION_MAX_IDLE_SECONDS,
+    MODEM_SESSION_POOL_SIZE,
+    MODEM_SMS_BURST,
+    MODEM_SMS_PER_MINUTE,
+    MODEM_STATS_INTERVAL_SECONDS,
+    MODEM_SYNC_PAGE_SIZE,
+    MODEM_URLS,
     MODEM_USERNAME,
-    NUMBER_OF_PARTITIONS,
+    REPLY_INDEX_MAX_AGE_SECONDS,
+    REPLY_POLL_INTERVAL_SECONDS,
+    RETENTION_INTERVAL_SECONDS,
+    SEND_LANE_MAX_WAIT_SECONDS,
+    SEND_QUEUE_WORKERS,
+    SERVICE_MODE,
+    SMS_ARCHIVE_ENABLED,
+    SMS_RETENTION_DAYS,
+    SMS_RETENTION_MAX_ROWS,
     KafkaTopic,
 )
-from kafka.consumers import consume_loop
-from kafka.handlers.configuration_handler import handle_sms_configuration
-from kafka.handlers.verification_handler import handle_sms_verification
+from kafka import producer
+from kafka.consumers import AsyncTopicConsumer, TopicConsumer
+from kafka.dispatcher import AsyncKeyedDispatcher, KeyedDispatcher
+from kafka.handlers.configuration_handler import handle_sms_configuration, handle_sms_configuration_async
+from kafka.handlers.reply_matcher import ReplyMatcher
+from kafka.handlers.verification_handler import handle_sms_verification, handle_sms_verification_async
+from kafka.producer import send_to_failed
+from kafka.retry import retry_topic, route_failure
+from modem.health import ModemHealthMonitor
 from modem.huawei_modem_client import HuaweiModemClient
-from utils.logging import setup_logging
+from modem.modem_pool import ModemPool
+from modem.send_queue import PrioritySendQueue
+from storage.pending_replies import PendingReplyStore
+from storage.retention import RetentionManager
+from storage.send_ledger import SendLedger
+from utils.logging import reload_log_levels, setup_logging
+from utils.metrics import start_metrics_server
 
 logger = logging.getLogger(__name__)
 stop_event = threading.Event()
+# Delivery reports are served until the consumers have committed their last messages
+deliveries_stop_event = threading.Event()
+
+
+def build_topic_handler_map(
+    pending_replies: PendingReplyStore, send_queue: PrioritySendQueue, send_ledger: SendLedger, asynchronous=False
+) -> dict:
+    verification_handler = handle_sms_verification_async if asynchronous else handle_sms_verification
+    configuration_handler = handle_sms_configuration_async if asynchronous else handle_sms_configuration
+    return {
+        KafkaTopic.SMS_VERIFICATION.value: functools.partial(
+            verification_handler, send_queue=send_queue, send_ledger=send_ledger
+        ),
+        KafkaTopic.SMS_CONFIGURATION.value: functools.partial(
+            configuration_handler, pending_replies=pending_replies, send_queue=send_queue, send_ledger=send_ledger
+        ),
+    }
+
+
+def restore_pending_replies(pending_replies: PendingReplyStore, reply_matcher: ReplyMatcher, partitions: list):
+    """Pending replies are kept in the local store across restarts and rebalances, resolve them right away."""
+
+    logger.info("Restored %d pending replies on assignment of %s", len(pending_replies.get_awaiting()), partitions)
+    reply_matcher.wake()
+
+
+def report_dead_letter(msg: Message):
+    """A message which used up its retries is reported to the backend as failed."""
+
+    try:
+        data = json.loads(msg.value().decode("utf-8"))
+        send_to_failed(data, data["phone"])
+    except Exception as e:
+        logger.error("Error while reporting dead letter message %s: %s", msg.value(), e)
 
-TOPIC_HANDLER_MAP = {
-    KafkaTopic.SMS_VERIFICATION.value: handle_sms_verification,
-    KafkaTopic.SMS_CONFIGURATION.value: handle_sms_configuration,
-}
+
+on_failure = functools.partial(route_failure, delays=KAFKA_RETRY_DELAYS_SECONDS, on_dead_letter=report_dead_letter)
 
 
 def signal_handler(signum, frame):
@@ -32,32 +110,226 @@ def signal_handler(signum, frame):
     stop_event.set()
 
 
-def main():
-    logger.debug("Initializing Huawei modem client...")
-    modem = HuaweiModemClient(url=MODEM_URL, db_path=DB_PATH, username=MODEM_USERNAME, password=MODEM_PASSWORD)
+def get_modem_db_path(index: int, name: str) -> str:
+    """The first modem keeps the original store, every other modem gets its own store next to it."""
+
+    if index == 0:
+        return DB_PATH
+    root, ext = os.path.splitext(DB_PATH)
+    return f"{root}_{name}{ext}"
+
+
+def create_modem_pool() -> ModemPool:
+    clients = []
+    for index, (name, url) in enumerate(MODEM_URLS.items()):
+        logger.debug("Initializing Huawei modem client %s...", name)
+        clients.append(
+            HuaweiModemClient(
+                url=url,
+                db_path=get_modem_db_path(index, name),
+                username=MODEM_USERNAME,
+                password=MODEM_PASSWORD,
+                incremental_sync=MODEM_INCREMENTAL_SYNC,
+                sync_page_size=MODEM_SYNC_PAGE_SIZE,
+                session_pool_size=MODEM_SESSION_POOL_SIZE,
+                session_max_idle_seconds=MODEM_SESSION_MAX_IDLE_SECONDS,
+                name=name,
+                sms_per_minute=MODEM_SMS_PER_MINUTE,
+                sms_burst=MODEM_SMS_BURST,
+                reply_index_max_age_seconds=REPLY_INDEX_MAX_AGE_SECONDS,
+            )
+        )
+    return ModemPool(
+        clients,
+        max_failures=MODEM_MAX_FAILURES,
+        cooldown_seconds=MODEM_COOLDOWN_SECONDS,
+        destination_min_interval=DESTINATION_MIN_INTERVAL_SECONDS,
+    )
+
+
+def build_consumers(consumer_cls, topic_handler_map: dict, dispatcher, on_assign, health: ModemHealthMonitor) -> list:
+    """One group consumer per topic and per retry topic."""
+
+    consumers = []
+    for topic_name, handler in topic_handler_map.items():
+        consumers.append(
+            consumer_cls(
+                handler,
+                topic_name,
+                dispatcher,
+                stop_event,
+                max_in_flight=MAX_IN_FLIGHT_PER_PARTITION,
+                on_assign=on_assign if topic_name == KafkaTopic.SMS_CONFIGURATION.value else None,
+                health=health,
+            )
+        )
+        for hop in range(1, len(KAFKA_RETRY_DELAYS_SECONDS) + 1):
+            consumers.append(
+                consumer_cls(
+                    handler,
+                    retry_topic(topic_name, hop),
+                    dispatcher,
+                    stop_event,
+                    max_in_flight=MAX_IN_FLIGHT_PER_PARTITION,
+                    delayed=True,
+                    health=health,
+                )
+            )
+    return consumers
+
 
-    # Thread pool for processing messages per partition
-    logger.debug("Starting thread pool with %s workers", NUMBER_OF_PARTITIONS * len(TOPIC_HANDLER_MAP))
+def run_threads(
+    modem: ModemPool,
+    send_queue: PrioritySendQueue,
+    reply_matcher: ReplyMatcher,
+    health: ModemHealthMonitor,
+    handler_kwargs: dict,
+):
+    reply_matcher.start()
+
+    logger.debug("Starting dispatcher with %s workers", HANDLER_WORKERS)
+    dispatcher = KeyedDispatcher(modem, workers=HANDLER_WORKERS, on_failure=on_failure)
+    topic_handler_map = build_topic_handler_map(**handler_kwargs)
+    on_assign = functools.partial(restore_pending_replies, handler_kwargs["pending_replies"], reply_matcher)
+    consumers = build_consumers(TopicConsumer, topic_handler_map, dispatcher, on_assign, health)
+
+    # Thread pool with one group consumer per topic and retry topic
+    logger.debug("Starting thread pool with %s workers", len(consumers))
     with concurrent.futures.ThreadPoolExecutor(
-        max_workers=NUMBER_OF_PARTITIONS * len(TOPIC_HANDLER_MAP), thread_name_prefix="KafkaHandler"
+        max_workers=len(consumers), thread_name_prefix="KafkaConsumer"
     ) as executor:
-        for topic_name, handler in TOPIC_HANDLER_MAP.items():
-            for partition in range(NUMBER_OF_PARTITIONS):
-                executor.submit(consume_loop, handler, partition, topic_name, modem, stop_event)
+        for consumer in consumers:
+            executor.submit(consumer.run)
 
         logger.info("Service started. Listening for messages.")
 
         try:
+            last_stats = time.time()
             while not stop_event.is_set():
                 time.sleep(1)
+                if time.time() - last_stats >= MODEM_STATS_INTERVAL_SECONDS:
+                    modem.log_stats()
+                    send_queue.log_stats()
+                    last_stats = time.time()
         finally:
             logger.info("Stopping executor...")
             stop_event.set()
             executor.shutdown(wait=True)
+            dispatcher.shutdown()
+
+
+async def run_asyncio(
+    modem: ModemPool,
+    send_queue: PrioritySendQueue,
+    reply_matcher: ReplyMatcher,
+    health: ModemHealthMonitor,
+    handler_kwargs: dict,
+):
+    """
+    Runs the consumers, the handlers and the reply matcher on one event loop. Blocking Kafka polls, modem and
+    store calls go to a small thread pool, while messages waiting for the modem or for a retry hold no thread.
+    """
+
+    consumer_count = len(build_topic_handler_map(**handler_kwargs)) * (len(KAFKA_RETRY_DELAYS_SECONDS) + 1)
+    asyncio.get_running_loop().set_default_executor(
+        concurrent.futures.ThreadPoolExecutor(
+            max_workers=consumer_count + ASYNC_WORKER_THREADS, thread_name_prefix="AsyncWorker"
+        )
+    )
+
+    dispatcher = AsyncKeyedDispatcher(modem, max_in_flight=ASYNC_MAX_IN_FLIGHT, on_failure=on_failure)
+    topic_handler_map = build_topic_handler_map(**handler_kwargs, asynchronous=True)
+    on_assign = functools.partial(restore_pending_replies, handler_kwargs["pending_replies"], reply_matcher)
+    consumers = build_consumers(AsyncTopicConsumer, topic_handler_map, dispatcher, on_assign, health)
+
+    matcher_task = asyncio.create_task(reply_matcher.run_async())
+    consumer_tasks = [asyncio.create_task(consumer.run_async()) for consumer in consumers]
+    logger.info("Service started in asyncio mode. Listening for messages.")
+
+    try:
+        last_stats = time.time()
+        while not stop_event.is_set():
+            await asyncio.sleep(1)
+            if time.time() - last_stats >= MODEM_STATS_INTERVAL_SECONDS:
+                modem.log_stats()
+                send_queue.log_stats()
+                last_stats = time.time()
+    finally:
+        logger.info("Stopping consumers...")
+        stop_event.set()
+        await asyncio.gather(*consumer_tasks)
+        await dispatcher.shutdown()
+        reply_matcher.wake()
+        await matcher_task
+
+
+def main():
+    start_metrics_server(METRICS_PORT)
+    modem = create_modem_pool()
+
+    logger.debug("Starting Kafka delivery report poller...")
+    delivery_poller = threading.Thread(
+        target=producer.poll_deliveries, args=(deliveries_stop_event,), name="KafkaDeliveries", daemon=True
+    )
+    delivery_poller.start()
+
+    pending_replies = PendingReplyStore(db_path=DB_PATH)
+    send_ledger = SendLedger(db_path=DB_PATH)
+
+    logger.debug("Starting modem health monitor...")
+    health = ModemHealthMonitor(
+        modem, stop_event, probe_base_seconds=MODEM_PROBE_BASE_SECONDS, probe_max_seconds=MODEM_PROBE_MAX_SECONDS
+    )
+    health.start()
+
+    logger.debug("Starting send queue...")
+    send_queue = PrioritySendQueue(
+        modem,
+        workers=SEND_QUEUE_WORKERS or len(modem.modems),
+        max_wait_seconds=SEND_LANE_MAX_WAIT_SECONDS,
+        health=health,
+    )
+    send_queue.start()
+
+    reply_matcher = ReplyMatcher(modem, pending_replies, stop_event, interval=REPLY_POLL_INTERVAL_SECONDS)
+
+    logger.debug("Starting retention manager...")
+    retention = RetentionManager(
+        modem,
+        pending_replies,
+        send_ledger,
+        stop_event,
+        interval=RETENTION_INTERVAL_SECONDS,
+        max_age_days=SMS_RETENTION_DAYS,
+        max_rows=SMS_RETENTION_MAX_ROWS,
+        archive=SMS_ARCHIVE_ENABLED,
+        modem_delete_after_seconds=MODEM_DELETE_AFTER_SECONDS,
+    )
+    retention.start()
+
+    handler_kwargs = {"pending_replies": pending_replies, "send_queue": send_queue, "send_ledger": send_ledger}
+    try:
+        if SERVICE_MODE == "asyncio":
+            asyncio.run(run_asyncio(modem, send_queue, reply_matcher, health, handler_kwargs))
+        else:
+            run_threads(modem, send_queue, reply_matcher, health, handler_kwargs)
+    finally:
+        stop_event.set()
+        health.join()
+        send_queue.join()
+        reply_matcher.join()
+        retention.join()
+        deliveries_stop_event.set()
+        delivery_poller.join()
+        producer.flush(KAFKA_FLUSH_TIMEOUT_SECONDS)
+        modem.close()
+        pending_replies.close()
+        send_ledger.close()
 
 
 if __name__ == "__main__":
     setup_logging()
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGHUP, reload_log_levels)
     main()
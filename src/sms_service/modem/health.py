@@ -0,0 +1,113 @@
+import logging
+import threading
+import time
+
+from modem.modem_pool import ModemPool
+from modem.rate_limiter import backoff_delay
+from utils.metrics import MODEM_CIRCUIT_OPEN
+
+logger = logging.getLogger(__name__)
+
+CHECK_INTERVAL_SECONDS = 1
+
+
+class ModemHealthMonitor:
+    """
+    Circuit breaker in front of the modem pool.
+    The circuit opens once every modem of the pool is unhealthy. While it is open the consumers pause their
+    partitions, the send queue keeps its messages instead of failing their attempts, and the monitor probes
+    the modems with exponential backoff. The first modem answering a probe closes the circuit again.
+    """
+
+    def __init__(
+        self,
+        modem_pool: ModemPool,
+        stop_event: threading.Event,
+        probe_base_seconds: float = 5,
+        probe_max_seconds: float = 300,
+    ):
+        self.modem_pool = modem_pool
+        self.stop_event = stop_event
+        self.probe_base_seconds = probe_base_seconds
+        self.probe_max_seconds = probe_max_seconds
+        self._closed = threading.Event()
+        self._closed.set()
+        self._opened_at = 0.0
+        self._probes = 0
+        self._thread: threading.Thread | None = None
+
+    @property
+    def is_open(self) -> bool:
+        return not self._closed.is_set()
+
+    def wait_closed(self, timeout: float | None = None) -> bool:
+        """Wait until the modems are reachable, returns False if the circuit is still open after the timeout."""
+
+        return self._closed.wait(timeout)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="ModemHealth", daemon=True)
+        self._thread.start()
+        logger.debug("Modem health monitor started")
+
+    def join(self, timeout: float | None = None):
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _open(self):
+        self._opened_at = time.time()
+        self._probes = 0
+        self._closed.clear()
+        MODEM_CIRCUIT_OPEN.set(1)
+        logger.error("Every modem is unreachable, pausing consumption until one of them recovers")
+
+    def _close(self, name: str):
+        self._closed.set()
+        MODEM_CIRCUIT_OPEN.set(0)
+        logger.warning(
+            "Modem %s recovered after %.0f seconds, resuming consumption", name, time.time() - self._opened_at
+        )
+
+    def _probe(self) -> bool:
+        """Wait for the next backoff step, then probe every modem and mark the answering ones healthy again."""
+
+        # Not below the base, full jitter alone could probe a down modem in a tight loop
+        delay = max(
+            backoff_delay(self._probes, self.probe_base_seconds, self.probe_max_seconds), self.probe_base_seconds
+        )
+        self._probes += 1
+        if self.stop_event.wait(delay):
+            return False
+
+        recovered = None
+        for client in self.modem_pool.clients:
+            try:
+                client.probe()
+            except Exception as e:
+                logger.info("Modem %s is still unreachable (probe %d): %s", client.name, self._probes, e)
+                # Kept out of routing until it answers a probe, or the longest backoff passed once the circuit closed
+                self.modem_pool.mark_unhealthy(client.name, time.time() + self.probe_max_seconds)
+                continue
+            self.modem_pool.mark_healthy(client.name)
+            recovered = recovered or client.name
+
+        if recovered:
+            self._close(recovered)
+            return True
+        return False
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                if self.is_open:
+                    self._probe()
+                    continue
+                if self.modem_pool.all_unhealthy():
+                    self._open()
+                    continue
+            except Exception as e:
+                logger.error("Error while checking modem health: %s", e)
+            self.stop_event.wait(CHECK_INTERVAL_SECONDS)
+
+        # Nothing waits for the modems during the shutdown
+        self._closed.set()
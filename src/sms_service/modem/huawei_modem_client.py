@@ -1,144 +1,255 @@
+import datetime
 import logging
-import sqlite3
-from typing import List
+import threading
+from typing import Collection, List
 
+from huawei_lte_api.api.Sms import Message
 from huawei_lte_api.Client import Client
-from huawei_lte_api.Connection import Connection
 from huawei_lte_api.enums.client import ResponseEnum
-from huawei_lte_api.enums.sms import BoxTypeEnum
+from huawei_lte_api.enums.sms import BoxTypeEnum, SortTypeEnum, TypeEnum
+from huawei_lte_api.exceptions import ResponseErrorException
+
+from modem.rate_limiter import TokenBucket
+from modem.session import ModemSessionPool
+from storage.database import Database
+from storage.reply_index import ReplyIndex
+from storage.sms_store import SmsStore, get_message_timestamp
 
 logger = logging.getLogger(__name__)
 
+# The modem needs some time to receive all parts of a multipart SMS before it can rebuild it
+MULTIPART_SETTLE_SECONDS = 10
+
 
 class HuaweiModemClient:
-    def __init__(self, url: str, db_path: str = "sms_storage.sqlite3", username: str = None, password: str = None):
+    def __init__(
+        self,
+        url: str,
+        db_path: str = "sms_storage.sqlite3",
+        username: str = None,
+        password: str = None,
+        incremental_sync: bool = True,
+        sync_page_size: int = 20,
+        session_pool_size: int = 1,
+        session_max_idle_seconds: float = 240,
+        name: str = "modem",
+        sms_per_minute: float = 0,
+        sms_burst: int = 1,
+        reply_index_max_age_seconds: float = 1200,
+    ):
+        self.name = name
         self.url = url
         self.username = username
         self.password = password
         self.db_path = db_path
-        self._init_db()
-
-    def _init_db(self):
-        """Initialize the local SQLite database to store sent messages."""
-
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS sms_messages (
-                id INTEGER PRIMARY KEY,
-                phone TEXT,
-                content TEXT,
-                date_time REAL,
-                modem_index INTEGER UNIQUE,
-                message_type TEXT CHECK( message_type IN ('incoming','outgoing') ) NOT NULL
-            )
-        """
+        self.incremental_sync = incremental_sync
+        self.sync_page_size = sync_page_size
+        self.sessions = ModemSessionPool(
+            url,
+            username=username,
+            password=password,
+            size=session_pool_size,
+            max_idle_seconds=session_max_idle_seconds,
+            name=name,
         )
-        conn.commit()
-        conn.close()
-        logger.debug("SQLite database initialized.")
+        self.store = SmsStore(Database(db_path))
+        self.rate_limiter = TokenBucket(sms_per_minute, burst=sms_burst)
+        self._sync_lock = threading.Lock()
+        self.replies = ReplyIndex(reply_index_max_age_seconds)
+        self.replies.add(self.store.get_incoming_since(self.replies.horizon))
+        logger.debug("Reply index of modem %s rebuilt with %d messages", name, len(self.replies))
+
+    def close(self):
+        self.sessions.close()
+        self.store.db.close()
 
     def send_sms(self, phone_number: str, message: str) -> bool:
-        """Send an SMS to a phone number."""
+        """Send an SMS to a phone number, the modem pool keeps the sends within rate_limiter."""
 
         logger.debug("Sending SMS to %s: '%s'", phone_number, message)
 
-        with Connection(self.url, username=self.username, password=self.password) as connection:
-            client = Client(connection)
-            result = client.sms.send_sms([phone_number], message)
-            success = result == ResponseEnum.OK.value
-            if success:
-                logger.debug("SMS successfully sent to %s", phone_number)
-            else:
-                logger.error("Failed to send SMS to %s", phone_number)
-            return success
-
-    def _save_messages(self, messages: List[dict]):
-        """Internal method to save messages to the database."""
-
-        from datetime import datetime
-
-        logger.debug("Saving %d messages to the database...", len(messages))
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        for msg in messages:
-            try:
-                timestamp = datetime.strptime(msg["Date"], "%Y-%m-%d %H:%M:%S").timestamp()
-                cursor.execute(
-                    """
-                    INSERT OR IGNORE INTO sms_messages (phone, content, date_time, modem_index, message_type)
-                    VALUES (?, ?, ?, ?, ?)
-                """,
-                    (msg["Phone"], msg["Content"], timestamp, msg["Index"], msg["message_type"]),
-                )
-                logger.debug("Saved message from phone %s", msg["Phone"])
-            except sqlite3.IntegrityError as e:
-                logger.error("Error while saving message: '%s'. %s", msg, e.sqlite_errorname)
-                continue
-
-        conn.commit()
-        conn.close()
-        logger.debug("All messages saved to the database.")
-
-    def _read_sms(self) -> List[dict]:
-        """Read incoming and outgoing SMS messages and store them."""
-
-        logger.debug("Reading incoming and outgoing SMS messages from modem...")
-        new_messages = []
+        result = self.sessions.call(lambda client: client.sms.send_sms([phone_number], message))
+        success = result == ResponseEnum.OK.value
+        if success:
+            logger.debug("SMS successfully sent to %s", phone_number)
+        else:
+            logger.error("Failed to send SMS to %s", phone_number)
+        return success
+
+    def probe(self):
+        """Cheapest authenticated request, raises if the modem can not be reached."""
+
+        self.sessions.call(lambda client: client.sms.get_sms_list(page=1, read_count=1))
 
-        with Connection(self.url, username=self.username, password=self.password) as connection:
-            client = Client(connection)
+    @staticmethod
+    def _read_box(client: Client, box_type: BoxTypeEnum, message_type: str) -> List[dict]:
+        """Read every message from the given box."""
 
-            for msg in client.sms.get_messages(box_type=BoxTypeEnum.LOCAL_INBOX):
-                logger.debug("Read incoming SMS from %s", msg.phone)
-                new_messages.append({**msg.to_dict(), "message_type": "incoming"})
+        return [{**msg.to_dict(), "message_type": message_type} for msg in client.sms.get_messages(box_type=box_type)]
+
+    def _read_box_incremental(self, client: Client, box_type: BoxTypeEnum, message_type: str) -> List[dict]:
+        """
+        Read only the messages that are newer than the stored sync state of the given box.
+        Pages are requested newest first, so reading stops at the first already stored message.
+        """
+
+        last_index, last_date = self.store.get_sync_state(box_type.value)
+        new_messages = []
+        max_index, max_date = last_index, last_date
+        unsettled_index = None
+        now = datetime.datetime.now()
+        page = 1
+
+        while True:
+            response = client.sms.get_sms_list(
+                page=page, box_type=box_type, read_count=self.sync_page_size, sort_type=SortTypeEnum.DATE
+            )
+            raw_messages = response.get("Messages", {}).get("Message", []) if int(response.get("Count", 0)) else []
+
+            reached_stored = False
+            for raw_message in raw_messages:
+                msg = Message.from_dict(raw_message)
+                timestamp = msg.date_time.timestamp()
+                if msg.index <= last_index and timestamp <= last_date:
+                    reached_stored = True
+                    break
+
+                if (
+                    msg.type == TypeEnum.MULTIPART
+                    and msg.date_time + datetime.timedelta(seconds=MULTIPART_SETTLE_SECONDS) > now
+                ):
+                    # Not complete yet, it must be read again on the next sync
+                    unsettled_index = msg.index if unsettled_index is None else min(unsettled_index, msg.index)
+                    continue
+
+                new_messages.append({**msg.to_dict(), "message_type": message_type})
+                max_index, max_date = max(max_index, msg.index), max(max_date, timestamp)
+
+            if reached_stored or len(raw_messages) < self.sync_page_size:
+                break
+            page += 1
+
+        if unsettled_index is not None:
+            max_index = min(max_index, unsettled_index - 1)
+
+        logger.debug("Read %d new messages from box %s in %d page(s)", len(new_messages), box_type.name, page)
+        self.store.save_messages(new_messages)
+        if (max_index, max_date) != (last_index, last_date):
+            self.store.set_sync_state(box_type.value, max_index, max_date)
+        return new_messages
 
-            for msg in client.sms.get_messages(box_type=BoxTypeEnum.LOCAL_SENT):
-                logger.debug("Read outgoing SMS to %s", msg.phone)
-                new_messages.append({**msg.to_dict(), "message_type": "outgoing"})
+    def _read_sms(self, include_sent: bool = True) -> List[dict]:
+        """Read incoming and, if requested, outgoing SMS messages and store them."""
+
+        logger.debug("Reading SMS messages from modem (include_sent=%s)...", include_sent)
+        boxes = [(BoxTypeEnum.LOCAL_INBOX, "incoming")]
+        if include_sent:
+            boxes.append((BoxTypeEnum.LOCAL_SENT, "outgoing"))
+        return self._read_boxes(boxes)
+
+    def _read_boxes(self, boxes: List[tuple[BoxTypeEnum, str]]) -> List[dict]:
+        """Read the given boxes as (box_type, message_type) and store their messages."""
+
+        def read_boxes(client: Client) -> List[dict]:
+            messages = []
+            for box_type, message_type in boxes:
+                if self.incremental_sync:
+                    messages.extend(self._read_box_incremental(client, box_type, message_type))
+                else:
+                    box_messages = self._read_box(client, box_type, message_type)
+                    self.store.save_messages(box_messages)
+                    messages.extend(box_messages)
+            return messages
+
+        with self._sync_lock:
+            new_messages = self.sessions.call(read_boxes)
+        self._index_replies(new_messages)
 
-        self._save_messages(new_messages)
         logger.debug("Finished reading and saving %d new SMS messages.", len(new_messages))
         return new_messages
 
+    def _index_replies(self, messages: List[dict]):
+        """Push incoming messages into the reply index, after they are stored."""
+
+        self.replies.add(
+            (msg["Phone"], msg["Content"], get_message_timestamp(msg), int(msg["Index"]))
+            for msg in messages
+            if msg["message_type"] == "incoming"
+        )
+        self.replies.prune()
+
+    def delete_stored_messages_from_modem(self, older_than_ts: float, batch_size: int = 50) -> int:
+        """Delete messages from the modem boxes which are already stored locally and older than the given time."""
+
+        indexes = self.store.get_modem_indexes_to_delete(older_than_ts, batch_size)
+        if not indexes:
+            return 0
+
+        def delete_messages(client: Client) -> List[int]:
+            deleted = []
+            for index in indexes:
+                try:
+                    result = client.sms.delete_sms(index)
+                except ResponseErrorException as e:
+                    # Most likely removed from the modem already, do not try again
+                    logger.warning("Modem %s refused to delete message %s: %s", self.name, index, e)
+                    deleted.append(index)
+                    continue
+                if result == ResponseEnum.OK.value:
+                    deleted.append(index)
+                else:
+                    logger.error("Failed to delete message %s from modem %s", index, self.name)
+            return deleted
+
+        # Deleting while an incremental sync is paging would shift the pages under it
+        with self._sync_lock:
+            deleted = self.sessions.call(delete_messages)
+
+        self.store.mark_deleted_from_modem(deleted)
+        logger.info("Deleted %d stored messages from modem %s", len(deleted), self.name)
+        return len(deleted)
+
     def get_all_stored_sms(self) -> List[dict]:
         """Get all stored SMS from the local database."""
 
         logger.debug("Fetching all stored SMS messages from the database...")
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT phone, content, date_time, message_type FROM sms_messages")
-        rows = cursor.fetchall()
-        conn.close()
+        messages = self.store.get_all()
+        logger.debug("Fetched %d SMS messages.", len(messages))
+        return messages
 
-        logger.debug("Fetched %d SMS messages.", len(rows))
-        return [{"phone": row[0], "content": row[1], "date_time": row[2], "message_type": row[3]} for row in rows]
+    def sync_inbox(self) -> List[dict]:
+        """Sync incoming modem messages to the local DB and return the newly stored ones."""
 
-    def get_reply_from_phone_since(self, phone: str, since_timestamp: float) -> str | None:
-        """Returns the first incoming message from a given phone number that was received after the given timestamp."""
+        return self._read_sms(include_sent=False)
 
-        self._read_sms()  # Sync modem messages to local DB
-
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT content FROM sms_messages
-            WHERE phone = ?
-              AND message_type = 'incoming'
-              AND date_time >= ?
-            ORDER BY date_time ASC
-            LIMIT 1
-        """,
-            (phone, since_timestamp),
-        )
-        row = cursor.fetchone()
-        conn.close()
+    def sync_sent(self) -> List[dict]:
+        """Sync the sent box to the local DB, so the sent messages can be deleted from the modem like the incoming."""
 
-        if row:
-            logger.info("Found reply from %s: %s", phone, row[0])
-            return row[0]
+        return self._read_boxes([(BoxTypeEnum.LOCAL_SENT, "outgoing")])
+
+    def find_reply(self, phone: str, since_timestamp: float, exclude: Collection[int] = ()) -> tuple[int, str] | None:
+        """
+        First stored incoming message from the phone received after the given timestamp, as (modem_index, content).
+        Messages whose modem index is in exclude were already taken as the reply of another command.
+        """
+
+        if since_timestamp >= self.replies.horizon:
+            reply = self.replies.get_reply_since(phone, since_timestamp, exclude)
+        else:
+            # Older than the replies kept in memory
+            reply = self.store.get_reply_from_phone_since(phone, since_timestamp, exclude)
+        if reply:
+            logger.info("Found reply from %s: %s", phone, reply[1])
+        return reply
+
+    def get_stored_reply_from_phone_since(self, phone: str, since_timestamp: float) -> str | None:
+        """Returns the first stored incoming message from a given phone number received after the given timestamp."""
+
+        reply = self.find_reply(phone, since_timestamp)
+        return reply[1] if reply else None
+
+    def get_reply_from_phone_since(self, phone: str, since_timestamp: float) -> str | None:
+        """Returns the first incoming message from a given phone number that was received after the given timestamp."""
 
-        return None
+        self.sync_inbox()
+        return self.get_stored_reply_from_phone_since(phone, since_timestamp)
@@ -0,0 +1,201 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import List
+
+from modem.huawei_modem_client import HuaweiModemClient
+from modem.rate_limiter import DestinationPacer
+from utils.metrics import SEND_SECONDS
+
+logger = logging.getLogger(__name__)
+
+THROUGHPUT_WINDOW_SECONDS = 60
+
+
+class PooledModem:
+    """A modem client together with its load and health statistics."""
+
+    def __init__(self, client: HuaweiModemClient, max_failures: int, cooldown_seconds: float):
+        self.client = client
+        self.max_failures = max_failures
+        self.cooldown_seconds = cooldown_seconds
+        self.in_flight = 0
+        self.sent = 0
+        self.failed = 0
+        self.consecutive_failures = 0
+        self.unhealthy_until = 0.0
+        self.total_send_seconds = 0.0
+        self._recent_sends: deque[float] = deque()
+
+    @property
+    def name(self) -> str:
+        return self.client.name
+
+    def is_healthy(self, now: float) -> bool:
+        return now >= self.unhealthy_until
+
+    def sent_last_window(self, now: float) -> int:
+        while self._recent_sends and self._recent_sends[0] < now - THROUGHPUT_WINDOW_SECONDS:
+            self._recent_sends.popleft()
+        return len(self._recent_sends)
+
+    def record(self, success: bool, duration: float, now: float):
+        self.total_send_seconds += duration
+        if success:
+            self.sent += 1
+            self.consecutive_failures = 0
+            self._recent_sends.append(now)
+            return
+
+        self.failed += 1
+        self.consecutive_failures += 1
+        if self.consecutive_failures >= self.max_failures:
+            logger.warning("Modem %s failed %d times in a row, pausing routing to it", self.name, self.max_failures)
+            self.unhealthy_until = now + self.cooldown_seconds
+            self.consecutive_failures = 0
+
+    def mark_healthy(self):
+        self.unhealthy_until = 0.0
+        self.consecutive_failures = 0
+
+    def stats(self, now: float) -> dict:
+        attempts = self.sent + self.failed
+        return {
+            "modem": self.name,
+            "healthy": self.is_healthy(now),
+            "queue_depth": self.in_flight,
+            "sent": self.sent,
+            "failed": self.failed,
+            "sent_per_minute": self.sent_last_window(now) * 60 / THROUGHPUT_WINDOW_SECONDS,
+            "avg_send_seconds": self.total_send_seconds / attempts if attempts else 0.0,
+        }
+
+
+class ModemPool:
+    """
+    Routes outgoing SMS between several modems.
+    A destination keeps using the modem that last sent to it while that modem is healthy, so device replies
+    arrive on the same modem. New destinations go to the healthy modem with the fewest queued sends among those
+    whose send rate allows a message now, or to the one that allows it first.
+    """
+
+    def __init__(
+        self,
+        clients: List[HuaweiModemClient],
+        max_failures: int = 3,
+        cooldown_seconds: float = 60,
+        destination_min_interval: float = 0,
+    ):
+        if not clients:
+            raise ValueError("Modem pool needs at least one modem")
+
+        self.modems = {client.name: PooledModem(client, max_failures, cooldown_seconds) for client in clients}
+        self.default = clients[0]
+        self._sticky: dict[str, str] = {}
+        self.pacer = DestinationPacer(destination_min_interval)
+        self._lock = threading.Lock()
+
+    @property
+    def clients(self) -> List[HuaweiModemClient]:
+        return [modem.client for modem in self.modems.values()]
+
+    def get(self, name: str | None) -> HuaweiModemClient:
+        """Return the modem client with the given name, or the default one for unknown names."""
+
+        modem = self.modems.get(name) if name else None
+        return modem.client if modem else self.default
+
+    def _route(self, phone: str, now: float) -> PooledModem:
+        sticky = self.modems.get(self._sticky.get(phone))
+        if sticky and sticky.is_healthy(now):
+            return sticky
+
+        candidates = [modem for modem in self.modems.values() if modem.is_healthy(now)] or list(self.modems.values())
+        return min(
+            candidates,
+            key=lambda modem: (modem.client.rate_limiter.ready_in(), modem.in_flight, modem.sent_last_window(now)),
+        )
+
+    def all_unhealthy(self) -> bool:
+        now = time.time()
+        with self._lock:
+            return not any(modem.is_healthy(now) for modem in self.modems.values())
+
+    def mark_healthy(self, name: str):
+        with self._lock:
+            self.modems[name].mark_healthy()
+
+    def mark_unhealthy(self, name: str, until: float):
+        with self._lock:
+            modem = self.modems[name]
+            modem.unhealthy_until = max(modem.unhealthy_until, until)
+
+    def get_modem_for(self, phone: str) -> HuaweiModemClient:
+        """Return the modem that sent the last SMS to the phone, or the one a new SMS would be routed to."""
+
+        with self._lock:
+            return self._route(phone, time.time()).client
+
+    def reserve(self, phone_number: str) -> tuple[str | None, float]:
+        """
+        Route an SMS to the phone and take its send slot when the destination pace and the rate of the routed modem
+        allow it now. Returns the name of the modem to send it through, or None and the seconds to wait first.
+        """
+
+        with self._lock:
+            modem = self._route(phone_number, time.time())
+            delay = max(self.pacer.ready_in(phone_number), modem.client.rate_limiter.ready_in())
+            if delay > 0:
+                return None, delay
+
+            self.pacer.reserve(phone_number)
+            modem.client.rate_limiter.take()
+            return modem.name, 0.0
+
+    def send_sms(self, phone_number: str, message: str, modem_name: str | None = None) -> tuple[bool, str]:
+        """
+        Send the SMS through the given modem, as returned by reserve, or else through the routed one.
+        Returns whether it was sent and the name of the modem it went through.
+        """
+
+        with self._lock:
+            modem = self.modems.get(modem_name) if modem_name else None
+            modem = modem or self._route(phone_number, time.time())
+            modem.in_flight += 1
+
+        started = time.time()
+        success = False
+        try:
+            success = modem.client.send_sms(phone_number, message)
+            return success, modem.name
+        finally:
+            duration = time.time() - started
+            SEND_SECONDS.labels(modem.name, "success" if success else "failure").observe(duration)
+            with self._lock:
+                modem.in_flight -= 1
+                modem.record(success, duration, time.time())
+                if success:
+                    self._sticky[phone_number] = modem.name
+
+    def stats(self) -> List[dict]:
+        now = time.time()
+        with self._lock:
+            return [modem.stats(now) for modem in self.modems.values()]
+
+    def log_stats(self):
+        for stats in self.stats():
+            logger.info(
+                "Modem %s: healthy=%s, queue_depth=%d, sent=%d, failed=%d, sent_per_minute=%.1f, avg_send=%.2fs",
+                stats["modem"],
+                stats["healthy"],
+                stats["queue_depth"],
+                stats["sent"],
+                stats["failed"],
+                stats["sent_per_minute"],
+                stats["avg_send_seconds"],
+            )
+
+    def close(self):
+        for client in self.clients:
+            client.close()
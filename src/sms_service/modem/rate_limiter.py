@@ -0,0 +1,80 @@
+import logging
+import random
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Limits the send rate to rate_per_minute on average, allowing bursts of up to burst messages.
+    It never waits itself, a sender checks ready_in and defers the message instead of holding its thread.
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int = 1):
+        self.rate = rate_per_minute / 60
+        self.capacity = max(burst, 1)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def ready_in(self) -> float:
+        """Seconds until a token is available, 0 when one can be taken now."""
+
+        if self.rate <= 0:
+            return 0.0
+
+        with self._lock:
+            self._refill(time.monotonic())
+            return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    def take(self):
+        if self.rate <= 0:
+            return
+
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens -= 1
+
+
+class DestinationPacer:
+    """
+    Keeps at least min_interval seconds between two messages to the same destination.
+    Like TokenBucket it only tells how long a message has to wait, reserve records a message sent now.
+    """
+
+    def __init__(self, min_interval: float):
+        self.min_interval = min_interval
+        self._next_allowed: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _prune(self, now: float):
+        for phone in [phone for phone, ts in self._next_allowed.items() if ts < now]:
+            del self._next_allowed[phone]
+
+    def ready_in(self, phone: str) -> float:
+        """Seconds until a message may be sent to the phone, 0 when it may be sent now."""
+
+        with self._lock:
+            return max(0.0, self._next_allowed.get(phone, 0.0) - time.monotonic())
+
+    def reserve(self, phone: str):
+        if self.min_interval <= 0:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+            if len(self._next_allowed) > 1000:
+                self._prune(now)
+            self._next_allowed[phone] = now + self.min_interval
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Exponential backoff with full jitter for the given zero based attempt."""
+
+    return random.uniform(0, min(cap, base * 2**attempt))
@@ -0,0 +1,189 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from enum import IntEnum
+from typing import List
+
+from modem.health import ModemHealthMonitor
+from modem.modem_pool import ModemPool
+
+logger = logging.getLogger(__name__)
+
+
+class SendLane(IntEnum):
+    """Send priority lanes, a lower value is sent first."""
+
+    VERIFICATION = 0
+    INTERACTIVE = 1
+    BULK = 2
+
+
+class QueuedSms:
+    def __init__(self, phone: str, message: str, lane: SendLane):
+        self.phone = phone
+        self.message = message
+        self.lane = lane
+        self.enqueued_at = time.monotonic()
+        self.result: Future = Future()
+
+
+class LaneStats:
+    def __init__(self):
+        self.sent = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record(self, wait: float):
+        self.sent += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+
+class PrioritySendQueue:
+    """
+    Prioritized queue in front of the modem pool.
+    Every SMS goes through a fixed number of sender threads, which always take the highest priority lane first,
+    so verification codes are not queued behind bulk configuration commands. A message waiting longer than
+    max_wait_seconds is sent next regardless of its lane, so lower lanes are never starved.
+    A message the destination pace or the modem rate does not allow yet is set aside until it does, and the sender
+    takes the next message meanwhile instead of sleeping.
+    While the modem circuit is open the messages stay queued instead of failing their attempts.
+    """
+
+    def __init__(
+        self,
+        modem_pool: ModemPool,
+        workers: int = 1,
+        max_wait_seconds: float = 30,
+        health: ModemHealthMonitor | None = None,
+    ):
+        self.modem_pool = modem_pool
+        self.health = health
+        self.workers = max(workers, 1)
+        self.max_wait_seconds = max_wait_seconds
+        self._lanes = {lane: deque() for lane in SendLane}
+        # Paced messages as (not before, order, message), they go back to the head of their lane when due
+        self._deferred: List[tuple[float, int, QueuedSms]] = []
+        self._deferred_order = itertools.count()
+        self._stats = {lane: LaneStats() for lane in SendLane}
+        self._condition = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._closed = False
+
+    def start(self):
+        for index in range(self.workers):
+            thread = threading.Thread(target=self.run, name=f"SmsSender-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.debug("Send queue started with %d senders", self.workers)
+
+    def join(self, timeout: float | None = None):
+        """Send everything still queued and stop the senders, called once no more messages are submitted."""
+
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def submit(self, phone: str, message: str, lane: SendLane) -> Future:
+        item = QueuedSms(phone, message, lane)
+        with self._condition:
+            self._lanes[lane].append(item)
+            self._condition.notify()
+        return item.result
+
+    def send_sms(self, phone: str, message: str, lane: SendLane = SendLane.INTERACTIVE) -> tuple[bool, str]:
+        """Queue the SMS and wait until a sender has sent it, returns the result of ModemPool.send_sms."""
+
+        return self.submit(phone, message, lane).result()
+
+    def _next(self, now: float) -> QueuedSms | None:
+        due = {}
+        while self._deferred and self._deferred[0][0] <= now:
+            _, _, item = heapq.heappop(self._deferred)
+            due.setdefault(item.lane, []).append(item)
+        for lane, items in due.items():
+            # Ahead of the queued messages, in the order they became due
+            self._lanes[lane].extendleft(reversed(items))
+
+        heads = [queue[0] for queue in self._lanes.values() if queue]
+        if not heads:
+            return None
+
+        starving = [item for item in heads if now - item.enqueued_at >= self.max_wait_seconds]
+        if starving:
+            item = min(starving, key=lambda item: item.enqueued_at)
+        else:
+            item = min(heads, key=lambda item: item.lane)
+        return self._lanes[item.lane].popleft()
+
+    def _take(self) -> QueuedSms | None:
+        """Wait for the next message ready to be sent, returns None once closed and everything is sent."""
+
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                item = self._next(now)
+                if item is not None:
+                    return item
+                if self._closed and not self._deferred:
+                    return None
+                self._condition.wait(self._deferred[0][0] - now if self._deferred else None)
+
+    def _defer(self, item: QueuedSms, delay: float):
+        with self._condition:
+            heapq.heappush(self._deferred, (time.monotonic() + delay, next(self._deferred_order), item))
+            # A sender waiting without a timeout has to learn about the deferred message
+            self._condition.notify()
+
+    def run(self):
+        while True:
+            item = self._take()
+            if item is None:
+                return
+
+            while self.health is not None and not self._closed and not self.health.wait_closed(timeout=1):
+                pass  # Every modem is down, hold the message instead of failing its attempt
+
+            modem_name, delay = self.modem_pool.reserve(item.phone)
+            if modem_name is None:
+                logger.debug("Pacing SMS to %s, deferred by %.2f seconds", item.phone, delay)
+                self._defer(item, delay)
+                continue
+
+            with self._condition:
+                self._stats[item.lane].record(time.monotonic() - item.enqueued_at)
+            try:
+                item.result.set_result(self.modem_pool.send_sms(item.phone, item.message, modem_name))
+            except Exception as e:
+                item.result.set_exception(e)
+
+    def stats(self) -> List[dict]:
+        with self._condition:
+            deferred = [item.lane for _, _, item in self._deferred]
+            return [
+                {
+                    "lane": lane.name.lower(),
+                    "queued": len(self._lanes[lane]) + deferred.count(lane),
+                    "sent": stats.sent,
+                    "avg_wait_seconds": stats.total_wait / stats.sent if stats.sent else 0.0,
+                    "max_wait_seconds": stats.max_wait,
+                }
+                for lane, stats in self._stats.items()
+            ]
+
+    def log_stats(self):
+        for stats in self.stats():
+            logger.info(
+                "Send lane %s: queued=%d, sent=%d, avg_wait=%.2fs, max_wait=%.2fs",
+                stats["lane"],
+                stats["queued"],
+                stats["sent"],
+                stats["avg_wait_seconds"],
+                stats["max_wait_seconds"],
+            )
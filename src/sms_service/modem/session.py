@@ -0,0 +1,130 @@
+import logging
+import queue
+import time
+from typing import Callable, TypeVar
+from urllib.parse import urlparse
+
+import requests
+from huawei_lte_api.Client import Client
+from huawei_lte_api.Connection import Connection
+from huawei_lte_api.exceptions import (
+    ResponseErrorLoginCsrfException,
+    ResponseErrorLoginRequiredException,
+    ResponseErrorWrongSessionToken,
+)
+
+from utils.metrics import MODEM_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Errors after which the modem session is considered expired and has to be logged in again
+SESSION_EXPIRED_ERRORS = (
+    ResponseErrorLoginRequiredException,
+    ResponseErrorLoginCsrfException,
+    ResponseErrorWrongSessionToken,
+)
+
+
+class ModemSession:
+    """A long-lived authenticated connection to the modem web API."""
+
+    def __init__(
+        self, url: str, username: str = None, password: str = None, timeout: float | None = None, name: str = "modem"
+    ):
+        self.url = url
+        self.name = name
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.connection: Connection | None = None
+        self.http: requests.Session | None = None
+        self.last_used = 0.0
+
+    def _count_response(self, response: requests.Response, *args, **kwargs):
+        MODEM_REQUESTS.labels(self.name, urlparse(response.url).path, str(response.status_code)).inc()
+
+    def get_client(self, max_idle_seconds: float) -> Client:
+        if self.connection and time.time() - self.last_used > max_idle_seconds:
+            logger.debug("Modem session was idle for too long, logging in again")
+            self.close()
+
+        if self.connection is None:
+            logger.debug("Logging in to modem at %s", self.url)
+            self.http = requests.Session()
+            self.http.hooks["response"].append(self._count_response)
+            self.connection = Connection(
+                self.url,
+                username=self.username,
+                password=self.password,
+                timeout=self.timeout,
+                requests_session=self.http,
+            )
+
+        self.last_used = time.time()
+        return Client(self.connection)
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception as e:
+                logger.debug("Error while closing modem session: %s", e)
+            self.connection = None
+        # The connection does not close a requests session it was given
+        if self.http is not None:
+            self.http.close()
+            self.http = None
+
+
+class ModemSessionPool:
+    """
+    A small pool of long-lived modem sessions.
+    Every session is used by one thread at a time, so the number of sessions caps the concurrent requests
+    reaching the modem. Expired sessions are logged in again transparently.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        username: str = None,
+        password: str = None,
+        size: int = 1,
+        max_idle_seconds: float = 240,
+        timeout: float | None = None,
+        name: str = "modem",
+    ):
+        self.name = name
+        self.max_idle_seconds = max_idle_seconds
+        self._sessions: queue.Queue[ModemSession] = queue.Queue()
+        for _ in range(size):
+            self._sessions.put(ModemSession(url, username=username, password=password, timeout=timeout, name=name))
+        self._all_sessions = list(self._sessions.queue)
+
+    def call(self, fn: Callable[[Client], T]) -> T:
+        """Run fn with an authenticated client, logging in again once if the modem session has expired."""
+
+        session = self._sessions.get()
+        try:
+            try:
+                return fn(session.get_client(self.max_idle_seconds))
+            except SESSION_EXPIRED_ERRORS as e:
+                logger.info("Modem session expired (%s), logging in again", e)
+                session.close()
+                return fn(session.get_client(self.max_idle_seconds))
+        except (requests.exceptions.RequestException, *SESSION_EXPIRED_ERRORS) as e:
+            if isinstance(e, requests.exceptions.RequestException) and e.response is None:
+                # Never answered, so the response hook did not count it
+                endpoint = urlparse(e.request.url).path if e.request is not None else ""
+                MODEM_REQUESTS.labels(self.name, endpoint, "error").inc()
+            # The connection state is unknown, start over with a new login next time
+            session.close()
+            raise
+        finally:
+            self._sessions.put(session)
+
+    def close(self):
+        for session in self._all_sessions:
+            session.close()
+        logger.debug("Modem sessions closed.")
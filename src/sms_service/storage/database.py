@@ -0,0 +1,53 @@
+import logging
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator
+
+logger = logging.getLogger(__name__)
+
+BUSY_TIMEOUT_MS = 5000
+
+
+class Database:
+    """
+    Long-lived SQLite connections to the service store, one per thread.
+    The store runs in WAL mode, so the reply matcher can read while handler threads write.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []
+        self._lock = threading.Lock()
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "connection", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, check_same_thread=False)
+            conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            self._local.connection = conn
+            with self._lock:
+                self._connections.append(conn)
+            logger.debug("Opened SQLite connection to %s for thread %s", self.db_path, threading.current_thread().name)
+        return conn
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Commit the statements executed inside the block together, or roll them back on error."""
+
+        conn = self.connection()
+        with conn:
+            yield conn
+
+    def execute(self, sql: str, params: tuple = ()) -> list[tuple]:
+        return self.connection().execute(sql, params).fetchall()
+
+    def close(self):
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+        self._local = threading.local()
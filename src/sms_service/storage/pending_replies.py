@@ -0,0 +1,142 @@
+import json
+import logging
+import time
+from typing import List
+
+from storage.database import Database
+
+logger = logging.getLogger(__name__)
+
+
+class PendingReplyStatus:
+    AWAITING = "awaiting"
+    REPLIED = "replied"
+    EXPIRED = "expired"
+
+
+class PendingReplyStore:
+    """Durable records of sent configuration commands which are waiting for a reply from the device."""
+
+    def __init__(self, db_path: str = "sms_storage.sqlite3"):
+        self.db = Database(db_path)
+        self._init_db()
+
+    def _init_db(self):
+        with self.db.transaction() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS pending_replies (
+                    message_id INTEGER PRIMARY KEY,
+                    phone TEXT NOT NULL,
+                    modem TEXT,
+                    payload TEXT NOT NULL,
+                    sent_at REAL NOT NULL,
+                    deadline REAL NOT NULL,
+                    status TEXT CHECK( status IN ('awaiting','replied','expired') ) NOT NULL,
+                    reply TEXT,
+                    reply_index INTEGER,
+                    resolved_at REAL
+                )
+            """
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(pending_replies)")}
+            if "modem" not in columns:
+                conn.execute("ALTER TABLE pending_replies ADD COLUMN modem TEXT")
+            if "reply_index" not in columns:
+                conn.execute("ALTER TABLE pending_replies ADD COLUMN reply_index INTEGER")
+            conn.execute("CREATE INDEX IF NOT EXISTS pending_replies_status ON pending_replies (status, deadline)")
+            conn.execute("CREATE INDEX IF NOT EXISTS pending_replies_phone ON pending_replies (phone, modem)")
+        logger.debug("Pending replies table initialized.")
+
+    def add(
+        self,
+        message_id: int,
+        phone: str,
+        payload: dict,
+        sent_at: float,
+        deadline: float,
+        modem: str = None,
+        replace: bool = True,
+    ):
+        """
+        Store a sent command as awaiting a reply. A resent command replaces its previous record,
+        with replace=False an existing record, possibly already resolved, is kept.
+        """
+
+        conflict = "REPLACE" if replace else "IGNORE"
+        with self.db.transaction() as conn:
+            conn.execute(
+                f"""
+                INSERT OR {conflict} INTO pending_replies (message_id, phone, modem, payload, sent_at, deadline, status)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+                (message_id, phone, modem, json.dumps(payload), sent_at, deadline, PendingReplyStatus.AWAITING),
+            )
+        logger.debug("Stored pending reply for message %s from phone %s", message_id, phone)
+
+    def get_awaiting(self) -> List[dict]:
+        rows = self.db.execute(
+            """
+            SELECT message_id, phone, modem, payload, sent_at, deadline FROM pending_replies
+            WHERE status = ?
+            ORDER BY sent_at ASC
+        """,
+            (PendingReplyStatus.AWAITING,),
+        )
+
+        return [
+            {
+                "message_id": row[0],
+                "phone": row[1],
+                "modem": row[2],
+                "payload": json.loads(row[3]),
+                "sent_at": row[4],
+                "deadline": row[5],
+            }
+            for row in rows
+        ]
+
+    def get_next_deadline(self, exclude: set[int] = frozenset()) -> float | None:
+        """Nearest deadline of the commands awaiting a reply, except the message ids in exclude."""
+
+        placeholders = ", ".join("?" * len(exclude))
+        rows = self.db.execute(
+            f"SELECT MIN(deadline) FROM pending_replies WHERE status = ? AND message_id NOT IN ({placeholders})",
+            (PendingReplyStatus.AWAITING, *exclude),
+        )
+        return rows[0][0] if rows else None
+
+    def get_reply_indexes(self, phone: str, modem: str | None) -> set[int]:
+        """Modem indexes of the messages already taken as replies to commands sent to the phone."""
+
+        rows = self.db.execute(
+            "SELECT reply_index FROM pending_replies WHERE phone = ? AND modem IS ? AND reply_index IS NOT NULL",
+            (phone, modem),
+        )
+        return {row[0] for row in rows}
+
+    def _resolve(self, message_id: int, status: str, reply: str | None = None, reply_index: int | None = None):
+        with self.db.transaction() as conn:
+            conn.execute(
+                """
+                UPDATE pending_replies SET status = ?, reply = ?, reply_index = ?, resolved_at = ?
+                WHERE message_id = ?
+            """,
+                (status, reply, reply_index, time.time(), message_id),
+            )
+
+    def mark_replied(self, message_id: int, reply: str, reply_index: int | None = None):
+        self._resolve(message_id, PendingReplyStatus.REPLIED, reply, reply_index)
+
+    def mark_expired(self, message_id: int):
+        self._resolve(message_id, PendingReplyStatus.EXPIRED)
+
+    def delete_resolved_before(self, before_ts: float) -> int:
+        with self.db.transaction() as conn:
+            return conn.execute(
+                "DELETE FROM pending_replies WHERE status != ? AND resolved_at < ?",
+                (PendingReplyStatus.AWAITING, before_ts),
+            ).rowcount
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,87 @@
+import bisect
+import logging
+import threading
+import time
+from typing import Collection, Dict, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ReplyIndex:
+    """
+    In-memory index of recent incoming messages by phone, which serves the reply lookups of waiting commands.
+    Every phone keeps its replies sorted by date, so a lookup is a binary search whatever the number of replies.
+    Replies older than max_age_seconds are dropped, lookups for older timestamps have to go to the store.
+    """
+
+    def __init__(self, max_age_seconds: float = 1200):
+        self.max_age_seconds = max_age_seconds
+        # Per phone: (date_time, modem_index, content) sorted by date_time
+        self._replies: Dict[str, List[Tuple[float, int, str]]] = {}
+        self._indexes: set[int] = set()
+        self._lock = threading.Lock()
+
+    @property
+    def horizon(self) -> float:
+        """Replies received before this time may be missing from the index."""
+
+        return time.time() - self.max_age_seconds
+
+    def add(self, messages: Iterable[Tuple[str, str, float, int]]) -> int:
+        """Add incoming messages given as (phone, content, date_time, modem_index), known messages are skipped."""
+
+        horizon = self.horizon
+        added = 0
+        with self._lock:
+            for phone, content, date_time, modem_index in messages:
+                if date_time < horizon or modem_index in self._indexes:
+                    continue
+                replies = self._replies.setdefault(phone, [])
+                entry = (date_time, modem_index, content)
+                if not replies or replies[-1] <= entry:
+                    replies.append(entry)
+                else:
+                    # Delivered out of order, rare enough for an insert in the middle
+                    bisect.insort(replies, entry)
+                self._indexes.add(modem_index)
+                added += 1
+        return added
+
+    def get_reply_since(
+        self, phone: str, since_timestamp: float, exclude: Collection[int] = ()
+    ) -> Tuple[int, str] | None:
+        """First reply from the phone received after the given time as (modem_index, content), skipping exclude."""
+
+        with self._lock:
+            replies = self._replies.get(phone)
+            if not replies:
+                return None
+            # A one-element tuple sorts before every entry with the same date
+            position = bisect.bisect_left(replies, (since_timestamp,))
+            for _, modem_index, content in replies[position:]:
+                if modem_index not in exclude:
+                    return modem_index, content
+        return None
+
+    def prune(self) -> int:
+        """Drop replies older than the age limit."""
+
+        horizon = self.horizon
+        pruned = 0
+        with self._lock:
+            for phone in list(self._replies):
+                replies = self._replies[phone]
+                expired = bisect.bisect_left(replies, (horizon,))
+                for _, modem_index, _ in replies[:expired]:
+                    self._indexes.discard(modem_index)
+                del replies[:expired]
+                pruned += expired
+                if not replies:
+                    del self._replies[phone]
+        if pruned:
+            logger.debug("Pruned %d replies from the reply index", pruned)
+        return pruned
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._indexes)
@@ -0,0 +1,114 @@
+import logging
+import os
+import threading
+import time
+
+from modem.modem_pool import ModemPool
+from storage.pending_replies import PendingReplyStore
+from storage.send_ledger import SendLedger
+
+logger = logging.getLogger(__name__)
+
+SECONDS_IN_DAY = 24 * 60 * 60
+
+
+def get_archive_path(db_path: str) -> str:
+    root, ext = os.path.splitext(db_path)
+    return f"{root}_archive{ext}"
+
+
+class RetentionManager:
+    """
+    Keeps the local stores and the modem boxes small over long uptimes.
+    Periodically deletes already stored messages from the modems, archives old rows,
+    drops resolved pending replies and old send records and returns free pages to the file system.
+    """
+
+    def __init__(
+        self,
+        modem_pool: ModemPool,
+        pending_replies: PendingReplyStore,
+        send_ledger: SendLedger,
+        stop_event: threading.Event,
+        interval: float = 3600,
+        max_age_days: float = 30,
+        max_rows: int = 50000,
+        archive: bool = True,
+        modem_delete_after_seconds: float = SECONDS_IN_DAY,
+    ):
+        self.modem_pool = modem_pool
+        self.pending_replies = pending_replies
+        self.send_ledger = send_ledger
+        self.stop_event = stop_event
+        self.interval = interval
+        self.max_age_days = max_age_days
+        self.max_rows = max_rows
+        self.archive = archive
+        self.modem_delete_after_seconds = modem_delete_after_seconds
+        self._thread: threading.Thread | None = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="Retention", daemon=True)
+        self._thread.start()
+        logger.debug("Retention manager started with interval %s seconds", self.interval)
+
+    def join(self, timeout: float | None = None):
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _clean_modem(self, modem, now: float):
+        if not self.modem_delete_after_seconds:
+            return
+
+        # Nothing else reads the sent box, its messages are only known to the store after this sync
+        modem.sync_sent()
+
+        # Delete in batches so that a large backlog does not hold the modem for long
+        while not self.stop_event.is_set():
+            if not modem.delete_stored_messages_from_modem(now - self.modem_delete_after_seconds):
+                break
+
+    def run_once(self):
+        now = time.time()
+        cutoff = now - self.max_age_days * SECONDS_IN_DAY
+
+        for modem in self.modem_pool.clients:
+            try:
+                self._clean_modem(modem, now)
+            except Exception as e:
+                logger.error("Error while deleting stored messages from modem %s: %s", modem.name, e)
+
+            try:
+                archive_path = get_archive_path(modem.db_path) if self.archive else None
+                modem.store.archive(cutoff, self.max_rows, archive_path)
+                modem.store.incremental_vacuum()
+            except Exception as e:
+                logger.error("Error while compacting store of modem %s: %s", modem.name, e)
+
+        try:
+            deleted = self.pending_replies.delete_resolved_before(cutoff)
+            if deleted:
+                logger.info("Deleted %d resolved pending replies", deleted)
+        except Exception as e:
+            logger.error("Error while deleting resolved pending replies: %s", e)
+
+        try:
+            deleted = self.send_ledger.delete_before(cutoff)
+            if deleted:
+                logger.info("Deleted %d send ledger records", deleted)
+        except Exception as e:
+            logger.error("Error while deleting send ledger records: %s", e)
+
+    def run(self):
+        for modem in self.modem_pool.clients:
+            try:
+                modem.store.enable_incremental_vacuum()
+            except Exception as e:
+                logger.error("Error while enabling incremental vacuum for modem %s: %s", modem.name, e)
+
+        while not self.stop_event.is_set():
+            started = time.time()
+            self.run_once()
+            logger.debug("Retention run took %.2f seconds", time.time() - started)
+
+            self.stop_event.wait(self.interval)
@@ -0,0 +1,56 @@
+import logging
+import time
+
+from storage.database import Database
+
+logger = logging.getLogger(__name__)
+
+
+class SendLedger:
+    """
+    Durable record of every message already sent to a modem, keyed by the backend message id.
+    Checked before sending, so a message redelivered by Kafka after a restart is not sent to the device again.
+    """
+
+    def __init__(self, db_path: str = "sms_storage.sqlite3"):
+        self.db = Database(db_path)
+        self._init_db()
+
+    def _init_db(self):
+        with self.db.transaction() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS send_ledger (
+                    message_id INTEGER PRIMARY KEY,
+                    phone TEXT NOT NULL,
+                    modem TEXT,
+                    sent_at REAL NOT NULL
+                )
+            """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS send_ledger_sent_at ON send_ledger (sent_at)")
+        logger.debug("Send ledger table initialized.")
+
+    def get(self, message_id: int) -> dict | None:
+        rows = self.db.execute("SELECT phone, modem, sent_at FROM send_ledger WHERE message_id = ?", (message_id,))
+        if not rows:
+            return None
+        phone, modem, sent_at = rows[0]
+        return {"message_id": message_id, "phone": phone, "modem": modem, "sent_at": sent_at}
+
+    def record_sent(self, message_id: int, phone: str, modem: str = None, sent_at: float = None) -> float:
+        sent_at = sent_at or time.time()
+        with self.db.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO send_ledger (message_id, phone, modem, sent_at) VALUES (?, ?, ?, ?)",
+                (message_id, phone, modem, sent_at),
+            )
+        logger.debug("Recorded message %s as sent to %s", message_id, phone)
+        return sent_at
+
+    def delete_before(self, before_ts: float) -> int:
+        with self.db.transaction() as conn:
+            return conn.execute("DELETE FROM send_ledger WHERE sent_at < ?", (before_ts,)).rowcount
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,236 @@
+import logging
+import sqlite3
+from datetime import datetime
+from typing import Collection, List
+
+from storage.database import Database
+
+logger = logging.getLogger(__name__)
+
+
+def get_message_timestamp(msg: dict) -> float:
+    """Timestamp of a message read from the modem, which reports local time in whole seconds."""
+
+    return datetime.strptime(msg["Date"], "%Y-%m-%d %H:%M:%S").timestamp()
+
+
+class SmsStore:
+    """Local copy of the modem SMS boxes and the sync state of every box."""
+
+    def __init__(self, database: Database):
+        self.db = database
+        self._init_db()
+
+    def _init_db(self):
+        """Initialize the local SQLite database to store modem messages."""
+
+        with self.db.transaction() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS sms_messages (
+                    id INTEGER PRIMARY KEY,
+                    phone TEXT,
+                    content TEXT,
+                    date_time REAL,
+                    modem_index INTEGER UNIQUE,
+                    message_type TEXT CHECK( message_type IN ('incoming','outgoing') ) NOT NULL,
+                    deleted_from_modem INTEGER NOT NULL DEFAULT 0
+                )
+            """
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(sms_messages)")}
+            if "deleted_from_modem" not in columns:
+                conn.execute("ALTER TABLE sms_messages ADD COLUMN deleted_from_modem INTEGER NOT NULL DEFAULT 0")
+            # Covers the reply lookup: filter by phone and type, range and sort by date, return content
+            conn.execute(
+                """
+                CREATE INDEX IF NOT EXISTS sms_messages_reply_lookup
+                ON sms_messages (phone, message_type, date_time, content)
+            """
+            )
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    box_type INTEGER PRIMARY KEY,
+                    last_index INTEGER NOT NULL,
+                    last_date REAL NOT NULL
+                )
+            """
+            )
+        logger.debug("SQLite database initialized.")
+
+    def save_messages(self, messages: List[dict]):
+        """Save messages read from the modem, messages which are already stored are ignored."""
+
+        if not messages:
+            return
+
+        logger.debug("Saving %d messages to the database...", len(messages))
+        rows = [
+            (
+                msg["Phone"],
+                msg["Content"],
+                get_message_timestamp(msg),
+                msg["Index"],
+                msg["message_type"],
+            )
+            for msg in messages
+        ]
+        insert = """
+            INSERT OR IGNORE INTO sms_messages (phone, content, date_time, modem_index, message_type)
+            VALUES (?, ?, ?, ?, ?)
+        """
+        try:
+            with self.db.transaction() as conn:
+                conn.executemany(insert, rows)
+        except sqlite3.IntegrityError:
+            # Fall back to row by row inserts to skip only the broken messages
+            with self.db.transaction() as conn:
+                for msg, row in zip(messages, rows):
+                    try:
+                        conn.execute(insert, row)
+                    except sqlite3.IntegrityError as e:
+                        logger.error("Error while saving message: '%s'. %s", msg, e.sqlite_errorname)
+        logger.debug("All messages saved to the database.")
+
+    def get_sync_state(self, box_type: int) -> tuple[int, float]:
+        """Return the highest modem index and date already stored for the given box."""
+
+        rows = self.db.execute("SELECT last_index, last_date FROM sync_state WHERE box_type = ?", (box_type,))
+        return rows[0] if rows else (-1, 0.0)
+
+    def set_sync_state(self, box_type: int, last_index: int, last_date: float):
+        with self.db.transaction() as conn:
+            conn.execute(
+                """
+                INSERT INTO sync_state (box_type, last_index, last_date) VALUES (?, ?, ?)
+                ON CONFLICT(box_type) DO UPDATE SET last_index = excluded.last_index, last_date = excluded.last_date
+            """,
+                (box_type, last_index, last_date),
+            )
+
+    def get_all(self) -> List[dict]:
+        rows = self.db.execute("SELECT phone, content, date_time, message_type FROM sms_messages")
+        return [{"phone": row[0], "content": row[1], "date_time": row[2], "message_type": row[3]} for row in rows]
+
+    def get_reply_from_phone_since(
+        self, phone: str, since_timestamp: float, exclude: Collection[int] = ()
+    ) -> tuple[int, str] | None:
+        """First incoming message from the phone after the given time as (modem_index, content), skipping exclude."""
+
+        exclude = list(exclude)
+        excluded = f"AND modem_index NOT IN ({', '.join('?' * len(exclude))})" if exclude else ""
+        rows = self.db.execute(
+            f"""
+            SELECT modem_index, content FROM sms_messages
+            WHERE phone = ?
+              AND message_type = 'incoming'
+              AND date_time >= ?
+              {excluded}
+            ORDER BY date_time ASC, modem_index ASC
+            LIMIT 1
+        """,
+            (phone, since_timestamp, *exclude),
+        )
+        return tuple(rows[0]) if rows else None
+
+    def get_incoming_since(self, since_timestamp: float) -> List[tuple[str, str, float, int]]:
+        """Incoming messages received after the given timestamp as (phone, content, date_time, modem_index)."""
+
+        return self.db.execute(
+            """
+            SELECT phone, content, date_time, modem_index FROM sms_messages
+            WHERE message_type = 'incoming' AND date_time >= ?
+            ORDER BY date_time ASC
+        """,
+            (since_timestamp,),
+        )
+
+    def get_modem_indexes_to_delete(self, before_ts: float, limit: int) -> List[int]:
+        """Modem indexes of stored messages older than before_ts that are still kept on the modem."""
+
+        rows = self.db.execute(
+            """
+            SELECT modem_index FROM sms_messages
+            WHERE deleted_from_modem = 0 AND date_time < ?
+            ORDER BY date_time ASC
+            LIMIT ?
+        """,
+            (before_ts, limit),
+        )
+        return [row[0] for row in rows]
+
+    def mark_deleted_from_modem(self, modem_indexes: List[int]):
+        with self.db.transaction() as conn:
+            conn.executemany(
+                "UPDATE sms_messages SET deleted_from_modem = 1 WHERE modem_index = ?",
+                [(index,) for index in modem_indexes],
+            )
+
+    def archive(self, before_ts: float, max_rows: int, archive_path: str | None = None) -> int:
+        """
+        Move messages older than before_ts, and the oldest messages above max_rows, out of the store.
+        Only messages already deleted from the modem are moved, the others are still needed to delete them there.
+        They are copied to the archive database first if an archive path is given.
+        """
+
+        conn = self.db.connection()
+        (total,) = conn.execute("SELECT COUNT(*) FROM sms_messages").fetchone()
+        cutoff = before_ts
+        if max_rows and total > max_rows:
+            (newest_kept_ts,) = conn.execute(
+                "SELECT date_time FROM sms_messages ORDER BY date_time DESC LIMIT 1 OFFSET ?", (max_rows - 1,)
+            ).fetchone()
+            cutoff = max(cutoff, newest_kept_ts)
+
+        if archive_path:
+            conn.execute("ATTACH DATABASE ? AS archive", (archive_path,))
+        try:
+            with conn:
+                if archive_path:
+                    # Own ids, the ids of the store are reused once its newest rows are archived
+                    conn.execute(
+                        """
+                        CREATE TABLE IF NOT EXISTS archive.sms_messages (
+                            id INTEGER PRIMARY KEY,
+                            phone TEXT,
+                            content TEXT,
+                            date_time REAL,
+                            modem_index INTEGER,
+                            message_type TEXT NOT NULL
+                        )
+                    """
+                    )
+                    conn.execute(
+                        """
+                        INSERT INTO archive.sms_messages (phone, content, date_time, modem_index, message_type)
+                        SELECT phone, content, date_time, modem_index, message_type FROM main.sms_messages
+                        WHERE date_time < ? AND deleted_from_modem = 1
+                    """,
+                        (cutoff,),
+                    )
+                archived = conn.execute(
+                    "DELETE FROM main.sms_messages WHERE date_time < ? AND deleted_from_modem = 1", (cutoff,)
+                ).rowcount
+        finally:
+            if archive_path:
+                conn.execute("DETACH DATABASE archive")
+
+        if archived:
+            logger.info("Archived %d messages older than %s", archived, datetime.fromtimestamp(cutoff))
+        return archived
+
+    def enable_incremental_vacuum(self):
+        """Switch the store to incremental auto vacuum, this needs one full VACUUM of an existing database."""
+
+        conn = self.db.connection()
+        (mode,) = conn.execute("PRAGMA auto_vacuum").fetchone()
+        if mode != 2:
+            logger.info("Enabling incremental vacuum for %s", self.db.db_path)
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("VACUUM")
+
+    def incremental_vacuum(self, pages: int = 0):
+        """Return free pages to the file system, all of them if pages is 0."""
+
+        self.db.connection().execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
@@ -0,0 +1,171 @@
+import itertools
+from concurrent.futures import Future
+from datetime import datetime
+
+import pytest
+from confluent_kafka import TopicPartition
+
+from modem.huawei_modem_client import HuaweiModemClient
+from storage.pending_replies import PendingReplyStore
+from tools.fake_modem import FakeModem, FakeModemServer
+
+DEVICE_PHONE = "+79990000001"
+
+_modem_indexes = itertools.count(40000)
+
+
+def make_message(phone: str, content: str, timestamp: float, message_type: str = "incoming", index: int = None):
+    """A message as read from the modem, the modem reports dates in whole seconds of local time."""
+
+    return {
+        "Index": next(_modem_indexes) if index is None else index,
+        "Phone": phone,
+        "Content": content,
+        "Date": datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S"),
+        "message_type": message_type,
+    }
+
+
+@pytest.fixture
+def modem(tmp_path):
+    """A modem client on its own store, it never reaches a real modem unless a test calls its session pool."""
+
+    client = HuaweiModemClient("http://modem.test/", db_path=str(tmp_path / "modem.sqlite3"), name="modem")
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def make_modem(tmp_path):
+    """Factory of further modem clients on their own stores, like the modem fixture."""
+
+    clients = []
+
+    def make_modem(name: str) -> HuaweiModemClient:
+        client = HuaweiModemClient(f"http://{name}.test/", db_path=str(tmp_path / f"{name}.sqlite3"), name=name)
+        clients.append(client)
+        return client
+
+    yield make_modem
+    for client in clients:
+        client.close()
+
+
+@pytest.fixture
+def fake_modem():
+    """A fake modem served over HTTP, it answers no commands. Its state is fake_modem.modem."""
+
+    server = FakeModemServer(FakeModem())
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def connected_modem(fake_modem, tmp_path):
+    """A modem client talking to the fake modem."""
+
+    client = HuaweiModemClient(
+        f"http://admin:password@{fake_modem.address}/", db_path=str(tmp_path / "connected.sqlite3"), name="fake"
+    )
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def receive(modem):
+    """Store incoming messages as if the modem inbox sync had read them."""
+
+    def receive(*messages: dict, client: HuaweiModemClient = None):
+        client = client or modem
+        client.store.save_messages(list(messages))
+        client._index_replies(list(messages))
+
+    return receive
+
+
+@pytest.fixture
+def pending_replies(tmp_path):
+    store = PendingReplyStore(str(tmp_path / "service.sqlite3"))
+    yield store
+    store.close()
+
+
+class FakeMessage:
+    """The parts of a consumed Kafka message the service reads."""
+
+    def __init__(
+        self,
+        value: bytes | None,
+        key: bytes | None = None,
+        topic: str = "sms_configuration",
+        offset: int = 0,
+        headers: dict[str, str] | None = None,
+    ):
+        self._value = value
+        self._key = key
+        self._topic = topic
+        self._offset = offset
+        self._headers = [(name, value.encode("utf-8")) for name, value in headers.items()] if headers else None
+
+    def value(self) -> bytes | None:
+        return self._value
+
+    def key(self) -> bytes | None:
+        return self._key
+
+    def topic(self) -> str:
+        return self._topic
+
+    def partition(self) -> int:
+        return 0
+
+    def offset(self) -> int:
+        return self._offset
+
+    def headers(self) -> list | None:
+        return self._headers
+
+    def error(self) -> None:
+        return None
+
+
+class FakeConsumer:
+    """The parts of a Kafka consumer a TopicConsumer uses, it records the paused partitions and the seeks."""
+
+    def __init__(self, partitions: list[int] = (0,)):
+        self.partitions = list(partitions)
+        self.paused: set[int] = set()
+        self.seeks: list[int] = []
+        self.commits: list[int] = []
+
+    def pause(self, partitions):
+        self.paused.update(tp.partition for tp in partitions)
+
+    def resume(self, partitions):
+        self.paused.difference_update(tp.partition for tp in partitions)
+
+    def seek(self, partition):
+        self.seeks.append(partition.offset)
+
+    def assignment(self):
+        return [TopicPartition("topic", partition) for partition in self.partitions]
+
+    def commit(self, message, asynchronous: bool = True):
+        self.commits.append(message.offset())
+
+    def get_watermark_offsets(self, partition, cached: bool = False):
+        return -1, -1
+
+
+class ImmediateDispatcher:
+    """Records the offsets of the dispatched messages and finishes them at once, without replies to wait for."""
+
+    def __init__(self):
+        self.handled = []
+
+    def submit(self, handler, msg) -> Future:
+        self.handled.append(msg.offset())
+        future = Future()
+        future.set_result([])
+        return future
@@ -0,0 +1,91 @@
+import json
+import threading
+import time
+
+import pytest
+
+from kafka.dispatcher import KeyedDispatcher, get_message_key
+from tests.conftest import FakeMessage
+
+
+def message(phone: str, offset: int = 0) -> FakeMessage:
+    return FakeMessage(json.dumps({"phone": phone}).encode(), key=phone.encode(), offset=offset)
+
+
+@pytest.fixture
+def dispatcher():
+    dispatcher = KeyedDispatcher(modem=None, workers=4)
+    yield dispatcher
+    dispatcher.shutdown()
+
+
+class TestGetMessageKey:
+    def test_key_of_message(self):
+        assert get_message_key(FakeMessage(b"{}", key=b"+79990000001")) == "+79990000001"
+
+    def test_phone_of_payload_without_key(self):
+        assert get_message_key(FakeMessage(json.dumps({"phone": "+79990000001"}).encode())) == "+79990000001"
+
+    def test_unreadable_message_without_key(self):
+        assert get_message_key(FakeMessage(b"not json")) == ""
+
+
+class TestKeyedDispatcher:
+    def test_messages_of_one_device_run_one_after_another(self, dispatcher):
+        running = []
+        overlaps = []
+        handled = []
+        lock = threading.Lock()
+
+        def handler(modem, msg):
+            with lock:
+                if running:
+                    overlaps.append(msg.offset())
+                running.append(msg.offset())
+            time.sleep(0.02)
+            with lock:
+                running.remove(msg.offset())
+                handled.append(msg.offset())
+            return True
+
+        futures = [dispatcher.submit(handler, message("+79990000001", offset)) for offset in range(5)]
+        for future in futures:
+            future.result(timeout=5)
+
+        assert handled == [0, 1, 2, 3, 4]
+        assert overlaps == []
+
+    def test_devices_do_not_wait_on_each_other(self, dispatcher):
+        second_device_handled = threading.Event()
+
+        def slow_handler(modem, msg):
+            return second_device_handled.wait(timeout=5)
+
+        def handler(modem, msg):
+            second_device_handled.set()
+            return True
+
+        slow = dispatcher.submit(slow_handler, message("+79990000001"))
+        dispatcher.submit(handler, message("+79990000002")).result(timeout=5)
+
+        assert slow.result(timeout=5) == []
+
+    def test_failed_message_is_passed_to_on_failure(self):
+        failures = []
+        dispatcher = KeyedDispatcher(modem=None, workers=1, on_failure=lambda msg, error: failures.append(error))
+        try:
+            done = dispatcher.submit(lambda modem, msg: False, message("+79990000001"))
+            assert done.result(timeout=5) == []
+        finally:
+            dispatcher.shutdown()
+
+        assert failures == ["Handler failure"]
+
+    def test_handler_exception_fails_message_without_on_failure(self, dispatcher):
+        def handler(modem, msg):
+            raise RuntimeError("Modem unreachable")
+
+        done = dispatcher.submit(handler, message("+79990000001"))
+
+        with pytest.raises(Exception, match="Modem unreachable"):
+            done.result(timeout=5)
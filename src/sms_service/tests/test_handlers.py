@@ -0,0 +1,101 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from kafka.handlers.configuration_handler import handle_sms_configuration
+from kafka.handlers.verification_handler import handle_sms_verification, handle_sms_verification_async
+from modem.modem_pool import ModemPool
+from modem.send_queue import PrioritySendQueue
+from storage.send_ledger import SendLedger
+from tests.conftest import DEVICE_PHONE, FakeMessage
+
+
+@pytest.fixture
+def sent(modem, monkeypatch) -> list[str]:
+    """Contents of the SMS the modem sent."""
+
+    sent = []
+    monkeypatch.setattr(modem, "send_sms", lambda phone, message: sent.append(message) or True)
+    return sent
+
+
+@pytest.fixture
+def pool(modem, sent):
+    return ModemPool([modem])
+
+
+@pytest.fixture
+def send_queue(pool):
+    queue = PrioritySendQueue(pool)
+    queue.start()
+    yield queue
+    queue.join(timeout=5)
+
+
+@pytest.fixture
+def send_ledger(tmp_path):
+    ledger = SendLedger(str(tmp_path / "ledger.sqlite3"))
+    yield ledger
+    ledger.close()
+
+
+def payload(topic: str, content: str, message_id: int = 1) -> FakeMessage:
+    data = {"message_id": message_id, "phone": DEVICE_PHONE, "content": content, "retries": 3, "timestamp": time.time()}
+    return FakeMessage(json.dumps(data).encode(), key=DEVICE_PHONE.encode(), topic=topic)
+
+
+class TestRedelivery:
+    def test_configuration_sent_once(self, pool, send_queue, send_ledger, pending_replies, sent):
+        message = payload("sms_configuration", "1234A001#0007999#")
+
+        for _ in range(2):
+            assert handle_sms_configuration(pool, message, pending_replies, send_queue, send_ledger)
+
+        assert sent == ["1234A001#0007999#"]
+        assert [pending["message_id"] for pending in pending_replies.get_awaiting()] == [1]
+
+    def test_verification_sent_once(self, pool, send_queue, send_ledger, sent):
+        message = payload("sms_verification", "CODE: 1234")
+
+        for _ in range(2):
+            assert handle_sms_verification(pool, message, send_queue, send_ledger)
+
+        assert sent == ["CODE: 1234"]
+
+    def test_other_message_is_sent(self, pool, send_queue, send_ledger, sent):
+        handle_sms_verification(pool, payload("sms_verification", "CODE: 1234"), send_queue, send_ledger)
+        handle_sms_verification(pool, payload("sms_verification", "CODE: 5678", message_id=2), send_queue, send_ledger)
+
+        assert sent == ["CODE: 1234", "CODE: 5678"]
+
+
+class TestSendingModem:
+    @pytest.fixture
+    def pool(self, modem, make_modem, monkeypatch):
+        pool = ModemPool([modem, make_modem("other")])
+
+        def send_sms(phone, message):
+            # The modem goes down right after the send, the next SMS to the phone is routed to the other one
+            pool.mark_unhealthy(modem.name, time.time() + 60)
+            return True
+
+        monkeypatch.setattr(modem, "send_sms", send_sms)
+        return pool
+
+    def test_reply_awaited_on_modem_that_sent(self, pool, modem, send_queue, send_ledger, pending_replies):
+        message = payload("sms_configuration", "1234A001#0007999#")
+
+        assert handle_sms_configuration(pool, message, pending_replies, send_queue, send_ledger)
+
+        assert pool.get_modem_for(DEVICE_PHONE) is not modem
+        assert [pending["modem"] for pending in pending_replies.get_awaiting()] == [modem.name]
+        assert send_ledger.get(1)["modem"] == modem.name
+
+    def test_async_send_recorded_on_modem_that_sent(self, pool, modem, send_queue, send_ledger):
+        message = payload("sms_verification", "CODE: 1234")
+
+        assert asyncio.run(handle_sms_verification_async(pool, message, send_queue, send_ledger))
+
+        assert send_ledger.get(1)["modem"] == modem.name
@@ -0,0 +1,146 @@
+import json
+import threading
+import time
+
+import pytest
+
+from kafka.consumers import TopicConsumer
+from modem import health
+from modem.health import ModemHealthMonitor
+from modem.modem_pool import ModemPool
+from tests.conftest import FakeConsumer, FakeMessage, ImmediateDispatcher
+
+
+@pytest.fixture
+def first(make_modem):
+    return make_modem("first")
+
+
+@pytest.fixture
+def second(make_modem):
+    return make_modem("second")
+
+
+@pytest.fixture
+def reachable(first, second, monkeypatch) -> dict[str, bool]:
+    """Whether the probe of every modem by name answers, they are all down unless set otherwise."""
+
+    reachable = {first.name: False, second.name: False}
+
+    for client in (first, second):
+
+        def probe(name=client.name):
+            if not reachable[name]:
+                raise ConnectionError(f"Modem {name} unreachable")
+
+        monkeypatch.setattr(client, "probe", probe)
+    return reachable
+
+
+@pytest.fixture
+def pool(first, second, reachable):
+    return ModemPool([first, second])
+
+
+@pytest.fixture
+def stop_event():
+    stop_event = threading.Event()
+    yield stop_event
+    stop_event.set()
+
+
+@pytest.fixture
+def monitor(pool, stop_event):
+    return ModemHealthMonitor(pool, stop_event, probe_base_seconds=0, probe_max_seconds=60)
+
+
+def all_down(pool: ModemPool):
+    for name in pool.modems:
+        pool.mark_unhealthy(name, time.time() + 60)
+
+
+def wait_for(condition, timeout: float = 5) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+class TestCircuit:
+    def test_failed_probe_keeps_circuit_open(self, monitor, pool, first):
+        monitor._open()
+
+        assert not monitor._probe()
+
+        assert monitor.is_open
+        assert not monitor.wait_closed(timeout=0)
+        assert not pool.modems[first.name].is_healthy(time.time())
+
+    def test_answering_modem_closes_circuit(self, monitor, pool, first, second, reachable):
+        all_down(pool)
+        monitor._open()
+        reachable[second.name] = True
+
+        assert monitor._probe()
+
+        assert not monitor.is_open
+        assert monitor.wait_closed(timeout=0)
+        assert pool.modems[second.name].is_healthy(time.time())
+        assert not pool.modems[first.name].is_healthy(time.time())
+        assert pool.get_modem_for("+79990000001") is second
+
+    def test_monitor_opens_and_closes(self, monitor, pool, second, reachable, monkeypatch):
+        monkeypatch.setattr(health, "CHECK_INTERVAL_SECONDS", 0.01)
+        monitor.start()
+        assert not monitor.is_open
+
+        pool.mark_unhealthy(second.name, time.time() + 60)
+        time.sleep(0.05)
+        assert not monitor.is_open  # The first modem is still healthy
+
+        all_down(pool)
+        assert wait_for(lambda: monitor.is_open)
+
+        reachable[second.name] = True
+        assert monitor.wait_closed(timeout=5)
+
+
+class TestConsumptionPause:
+    @pytest.fixture
+    def consumer(self, monitor):
+        consumer = TopicConsumer(None, "sms_configuration", ImmediateDispatcher(), threading.Event(), health=monitor)
+        consumer.consumer = FakeConsumer(partitions=[0, 1])
+        return consumer
+
+    def test_partitions_paused_while_circuit_open(self, consumer, monitor, reachable):
+        monitor._open()
+        consumer._check_health()
+
+        assert consumer.consumer.paused == {0, 1}
+
+        reachable["first"] = True
+        monitor._probe()
+        consumer._check_health()
+
+        assert consumer.consumer.paused == set()
+
+    def test_message_fetched_while_open_is_not_handled(self, consumer, monitor):
+        monitor._open()
+        consumer._check_health()
+
+        consumer._process(FakeMessage(json.dumps({}).encode(), offset=3))
+
+        assert consumer.dispatcher.handled == []
+        assert consumer.consumer.seeks == [3]
+
+    def test_partition_paused_for_retry_stays_paused(self, consumer, monitor, reachable):
+        consumer._pause(0)
+        consumer.waiting[0] = time.time() + 60
+        monitor._open()
+        consumer._check_health()
+
+        reachable["first"] = True
+        monitor._probe()
+        consumer._check_health()
+
+        assert consumer.consumer.paused == {0}
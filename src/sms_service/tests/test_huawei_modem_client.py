@@ -0,0 +1,125 @@
+import itertools
+import math
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from huawei_lte_api.enums.sms import BoxTypeEnum, TypeEnum
+
+from modem import huawei_modem_client, session
+from tests.conftest import DEVICE_PHONE
+
+
+class FakeSmsApi:
+    """The SMS API of a modem, it lists a box newest first and counts the list requests."""
+
+    def __init__(self):
+        self.boxes = {BoxTypeEnum.LOCAL_INBOX: [], BoxTypeEnum.LOCAL_SENT: []}
+        self.list_requests = 0
+        self._indexes = itertools.count(40000)
+
+    def receive(
+        self,
+        content: str,
+        timestamp: float = None,
+        sms_type: TypeEnum = TypeEnum.SINGLE,
+    ):
+        # The modem keeps whole seconds
+        date = datetime.fromtimestamp(math.ceil(timestamp or time.time()))
+        self.boxes[BoxTypeEnum.LOCAL_INBOX].append(
+            {
+                "Index": str(next(self._indexes)),
+                "Smstat": "0",
+                "Phone": DEVICE_PHONE,
+                "Content": content,
+                "Date": date.strftime("%Y-%m-%d %H:%M:%S"),
+                "Sca": None,
+                "SaveType": "4",
+                "Priority": "0",
+                "SmsType": str(sms_type.value),
+            }
+        )
+
+    def get_sms_list(
+        self,
+        page: int = 1,
+        box_type: BoxTypeEnum = BoxTypeEnum.LOCAL_INBOX,
+        read_count: int = 20,
+        **kwargs,
+    ):
+        self.list_requests += 1
+        messages = sorted(
+            self.boxes[box_type],
+            key=lambda msg: (msg["Date"], int(msg["Index"])),
+            reverse=True,
+        )
+        messages = messages[(page - 1) * read_count : page * read_count]
+        # Like the real modem, Count is the number of messages on the requested page
+        return {
+            "Count": str(len(messages)),
+            "Messages": {"Message": messages} if messages else None,
+        }
+
+
+@pytest.fixture
+def sms_api(monkeypatch):
+    sms_api = FakeSmsApi()
+    monkeypatch.setattr(session, "Connection", lambda *args, **kwargs: SimpleNamespace(close=lambda: None))
+    monkeypatch.setattr(session, "Client", lambda connection: SimpleNamespace(sms=sms_api))
+    return sms_api
+
+
+def contents(messages: list[dict]) -> list[str]:
+    return sorted(msg["Content"] for msg in messages)
+
+
+class TestIncrementalSync:
+    @pytest.fixture(autouse=True)
+    def small_pages(self, modem):
+        modem.sync_page_size = 2
+
+    def test_second_sync_reads_nothing(self, modem, sms_api):
+        now = time.time() - 60
+        for i in range(3):
+            sms_api.receive(f"SMS {i}", now + i)
+
+        assert contents(modem._read_sms(include_sent=False)) == [
+            "SMS 0",
+            "SMS 1",
+            "SMS 2",
+        ]
+        assert modem._read_sms(include_sent=False) == []
+
+    def test_stops_at_first_stored_message(self, modem, sms_api):
+        now = time.time() - 60
+        for i in range(5):
+            sms_api.receive(f"SMS {i}", now + i)
+        modem._read_sms(include_sent=False)
+        sms_api.receive("NEW", now + 10)
+        requests = sms_api.list_requests
+
+        assert contents(modem._read_sms(include_sent=False)) == ["NEW"]
+        # The newest page holds the new and the first stored message, older pages are not read
+        assert sms_api.list_requests == requests + 1
+
+    def test_full_last_page_reads_one_empty_page(self, modem, sms_api):
+        now = time.time() - 60
+        sms_api.receive("SMS 0", now)
+        sms_api.receive("SMS 1", now + 1)
+
+        assert contents(modem._read_sms(include_sent=False)) == ["SMS 0", "SMS 1"]
+        assert sms_api.list_requests == 2
+
+        sms_api.receive("SMS 2", now + 2)
+        assert contents(modem._read_sms(include_sent=False)) == ["SMS 2"]
+
+    def test_unsettled_multipart_is_read_again(self, modem, sms_api, monkeypatch):
+        sms_api.receive("PART", sms_type=TypeEnum.MULTIPART)
+        sms_api.receive("SINGLE", time.time() + 1)
+
+        assert contents(modem._read_sms(include_sent=False)) == ["SINGLE"]
+
+        monkeypatch.setattr(huawei_modem_client, "MULTIPART_SETTLE_SECONDS", -10)
+        assert "PART" in contents(modem._read_sms(include_sent=False))
+        assert modem.get_reply_from_phone_since(DEVICE_PHONE, time.time() - 60) == "PART"
@@ -0,0 +1,92 @@
+import time
+
+import pytest
+
+from modem.modem_pool import ModemPool
+from tests.conftest import DEVICE_PHONE
+
+OTHER_PHONE = "+79990000002"
+
+
+@pytest.fixture
+def first(make_modem):
+    return make_modem("first")
+
+
+@pytest.fixture
+def second(make_modem):
+    return make_modem("second")
+
+
+@pytest.fixture
+def results(first, second, monkeypatch):
+    """Result of the sends of every modem by name, they succeed unless set otherwise."""
+
+    results = {first.name: True, second.name: True}
+    for client in (first, second):
+        monkeypatch.setattr(client, "send_sms", lambda phone, message, name=client.name: results[name])
+    return results
+
+
+@pytest.fixture
+def pool(first, second, results):
+    return ModemPool([first, second], max_failures=2, cooldown_seconds=60)
+
+
+class TestRouting:
+    def test_new_destination_goes_to_least_loaded_modem(self, pool, first, second):
+        pool.modems[first.name].in_flight = 1
+
+        assert pool.get_modem_for(DEVICE_PHONE) is second
+
+    def test_destination_sticks_to_modem_that_sent_to_it(self, pool, first, second):
+        pool.send_sms(DEVICE_PHONE, "OPEN")
+        pool.modems[first.name].in_flight = 5
+
+        assert pool.get_modem_for(DEVICE_PHONE) is first
+        assert pool.get_modem_for(OTHER_PHONE) is second
+
+    def test_failed_send_does_not_stick(self, pool, first, second, results):
+        results[first.name] = False
+        pool.send_sms(DEVICE_PHONE, "OPEN")
+        pool.modems[second.name].in_flight = 1
+        pool.modems[first.name].in_flight = 2
+
+        assert pool.get_modem_for(DEVICE_PHONE) is second
+
+    def test_unhealthy_modem_is_skipped(self, pool, first, second):
+        pool.mark_unhealthy(first.name, time.time() + 60)
+
+        assert pool.get_modem_for(DEVICE_PHONE) is second
+        assert not pool.all_unhealthy()
+
+    def test_all_unhealthy_still_routes(self, pool, first, second):
+        pool.mark_unhealthy(first.name, time.time() + 60)
+        pool.mark_unhealthy(second.name, time.time() + 60)
+
+        assert pool.all_unhealthy()
+        assert pool.get_modem_for(DEVICE_PHONE) in (first, second)
+
+
+class TestStickinessRelease:
+    def test_failing_modem_releases_its_destinations(self, pool, first, second, results):
+        pool.send_sms(DEVICE_PHONE, "OPEN")
+        results[first.name] = False
+        for _ in range(2):
+            pool.send_sms(DEVICE_PHONE, "OPEN")
+
+        assert not pool.modems[first.name].is_healthy(time.time())
+        assert pool.send_sms(DEVICE_PHONE, "OPEN") == (True, second.name)
+
+        # The destination moved with the successful send and stays there once the first modem recovers
+        pool.mark_healthy(first.name)
+        assert pool.get_modem_for(DEVICE_PHONE) is second
+
+    def test_unhealthy_sticky_modem_is_skipped(self, pool, first, second):
+        pool.send_sms(DEVICE_PHONE, "OPEN")
+        pool.mark_unhealthy(first.name, time.time() + 60)
+
+        assert pool.get_modem_for(DEVICE_PHONE) is second
+
+        pool.mark_healthy(first.name)
+        assert pool.get_modem_for(DEVICE_PHONE) is first
@@ -0,0 +1,98 @@
+import threading
+
+import pytest
+from confluent_kafka import KafkaError
+
+from kafka import producer as kafka_producer
+
+
+class FakeProducer:
+    """Keeps the delivery callbacks of produced messages, the test decides how each delivery ends."""
+
+    def __init__(self, full: int = 0):
+        self.callbacks = []
+        self.full = full
+
+    def produce(self, topic, key=None, value=None, headers=None, on_delivery=None):
+        if self.full:
+            self.full -= 1
+            raise BufferError()
+        self.callbacks.append(on_delivery)
+
+    def poll(self, timeout=None):
+        return 0
+
+    def flush(self, timeout=None):
+        return 0
+
+    def fail_last(self):
+        self.callbacks[-1](KafkaError(KafkaError._MSG_TIMED_OUT), None)
+
+
+@pytest.fixture
+def fake_producer(monkeypatch):
+    fake = FakeProducer()
+    monkeypatch.setattr(kafka_producer, "producer", fake)
+    monkeypatch.setattr(kafka_producer, "KAFKA_RETRY_DELAYS_SECONDS", [0, 0])
+    monkeypatch.setattr(kafka_producer, "_retries", [])
+    monkeypatch.setattr(kafka_producer, "_closing", threading.Event())
+    return fake
+
+
+def test_failed_delivery_produced_again_from_poll_loop(fake_producer):
+    delivery = kafka_producer.send_raw("sms_responses", "{}", "+79990000001")
+
+    fake_producer.fail_last()
+    # Never produced again from inside the delivery callback
+    assert len(fake_producer.callbacks) == 1
+    assert not delivery.done()
+
+    kafka_producer._produce_due_retries()
+    assert len(fake_producer.callbacks) == 2
+
+
+def test_retries_exhausted_fail_delivery(fake_producer):
+    delivery = kafka_producer.send_raw("sms_responses", "{}", "+79990000001")
+
+    for _ in range(2):
+        fake_producer.fail_last()
+        kafka_producer._produce_due_retries()
+    fake_producer.fail_last()
+
+    assert len(fake_producer.callbacks) == 3
+    assert isinstance(delivery.exception(timeout=0), Exception)
+    kafka_producer._produce_due_retries()
+    assert len(fake_producer.callbacks) == 3
+
+
+def test_retry_waits_for_delay(fake_producer, monkeypatch):
+    monkeypatch.setattr(kafka_producer, "KAFKA_RETRY_DELAYS_SECONDS", [60])
+    kafka_producer.send_raw("sms_responses", "{}", "+79990000001")
+
+    fake_producer.fail_last()
+    kafka_producer._produce_due_retries()
+
+    assert len(fake_producer.callbacks) == 1
+    assert len(kafka_producer._retries) == 1
+
+
+def test_full_queue_keeps_retry_for_next_poll(fake_producer):
+    kafka_producer.send_raw("sms_responses", "{}", "+79990000001")
+    fake_producer.fail_last()
+
+    fake_producer.full = 1
+    kafka_producer._produce_due_retries()
+    assert len(kafka_producer._retries) == 1
+
+    kafka_producer._produce_due_retries()
+    assert not kafka_producer._retries
+    assert len(fake_producer.callbacks) == 2
+
+
+def test_flush_fails_pending_retries(fake_producer, monkeypatch):
+    monkeypatch.setattr(kafka_producer, "KAFKA_RETRY_DELAYS_SECONDS", [60])
+    delivery = kafka_producer.send_raw("sms_responses", "{}", "+79990000001")
+    fake_producer.fail_last()
+
+    assert kafka_producer.flush(0) == 1
+    assert delivery.exception(timeout=0) is not None
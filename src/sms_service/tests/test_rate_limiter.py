@@ -0,0 +1,88 @@
+import pytest
+
+from modem.modem_pool import ModemPool
+from modem.rate_limiter import DestinationPacer, TokenBucket
+from tests.conftest import DEVICE_PHONE
+
+
+class TestTokenBucket:
+    def test_burst_then_wait(self):
+        bucket = TokenBucket(rate_per_minute=60, burst=2)
+
+        for _ in range(2):
+            assert bucket.ready_in() == 0
+            bucket.take()
+
+        assert bucket.ready_in() == pytest.approx(1, abs=0.05)
+
+    def test_ready_in_takes_nothing(self):
+        bucket = TokenBucket(rate_per_minute=60, burst=1)
+
+        bucket.ready_in()
+        assert bucket.ready_in() == 0
+
+    def test_unlimited(self):
+        bucket = TokenBucket(rate_per_minute=0)
+
+        bucket.take()
+        assert bucket.ready_in() == 0
+
+
+class TestDestinationPacer:
+    def test_interval_per_destination(self):
+        pacer = DestinationPacer(min_interval=5)
+
+        pacer.reserve(DEVICE_PHONE)
+
+        assert pacer.ready_in(DEVICE_PHONE) == pytest.approx(5, abs=0.05)
+        assert pacer.ready_in("+79990000002") == 0
+
+    def test_disabled(self):
+        pacer = DestinationPacer(min_interval=0)
+
+        pacer.reserve(DEVICE_PHONE)
+        assert pacer.ready_in(DEVICE_PHONE) == 0
+
+
+class TestModemPoolReserve:
+    @pytest.fixture
+    def pool(self, modem):
+        modem.rate_limiter = TokenBucket(rate_per_minute=60, burst=2)
+        return ModemPool([modem], destination_min_interval=5)
+
+    def test_reserve_routes_to_modem(self, pool):
+        assert pool.reserve(DEVICE_PHONE) == ("modem", 0)
+
+    def test_same_destination_paced(self, pool):
+        pool.reserve(DEVICE_PHONE)
+
+        modem_name, delay = pool.reserve(DEVICE_PHONE)
+        assert modem_name is None
+        assert delay == pytest.approx(5, abs=0.05)
+
+    def test_modem_rate_limited(self, pool):
+        pool.reserve(DEVICE_PHONE)
+        pool.reserve("+79990000002")
+
+        modem_name, delay = pool.reserve("+79990000003")
+        assert modem_name is None
+        assert delay == pytest.approx(1, abs=0.05)
+
+    def test_waiting_message_takes_no_slot(self, pool):
+        pool.reserve(DEVICE_PHONE)
+        pool.reserve(DEVICE_PHONE)
+
+        assert pool.reserve("+79990000002") == ("modem", 0)
+
+    def test_new_destination_routed_to_modem_with_tokens(self, modem, make_modem):
+        other = make_modem("other")
+        for client in (modem, other):
+            client.rate_limiter = TokenBucket(rate_per_minute=60, burst=1)
+        pool = ModemPool([modem, other])
+        modem.rate_limiter.take()
+
+        assert pool.reserve(DEVICE_PHONE) == ("other", 0)
+
+        modem_name, delay = pool.reserve("+79990000002")
+        assert modem_name is None
+        assert 0 < delay <= 1
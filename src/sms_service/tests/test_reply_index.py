@@ -0,0 +1,59 @@
+import time
+
+import pytest
+
+from storage.reply_index import ReplyIndex
+
+PHONE = "+79990000001"
+
+
+@pytest.fixture
+def index():
+    return ReplyIndex(max_age_seconds=600)
+
+
+class TestReplyIndex:
+    def test_returns_first_reply_since_timestamp(self, index):
+        now = time.time()
+        index.add([(PHONE, "first", now - 30, 1), (PHONE, "second", now - 20, 2), (PHONE, "third", now - 10, 3)])
+
+        assert index.get_reply_since(PHONE, now - 25) == (2, "second")
+        assert index.get_reply_since(PHONE, now - 20) == (2, "second")
+        assert index.get_reply_since(PHONE, now - 5) is None
+
+    def test_excluded_replies_are_skipped(self, index):
+        now = time.time()
+        index.add([(PHONE, "first", now - 20, 1), (PHONE, "second", now - 20, 2)])
+
+        assert index.get_reply_since(PHONE, now - 30, exclude={1}) == (2, "second")
+        assert index.get_reply_since(PHONE, now - 30, exclude={1, 2}) is None
+
+    def test_out_of_order_messages_are_sorted(self, index):
+        now = time.time()
+        index.add([(PHONE, "late", now - 10, 2)])
+        index.add([(PHONE, "early", now - 20, 1)])
+
+        assert index.get_reply_since(PHONE, now - 30) == (1, "early")
+
+    def test_replies_of_other_phones_are_ignored(self, index):
+        now = time.time()
+        index.add([("+79990000002", "other", now - 10, 1)])
+
+        assert index.get_reply_since(PHONE, now - 30) is None
+
+    def test_known_and_expired_messages_are_skipped(self, index):
+        now = time.time()
+
+        assert index.add([(PHONE, "reply", now - 10, 1), (PHONE, "old", now - 3600, 2)]) == 1
+        assert index.add([(PHONE, "reply", now - 10, 1)]) == 0
+        assert len(index) == 1
+
+    def test_prune_drops_replies_older_than_max_age(self, index):
+        now = time.time()
+        index.add([(PHONE, "old", now - 100, 1), (PHONE, "new", now - 10, 2)])
+        index.max_age_seconds = 50
+
+        assert index.prune() == 1
+
+        assert len(index) == 1
+        assert index.get_reply_since(PHONE, now - 200) == (2, "new")
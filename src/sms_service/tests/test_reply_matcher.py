@@ -0,0 +1,186 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from kafka.handlers.reply_matcher import ReplyMatcher
+from modem.modem_pool import ModemPool
+from tests.conftest import DEVICE_PHONE, make_message
+
+
+class FakeTopic:
+    """Records the published payloads, deliveries stay pending until confirm is called."""
+
+    def __init__(self):
+        self.published: list[dict] = []
+        self.deliveries: list[Future] = []
+
+    def __call__(self, payload: dict, phone: str) -> Future:
+        self.published.append(payload)
+        delivery = Future()
+        self.deliveries.append(delivery)
+        return delivery
+
+    def confirm(self):
+        for delivery in self.deliveries:
+            if not delivery.done():
+                delivery.set_result(True)
+
+
+@pytest.fixture
+def responses(monkeypatch):
+    topic = FakeTopic()
+    monkeypatch.setattr("kafka.handlers.reply_matcher.send_to_responses", topic)
+    return topic
+
+
+@pytest.fixture
+def failed(monkeypatch):
+    topic = FakeTopic()
+    monkeypatch.setattr("kafka.handlers.reply_matcher.send_to_failed", topic)
+    return topic
+
+
+@pytest.fixture
+def matcher(modem, pending_replies, responses, failed, monkeypatch):
+    monkeypatch.setattr(modem, "sync_inbox", lambda: [])
+    return ReplyMatcher(ModemPool([modem]), pending_replies, threading.Event())
+
+
+def add_command(pending_replies, message_id: int, sent_at: float, deadline: float = None):
+    pending_replies.add(
+        message_id,
+        DEVICE_PHONE,
+        {"message_id": message_id, "phone": DEVICE_PHONE},
+        sent_at=sent_at,
+        deadline=deadline or sent_at + 600,
+        modem="modem",
+    )
+
+
+def replies_by_message(responses: FakeTopic) -> dict[int, str]:
+    return {payload["message_id"]: payload["content"] for payload in responses.published}
+
+
+class TestReplyMatcher:
+    def test_reply_resolves_command(self, matcher, pending_replies, receive, responses):
+        now = int(time.time())
+        add_command(pending_replies, 1, now - 60)
+        receive(make_message(DEVICE_PHONE, "OK", now - 30))
+
+        matcher.match_once()
+        responses.confirm()
+
+        assert replies_by_message(responses) == {1: "OK"}
+        assert pending_replies.get_awaiting() == []
+
+    def test_one_reply_answers_only_the_oldest_command(self, matcher, pending_replies, receive, responses):
+        now = int(time.time())
+        add_command(pending_replies, 1, now - 60)
+        add_command(pending_replies, 2, now - 50)
+        receive(make_message(DEVICE_PHONE, "OK", now - 30))
+
+        matcher.match_once()
+        responses.confirm()
+        matcher.match_once()
+
+        assert replies_by_message(responses) == {1: "OK"}
+        assert [pending["message_id"] for pending in pending_replies.get_awaiting()] == [2]
+
+    def test_replies_are_matched_in_send_order(self, matcher, pending_replies, receive, responses):
+        now = int(time.time())
+        add_command(pending_replies, 1, now - 60)
+        add_command(pending_replies, 2, now - 50)
+        receive(make_message(DEVICE_PHONE, "FIRST", now - 30), make_message(DEVICE_PHONE, "SECOND", now - 20))
+
+        matcher.match_once()
+
+        assert replies_by_message(responses) == {1: "FIRST", 2: "SECOND"}
+
+    def test_reply_before_a_later_command_is_not_taken_by_it(self, matcher, pending_replies, receive, responses):
+        now = int(time.time())
+        add_command(pending_replies, 1, now - 60)
+        receive(make_message(DEVICE_PHONE, "FIRST", now - 55))
+        matcher.match_once()
+        responses.confirm()
+
+        add_command(pending_replies, 2, now - 50)
+        receive(make_message(DEVICE_PHONE, "SECOND", now - 20))
+        matcher.match_once()
+
+        assert replies_by_message(responses) == {1: "FIRST", 2: "SECOND"}
+
+    def test_reply_being_published_is_not_taken_again(self, matcher, pending_replies, receive, responses):
+        now = int(time.time())
+        add_command(pending_replies, 1, now - 60)
+        receive(make_message(DEVICE_PHONE, "OK", now - 30))
+        matcher.match_once()
+
+        # The first reply is not confirmed by Kafka yet when the next command is checked
+        add_command(pending_replies, 2, now - 50)
+        matcher.match_once()
+
+        assert replies_by_message(responses) == {1: "OK"}
+
+    def test_taken_replies_survive_a_restart(self, modem, pending_replies, receive, responses, failed):
+        now = int(time.time())
+        add_command(pending_replies, 1, now - 60)
+        add_command(pending_replies, 2, now - 50)
+        receive(make_message(DEVICE_PHONE, "OK", now - 30))
+        ReplyMatcher(ModemPool([modem]), pending_replies, threading.Event()).match_once()
+        responses.confirm()
+
+        ReplyMatcher(ModemPool([modem]), pending_replies, threading.Event()).match_once()
+
+        assert len(responses.published) == 1
+        assert [pending["message_id"] for pending in pending_replies.get_awaiting()] == [2]
+
+    def test_failed_publish_releases_the_reply(self, matcher, pending_replies, receive, responses):
+        now = int(time.time())
+        add_command(pending_replies, 1, now - 60)
+        receive(make_message(DEVICE_PHONE, "OK", now - 30))
+        matcher.match_once()
+        responses.deliveries[0].set_exception(Exception("Broker down"))
+
+        matcher.match_once()
+        responses.confirm()
+
+        assert [payload["message_id"] for payload in responses.published] == [1, 1]
+        assert pending_replies.get_awaiting() == []
+
+    def test_expired_command_is_published_as_failed(self, matcher, pending_replies, responses, failed):
+        now = time.time()
+        add_command(pending_replies, 1, now - 700, deadline=now - 100)
+
+        matcher.match_once()
+        failed.confirm()
+
+        assert [payload["message_id"] for payload in failed.published] == [1]
+        assert responses.published == []
+        assert pending_replies.get_awaiting() == []
+
+    def test_expiry_being_published_does_not_wake_the_matcher(self, matcher, modem, pending_replies, failed):
+        now = time.time()
+        add_command(pending_replies, 1, now - 700, deadline=now - 100)
+        syncs = []
+
+        def sync_inbox():
+            syncs.append(time.time())
+            return []
+
+        modem.sync_inbox = sync_inbox
+
+        async def run_for(seconds: float):
+            task = asyncio.create_task(matcher.run_async())
+            await asyncio.sleep(seconds)
+            matcher.stop_event.set()
+            matcher.wake()
+            await task
+
+        # The expiry delivery stays unconfirmed, so the command is still awaiting with its deadline passed
+        asyncio.run(run_for(1.5))
+
+        assert len(failed.published) == 1
+        assert len(syncs) == 1
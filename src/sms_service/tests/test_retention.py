@@ -0,0 +1,53 @@
+import threading
+import time
+
+import pytest
+
+from modem.modem_pool import ModemPool
+from storage.retention import RetentionManager
+from storage.send_ledger import SendLedger
+from tests.conftest import DEVICE_PHONE
+from tools.fake_modem import BOX_INBOX, BOX_SENT
+
+HOUR = 60 * 60
+
+
+@pytest.fixture
+def retention(connected_modem, pending_replies, tmp_path):
+    ledger = SendLedger(str(tmp_path / "ledger.sqlite3"))
+    manager = RetentionManager(
+        ModemPool([connected_modem]),
+        pending_replies,
+        ledger,
+        threading.Event(),
+        archive=False,
+        modem_delete_after_seconds=HOUR,
+    )
+    yield manager
+    ledger.db.close()
+
+
+def box_size(fake_modem, box: int) -> int:
+    return len(fake_modem.modem.list_messages(box, page=1, read_count=1000, ascending=True))
+
+
+class TestModemCleanup:
+    def test_old_sent_messages_are_deleted(self, retention, fake_modem):
+        old = time.time() - 2 * HOUR
+        for i in range(3):
+            fake_modem.modem._store(BOX_SENT, DEVICE_PHONE, f"COMMAND {i}", old + i)
+        fake_modem.modem._store(BOX_SENT, DEVICE_PHONE, "RECENT", time.time())
+
+        retention.run_once()
+
+        assert box_size(fake_modem, BOX_SENT) == 1
+
+    def test_old_incoming_messages_are_deleted(self, retention, connected_modem, fake_modem):
+        fake_modem.modem._store(BOX_INBOX, DEVICE_PHONE, "OLD", time.time() - 2 * HOUR)
+        fake_modem.modem._store(BOX_INBOX, DEVICE_PHONE, "RECENT", time.time())
+        connected_modem.sync_inbox()
+
+        retention.run_once()
+
+        assert box_size(fake_modem, BOX_INBOX) == 1
+        assert box_size(fake_modem, BOX_SENT) == 0
@@ -0,0 +1,112 @@
+import json
+import threading
+import time
+
+import pytest
+
+from kafka import retry
+from kafka.consumers import TopicConsumer
+from kafka.retry import (
+    ATTEMPT_HEADER,
+    LAST_ERROR_HEADER,
+    ORIGINAL_TOPIC_HEADER,
+    RETRY_AT_HEADER,
+    get_attempt,
+    route_failure,
+)
+from tests.conftest import DEVICE_PHONE, FakeConsumer, FakeMessage, ImmediateDispatcher
+
+DELAYS = [30, 300]
+
+
+def make_message(payload: dict, topic: str = "sms_configuration", headers: dict | None = None, offset: int = 0):
+    return FakeMessage(json.dumps(payload).encode(), DEVICE_PHONE.encode(), topic, offset, headers)
+
+
+@pytest.fixture
+def produced(monkeypatch) -> list[dict]:
+    """Messages route_failure published, as topic, value, key and headers."""
+
+    produced = []
+
+    def send_raw(topic, value, key, headers=None):
+        produced.append({"topic": topic, "value": value, "key": key, "headers": headers})
+
+    monkeypatch.setattr(retry, "send_raw", send_raw)
+    return produced
+
+
+class TestRouteFailure:
+    def test_first_failure_goes_to_first_retry_topic(self, produced):
+        message = make_message({"message_id": 1})
+
+        route_failure(message, "Handler failed", DELAYS)
+
+        (published,) = produced
+        assert published["topic"] == "sms_configuration_retry_1"
+        assert published["value"] == message.value()
+        assert published["key"] == DEVICE_PHONE
+        assert published["headers"][ATTEMPT_HEADER] == "1"
+        assert published["headers"][LAST_ERROR_HEADER] == "Handler failed"
+        assert published["headers"][ORIGINAL_TOPIC_HEADER] == "sms_configuration"
+        assert float(published["headers"][RETRY_AT_HEADER]) == pytest.approx(time.time() + 30, abs=1)
+
+    def test_retry_message_goes_to_next_retry_topic(self, produced):
+        headers = {ATTEMPT_HEADER: "1", ORIGINAL_TOPIC_HEADER: "sms_configuration"}
+        message = make_message({"message_id": 1}, topic="sms_configuration_retry_1", headers=headers)
+
+        assert get_attempt(message) == 1
+        route_failure(message, "Handler failed", DELAYS)
+
+        assert produced[0]["topic"] == "sms_configuration_retry_2"
+        assert produced[0]["headers"][ATTEMPT_HEADER] == "2"
+        assert float(produced[0]["headers"][RETRY_AT_HEADER]) == pytest.approx(time.time() + 300, abs=1)
+
+    def test_last_attempt_goes_to_dead_letter_topic(self, produced):
+        headers = {ATTEMPT_HEADER: "2", ORIGINAL_TOPIC_HEADER: "sms_configuration"}
+        message = make_message({"message_id": 1}, topic="sms_configuration_retry_2", headers=headers)
+        dead_letters = []
+
+        route_failure(message, "Handler failed", DELAYS, on_dead_letter=dead_letters.append)
+
+        assert produced[0]["topic"] == "sms_configuration_dlq"
+        assert produced[0]["headers"][ATTEMPT_HEADER] == "3"
+        assert RETRY_AT_HEADER not in produced[0]["headers"]
+        assert dead_letters == [message]
+
+    def test_payload_retries_cap_attempts(self, produced):
+        route_failure(make_message({"message_id": 1, "retries": 1}), "Handler failed", DELAYS)
+
+        assert produced[0]["topic"] == "sms_configuration_dlq"
+
+
+class TestDelayedRetryTopic:
+    @pytest.fixture
+    def consumer(self):
+        consumer = TopicConsumer(
+            None, "sms_configuration_retry_1", ImmediateDispatcher(), threading.Event(), delayed=True
+        )
+        consumer.consumer = FakeConsumer()
+        return consumer
+
+    def test_message_not_due_pauses_partition(self, consumer):
+        consumer._process(make_message({}, offset=7, headers={RETRY_AT_HEADER: str(time.time() + 60)}))
+
+        assert consumer.dispatcher.handled == []
+        assert consumer.consumer.paused == {0}
+        assert consumer.consumer.seeks == [7]
+
+    def test_partition_resumed_once_due(self, consumer):
+        consumer._process(make_message({}, offset=7, headers={RETRY_AT_HEADER: str(time.time() + 60)}))
+        consumer.waiting[0] = time.time() - 1
+
+        consumer._commit()
+
+        assert consumer.consumer.paused == set()
+        assert consumer.waiting == {}
+
+    def test_due_message_is_handled(self, consumer):
+        consumer._process(make_message({}, offset=7, headers={RETRY_AT_HEADER: str(time.time() - 1)}))
+
+        assert consumer.dispatcher.handled == [7]
+        assert consumer.consumer.paused == set()
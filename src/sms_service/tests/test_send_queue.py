@@ -0,0 +1,116 @@
+import threading
+import time
+
+from modem.send_queue import PrioritySendQueue, QueuedSms, SendLane
+
+
+class FakePool:
+    """Sends instantly, phones in paced wait the given seconds after every send to them."""
+
+    def __init__(self, paced: dict[str, float] | None = None):
+        self.paced = paced or {}
+        self.sent = []
+        self._next_allowed = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, phone):
+        with self._lock:
+            delay = self._next_allowed.get(phone, 0) - time.monotonic()
+            if delay > 0:
+                return None, delay
+            if phone in self.paced:
+                self._next_allowed[phone] = time.monotonic() + self.paced[phone]
+            return "modem", 0.0
+
+    def send_sms(self, phone, message, modem_name=None):
+        with self._lock:
+            self.sent.append(message)
+        return True, "modem"
+
+
+def start(pool: FakePool, **kwargs) -> PrioritySendQueue:
+    queue = PrioritySendQueue(pool, **kwargs)
+    queue.start()
+    return queue
+
+
+class TestPrioritySendQueue:
+    def test_highest_lane_first(self):
+        pool = FakePool()
+        queue = PrioritySendQueue(pool)
+        results = [
+            queue.submit("+79990000001", "bulk", SendLane.BULK),
+            queue.submit("+79990000002", "interactive", SendLane.INTERACTIVE),
+            queue.submit("+79990000003", "code", SendLane.VERIFICATION),
+        ]
+
+        queue.start()
+        queue.join(timeout=5)
+
+        assert all(result.result(timeout=0)[0] for result in results)
+        assert pool.sent == ["code", "interactive", "bulk"]
+
+    def test_starving_message_sent_first(self):
+        pool = FakePool()
+        queue = PrioritySendQueue(pool, max_wait_seconds=0.05)
+        queue.submit("+79990000001", "bulk", SendLane.BULK)
+        time.sleep(0.1)
+        queue.submit("+79990000002", "code", SendLane.VERIFICATION)
+
+        queue.start()
+        queue.join(timeout=5)
+
+        assert pool.sent == ["bulk", "code"]
+
+    def test_paced_message_does_not_hold_sender(self):
+        pool = FakePool(paced={"+79990000001": 0.3})
+        queue = start(pool, workers=1)
+
+        queue.submit("+79990000001", "first", SendLane.INTERACTIVE).result(timeout=5)
+        second = queue.submit("+79990000001", "second", SendLane.INTERACTIVE)
+        other = queue.submit("+79990000002", "other", SendLane.BULK)
+
+        # The single sender sends the lower lane while the paced message waits
+        assert other.result(timeout=0.2)[0]
+        assert not second.done()
+        assert second.result(timeout=5)[0]
+        queue.join(timeout=5)
+
+        assert pool.sent == ["first", "other", "second"]
+
+    def test_join_sends_deferred_messages(self):
+        pool = FakePool(paced={"+79990000001": 0.1})
+        queue = start(pool)
+        queue.submit("+79990000001", "first", SendLane.INTERACTIVE)
+        second = queue.submit("+79990000001", "second", SendLane.INTERACTIVE)
+
+        queue.join(timeout=5)
+
+        assert second.result(timeout=0)[0]
+        assert pool.sent == ["first", "second"]
+
+    def test_deferred_messages_counted_as_queued(self):
+        pool = FakePool(paced={"+79990000001": 60})
+        queue = start(pool)
+        queue.submit("+79990000001", "first", SendLane.INTERACTIVE).result(timeout=5)
+        queue.submit("+79990000001", "second", SendLane.INTERACTIVE)
+
+        deadline = time.monotonic() + 5
+        while not queue._deferred and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        interactive = next(stats for stats in queue.stats() if stats["lane"] == "interactive")
+        assert interactive["queued"] == 1
+        assert interactive["sent"] == 1
+
+    def test_due_deferred_messages_keep_their_order(self):
+        pool = FakePool()
+        queue = PrioritySendQueue(pool)
+        queue.submit("+79990000003", "queued", SendLane.INTERACTIVE)
+        queue._defer(QueuedSms("+79990000001", "first", SendLane.INTERACTIVE), 0)
+        queue._defer(QueuedSms("+79990000002", "second", SendLane.INTERACTIVE), 0)
+
+        queue.start()
+        queue.join(timeout=5)
+
+        assert pool.sent == ["first", "second", "queued"]
@@ -0,0 +1,106 @@
+import threading
+import time
+
+import pytest
+import requests
+from huawei_lte_api.exceptions import ResponseErrorLoginRequiredException
+
+from modem import session
+from modem.session import ModemSessionPool
+
+
+class FakeConnection:
+    """Stands in for a logged in huawei_lte_api connection."""
+
+    def __init__(self, url, **kwargs):
+        self.url = url
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def connections(monkeypatch) -> list[FakeConnection]:
+    """Every connection the pool logged in with, the client handed to fn is its connection."""
+
+    connections = []
+
+    def connect(url, **kwargs):
+        connections.append(FakeConnection(url, **kwargs))
+        return connections[-1]
+
+    monkeypatch.setattr(session, "Connection", connect)
+    monkeypatch.setattr(session, "Client", lambda connection: connection)
+    return connections
+
+
+@pytest.fixture
+def pool(connections):
+    pool = ModemSessionPool("http://modem.test/", size=1, max_idle_seconds=60)
+    yield pool
+    pool.close()
+
+
+class TestModemSessionPool:
+    def test_session_is_reused(self, pool, connections):
+        assert pool.call(lambda client: client) is pool.call(lambda client: client)
+        assert len(connections) == 1
+
+    def test_expired_session_logs_in_again(self, pool, connections):
+        calls = []
+
+        def fn(client):
+            calls.append(client)
+            if len(calls) == 1:
+                raise ResponseErrorLoginRequiredException("Login required", 100003)
+            return "OK"
+
+        assert pool.call(fn) == "OK"
+        assert len(connections) == 2
+        assert connections[0].closed
+        assert calls == connections
+
+    def test_request_error_closes_session(self, pool, connections):
+        def fail(client):
+            raise requests.exceptions.ConnectionError("Modem unreachable")
+
+        with pytest.raises(requests.exceptions.ConnectionError):
+            pool.call(fail)
+
+        assert connections[0].closed
+        assert pool.call(lambda client: client) is connections[1]
+
+    def test_idle_session_logs_in_again(self, pool, connections):
+        pool.call(lambda client: client)
+        pool._all_sessions[0].last_used = time.time() - 120
+
+        assert pool.call(lambda client: client) is connections[1]
+        assert connections[0].closed
+
+    def test_pool_size_caps_concurrent_calls(self, connections):
+        pool = ModemSessionPool("http://modem.test/", size=2)
+        lock = threading.Lock()
+        running = []
+        max_running = []
+        release = threading.Event()
+
+        def fn(client):
+            with lock:
+                running.append(client)
+                max_running.append(len(running))
+            release.wait(5)
+            with lock:
+                running.remove(client)
+
+        threads = [threading.Thread(target=pool.call, args=(fn,)) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.2)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        assert max(max_running) == 2
+        assert len(connections) == 2
+        pool.close()
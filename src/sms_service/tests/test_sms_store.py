@@ -0,0 +1,98 @@
+import sqlite3
+import time
+
+import pytest
+
+from storage.database import Database
+from storage.sms_store import SmsStore
+from tests.conftest import DEVICE_PHONE, make_message
+
+DAY = 24 * 60 * 60
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SmsStore(Database(str(tmp_path / "store.sqlite3")))
+    yield store
+    store.db.close()
+
+
+def stored_indexes(store: SmsStore) -> list[int]:
+    return [row[0] for row in store.db.execute("SELECT modem_index FROM sms_messages ORDER BY modem_index")]
+
+
+class TestSyncState:
+    def test_empty_state(self, store):
+        assert store.get_sync_state(1) == (-1, 0.0)
+
+    def test_state_is_kept_per_box(self, store):
+        store.set_sync_state(1, 10, 1000.0)
+        store.set_sync_state(2, 5, 500.0)
+        store.set_sync_state(1, 12, 1200.0)
+
+        assert store.get_sync_state(1) == (12, 1200.0)
+        assert store.get_sync_state(2) == (5, 500.0)
+
+
+class TestSaveMessages:
+    def test_known_messages_are_ignored(self, store):
+        now = int(time.time())
+        message = make_message(DEVICE_PHONE, "OK", now, index=1)
+
+        store.save_messages([message])
+        store.save_messages([message, make_message(DEVICE_PHONE, "AGAIN", now, index=2)])
+
+        assert stored_indexes(store) == [1, 2]
+
+
+class TestReplyLookup:
+    def test_first_reply_since_timestamp(self, store):
+        now = int(time.time())
+        store.save_messages(
+            [
+                make_message(DEVICE_PHONE, "BEFORE", now - 30, index=1),
+                make_message(DEVICE_PHONE, "OUT", now - 10, message_type="outgoing", index=2),
+                make_message(DEVICE_PHONE, "OK", now - 5, index=3),
+            ]
+        )
+
+        assert store.get_reply_from_phone_since(DEVICE_PHONE, now - 20) == (3, "OK")
+        assert store.get_reply_from_phone_since(DEVICE_PHONE, now - 20, exclude={3}) is None
+
+
+class TestArchive:
+    @pytest.fixture
+    def old_messages(self, store):
+        old = time.time() - 40 * DAY
+        store.save_messages([make_message(DEVICE_PHONE, f"OLD {index}", old + index, index=index) for index in (1, 2)])
+        store.save_messages([make_message(DEVICE_PHONE, "NEW", time.time(), index=3)])
+        store.mark_deleted_from_modem([1])
+
+    def test_only_messages_deleted_from_modem_are_archived(self, store, old_messages, tmp_path):
+        archive_path = str(tmp_path / "archive.sqlite3")
+
+        assert store.archive(time.time() - 30 * DAY, max_rows=0, archive_path=archive_path) == 1
+
+        assert stored_indexes(store) == [2, 3]
+        assert store.get_modem_indexes_to_delete(time.time() - DAY, limit=10) == [2]
+        with sqlite3.connect(archive_path) as archive:
+            rows = archive.execute("SELECT phone, content, modem_index, message_type FROM sms_messages").fetchall()
+        assert rows == [(DEVICE_PHONE, "OLD 1", 1, "incoming")]
+
+    def test_max_rows_archives_oldest_deleted_messages(self, store, old_messages):
+        store.mark_deleted_from_modem([2])
+
+        assert store.archive(0, max_rows=1) == 2
+
+        assert stored_indexes(store) == [3]
+
+    def test_archive_keeps_its_own_ids(self, store, old_messages, tmp_path):
+        archive_path = str(tmp_path / "archive.sqlite3")
+        store.archive(time.time() - 30 * DAY, max_rows=0, archive_path=archive_path)
+        store.mark_deleted_from_modem([2])
+
+        store.archive(time.time() - 30 * DAY, max_rows=0, archive_path=archive_path)
+
+        with sqlite3.connect(archive_path) as archive:
+            rows = archive.execute("SELECT modem_index FROM sms_messages ORDER BY id").fetchall()
+        assert rows == [(1,), (2,)]
@@ -0,0 +1,242 @@
+"""
+End-to-end throughput benchmark of sms_service against fake modems.
+
+Starts the fake modems, runs the service against them, produces configuration or verification messages
+to Kafka the way the backend does and reports the SMS sent per minute, the latency percentiles until the reply
+is published to sms_responses (or until the modem sent the SMS for verification messages) and the number
+of requests every modem received.
+
+Needs a running Kafka with the topics of init_topics.sh. Run from src/sms_service:
+    python -m tools.benchmark --messages 200 --devices 50 --modems 2
+The service settings (MODEM_SMS_PER_MINUTE, REPLY_POLL_INTERVAL_SECONDS, ...) are taken from the environment.
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Dict, List
+
+from confluent_kafka import Consumer, Producer, TopicPartition
+
+from config import KAFKA_SERVERS, KafkaTopic
+from tools.fake_modem import FakeModemServer, add_modem_arguments, start_modems
+
+logger = logging.getLogger(__name__)
+
+SERVICE_DIR = os.path.join(os.path.dirname(__file__), "..")
+
+
+def load_device_commands(path: str) -> List[str]:
+    """Templates of every command of phone_commands.json, sent to the simulated devices with random parameters."""
+
+    with open(path, "r", encoding="utf-8") as f:
+        commands = json.load(f)
+    return [spec["template"] for model_commands in commands.values() for spec in model_commands.values()]
+
+
+def percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = math.ceil(percent / 100 * len(ordered)) - 1
+    return ordered[min(max(rank, 0), len(ordered) - 1)]
+
+
+def make_payloads(args: argparse.Namespace, first_id: int) -> List[dict]:
+    rnd = random.Random(args.seed)
+    devices = [f"+79{rnd.randrange(10**9):09d}" for _ in range(args.devices)]
+    commands = load_device_commands(args.commands)
+
+    payloads = []
+    for i in range(args.messages):
+        message_id = first_id + i
+        if args.topic == KafkaTopic.SMS_VERIFICATION.value:
+            content = f"Verification code {message_id}"
+        else:
+            content = rnd.choice(commands).format(
+                pwd="1234", index=f"{rnd.randint(1, 999):03d}", phone=f"9{rnd.randrange(10**9):09d}"
+            )
+        payloads.append(
+            {
+                "message_id": message_id,
+                "phone": devices[i % len(devices)],
+                "content": content,
+                "retries": args.retries,
+            }
+        )
+    return payloads
+
+
+def create_result_consumer() -> Consumer:
+    """Read sms_responses and failed_messages from their current end, so only this run is seen."""
+
+    consumer = Consumer(
+        {"bootstrap.servers": KAFKA_SERVERS, "group.id": f"benchmark-{uuid.uuid4()}", "enable.auto.commit": False}
+    )
+    partitions = []
+    for topic in (KafkaTopic.SMS_RESPONSES.value, KafkaTopic.FAILED_MESSAGES.value):
+        for partition in consumer.list_topics(topic, timeout=10).topics[topic].partitions:
+            _, high = consumer.get_watermark_offsets(TopicPartition(topic, partition), timeout=10)
+            partitions.append(TopicPartition(topic, partition, high))
+    consumer.assign(partitions)
+    return consumer
+
+
+def start_service(modems: List[FakeModemServer], db_dir: str) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "MODEM_HOSTS": ",".join(server.address for server in modems),
+        "DB_PATH": os.path.join(db_dir, "sms_storage.sqlite3"),
+    }
+    return subprocess.Popen([sys.executable, "main.py"], cwd=SERVICE_DIR, env=env)
+
+
+def stop_service(service: subprocess.Popen):
+    service.send_signal(signal.SIGTERM)
+    try:
+        service.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        logger.warning("Service did not stop in time, killing it")
+        service.kill()
+        service.wait()
+
+
+def produce(args: argparse.Namespace, payloads: List[dict]) -> Dict[int, float]:
+    producer = Producer({"bootstrap.servers": KAFKA_SERVERS, "linger.ms": 5})
+    produced_at = {}
+    interval = 1 / args.rate if args.rate else 0
+
+    for payload in payloads:
+        payload["timestamp"] = time.time()
+        produced_at[payload["message_id"]] = payload["timestamp"]
+        producer.produce(args.topic, key=payload["phone"], value=json.dumps(payload))
+        producer.poll(0)
+        if interval:
+            time.sleep(interval)
+
+    if producer.flush(30):
+        raise ConnectionError("Not every benchmark message was delivered to Kafka")
+    return produced_at
+
+
+def collect_results(args: argparse.Namespace, consumer: Consumer, modems: List[FakeModemServer], payloads: List[dict]):
+    """Wait until every message was answered, failed or sent (verification), or the timeout passed."""
+
+    expected = {payload["message_id"] for payload in payloads}
+    by_content = {payload["content"]: payload["message_id"] for payload in payloads}
+    replied: Dict[int, float] = {}
+    failed: Dict[int, float] = {}
+    deadline = time.time() + args.timeout
+
+    def sent() -> Dict[int, float]:
+        return {
+            by_content[content]: sent_at
+            for server in modems
+            for sent_at, _, content in list(server.modem.sent_log)
+            if content in by_content
+        }
+
+    while time.time() < deadline:
+        msg = consumer.poll(0.5)
+        if msg is not None and not msg.error():
+            try:
+                message_id = json.loads(msg.value().decode("utf-8")).get("message_id")
+            except Exception:
+                message_id = None
+            if message_id in expected:
+                target = failed if msg.topic() == KafkaTopic.FAILED_MESSAGES.value else replied
+                target.setdefault(message_id, time.time())
+
+        finished = replied.keys() | failed.keys()
+        if args.topic == KafkaTopic.SMS_VERIFICATION.value:
+            finished |= sent().keys()
+        if expected <= finished:
+            break
+
+    return replied, failed, sent()
+
+
+def report(
+    args: argparse.Namespace,
+    modems: List[FakeModemServer],
+    produced_at: Dict[int, float],
+    replied: Dict[int, float],
+    failed: Dict[int, float],
+    sent: Dict[int, float],
+):
+    started = min(produced_at.values())
+    done = replied if args.topic == KafkaTopic.SMS_CONFIGURATION.value else sent
+    latencies = [done[message_id] - produced_at[message_id] for message_id in done]
+    sent_minutes = (max(sent.values()) - started) / 60 if sent else 0
+
+    print(f"Messages produced:     {len(produced_at)} to {args.topic}")
+    print(f"SMS sent:              {len(sent)}")
+    print(f"Replies published:     {len(replied)}")
+    print(f"Failed messages:       {len(failed)}")
+    print(f"Unfinished:            {len(produced_at) - len(done.keys() | failed.keys())}")
+    print(f"Throughput:            {len(sent) / sent_minutes if sent_minutes else 0:.1f} SMS/min")
+    label = "reply" if args.topic == KafkaTopic.SMS_CONFIGURATION.value else "send"
+    print(
+        f"Latency until {label}:   p50={percentile(latencies, 50):.2f}s p90={percentile(latencies, 90):.2f}s "
+        f"p99={percentile(latencies, 99):.2f}s max={max(latencies, default=0):.2f}s"
+    )
+    for server in modems:
+        stats = server.modem.stats()
+        requests = ", ".join(f"{path}={count}" for path, count in sorted(stats["requests"].items()))
+        print(f"Modem {stats['name']} requests: total={sum(stats['requests'].values())} ({requests})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_modem_arguments(parser)
+    parser.add_argument(
+        "--topic",
+        choices=[KafkaTopic.SMS_CONFIGURATION.value, KafkaTopic.SMS_VERIFICATION.value],
+        default=KafkaTopic.SMS_CONFIGURATION.value,
+    )
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--devices", type=int, default=20, help="number of distinct destination phones")
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--rate", type=float, default=0, help="messages produced per second, 0 produces all at once")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for the messages to finish")
+    parser.add_argument("--warmup", type=float, default=15, help="seconds the service gets to join the topics")
+    parser.add_argument(
+        "--no-service", action="store_true", help="do not start the service, one is already running on the modems"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    modems = start_modems(args)
+    print("MODEM_HOSTS=" + ",".join(server.address for server in modems))
+    consumer = create_result_consumer()
+    service = None
+
+    with tempfile.TemporaryDirectory() as db_dir:
+        try:
+            if not args.no_service:
+                service = start_service(modems, db_dir)
+            time.sleep(args.warmup)
+
+            payloads = make_payloads(args, first_id=int(time.time() * 1000))
+            produced_at = produce(args, payloads)
+            replied, failed, sent = collect_results(args, consumer, modems, payloads)
+            report(args, modems, produced_at, replied, failed, sent)
+        finally:
+            if service:
+                stop_service(service)
+            consumer.close()
+            for server in modems:
+                server.stop()
+
+
+if __name__ == "__main__":
+    main()
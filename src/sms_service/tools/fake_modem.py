@@ -0,0 +1,425 @@
+"""
+Local stand-in for a Huawei LTE modem, implementing the part of its web API used by HuaweiModemClient:
+login, sending SMS, listing the inbox and sent boxes and deleting messages.
+
+Devices answer configuration commands from phone_commands.json with a reply matching the response_pattern
+of the command, so the whole send and reply path can be exercised without hardware.
+
+Run from src/sms_service:
+    python -m tools.fake_modem --modems 2 --send-latency 0.5 --reply-delay 3
+and start the service with the printed MODEM_HOSTS.
+"""
+
+import argparse
+import base64
+import datetime
+import heapq
+import itertools
+import json
+import logging
+import math
+import os
+import random
+import re
+import secrets
+import string
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Tuple
+
+import xmltodict
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COMMANDS_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "..", "backend", "message_management", "configs", "phone_commands.json"
+)
+
+# Replies of the commands whose response_pattern is not a plain string, formatted with the command parameters
+REPLY_TEMPLATES = {
+    ("RTU5025", "add_phone"): "{index}:7{phone}",
+    ("RTU5025", "delete_phone"): "{index}:Empty.",
+}
+
+BOX_INBOX = 1
+BOX_SENT = 2
+
+ERROR_SYSTEM_BUSY = 100004
+ERROR_NO_RIGHTS = 100003
+ERROR_NO_SUPPORT = 100002
+ERROR_USERNAME_PWD_WRONG = 108006
+ERROR_SMS_NOT_FOUND = 113053
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class CommandReplies:
+    """Recognizes the commands of phone_commands.json in a sent SMS and builds the reply of the device."""
+
+    def __init__(self, commands: dict):
+        self._commands: List[Tuple[re.Pattern, str]] = []
+        for model, model_commands in commands.items():
+            for command, spec in model_commands.items():
+                reply = self._get_reply(model, command, spec["response_pattern"])
+                if reply is None:
+                    logger.warning("No auto-reply for %s %s, the device will not answer it", model, command)
+                    continue
+                self._commands.append((self._compile_template(spec["template"]), reply))
+
+    @classmethod
+    def from_file(cls, path: str = DEFAULT_COMMANDS_PATH) -> "CommandReplies":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    @staticmethod
+    def _compile_template(template: str) -> re.Pattern:
+        pattern = ""
+        for literal, field, _, _ in string.Formatter().parse(template):
+            pattern += re.escape(literal)
+            if field:
+                pattern += f"(?P<{field}>.+?)"
+        return re.compile(pattern)
+
+    @staticmethod
+    def _get_reply(model: str, command: str, response_pattern: str) -> str | None:
+        reply = REPLY_TEMPLATES.get((model, command))
+        if reply is None and re.escape(response_pattern) == response_pattern:
+            # A plain string pattern is its own reply
+            reply = response_pattern
+        if reply is None:
+            return None
+
+        example = reply.format_map(_ExampleParams())
+        if not re.match(response_pattern, example):
+            raise ValueError(f"Auto-reply {reply!r} of {model} {command} does not match {response_pattern!r}")
+        return reply
+
+    def reply_to(self, content: str) -> str | None:
+        for template, reply in self._commands:
+            match = template.fullmatch(content)
+            if match:
+                return reply.format(**match.groupdict())
+        return None
+
+
+class _ExampleParams(dict):
+    """Parameter values used to check the reply templates against their response patterns."""
+
+    def __missing__(self, key: str) -> str:
+        return {"index": "003", "phone": "9854500040"}.get(key, "1234")
+
+
+class FakeModem:
+    """State of one fake modem: the message boxes, the logged in sessions and the request counts."""
+
+    def __init__(
+        self,
+        name: str = "modem",
+        username: str = "admin",
+        password: str = "password",
+        send_latency: float = 0.0,
+        failure_rate: float = 0.0,
+        reply_delay: float = 2.0,
+        inbox_size: int = 0,
+        session_timeout: float = 300,
+        replies: CommandReplies | None = None,
+        seed: int | None = None,
+    ):
+        self.name = name
+        self.username = username
+        self.password = password
+        self.send_latency = send_latency
+        self.failure_rate = failure_rate
+        self.reply_delay = reply_delay
+        self.session_timeout = session_timeout
+        self.replies = replies
+        self.requests: Counter = Counter()
+        self.sent_log: List[Tuple[float, str, str]] = []
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._indexes = itertools.count(40000)
+        self._boxes: Dict[int, Dict[int, dict]] = {BOX_INBOX: {}, BOX_SENT: {}}
+        self._incoming: List[Tuple[float, int, str, str]] = []
+        self._sessions: Dict[str, float] = {}
+
+        now = time.time()
+        for i in range(inbox_size):
+            self._store(BOX_INBOX, f"+7900{i:07d}", f"Filler message {i}", now - inbox_size + i)
+
+    def _store(self, box: int, phone: str, content: str, timestamp: float):
+        index = next(self._indexes)
+        # The modem keeps whole seconds, rounded up so a reply never looks older than the SMS it answers
+        date = datetime.datetime.fromtimestamp(math.ceil(timestamp))
+        self._boxes[box][index] = {
+            "Smstat": "0" if box == BOX_INBOX else "3",
+            "Index": str(index),
+            "Phone": phone,
+            "Content": content,
+            "Date": date.strftime(DATETIME_FORMAT),
+            "Sca": None,
+            "SaveType": "4",
+            "Priority": "0",
+            "SmsType": "1",
+        }
+
+    def _deliver_due_replies(self):
+        now = time.time()
+        while self._incoming and self._incoming[0][0] <= now:
+            arrives_at, _, phone, content = heapq.heappop(self._incoming)
+            self._store(BOX_INBOX, phone, content, arrives_at)
+
+    def count_request(self, path: str):
+        with self._lock:
+            self.requests[path] += 1
+
+    def open_session(self) -> str:
+        session_id = secrets.token_hex(16)
+        with self._lock:
+            self._sessions[session_id] = 0.0
+        return session_id
+
+    def is_logged_in(self, session_id: str | None) -> bool:
+        with self._lock:
+            last_used = self._sessions.get(session_id)
+            if not last_used or time.time() - last_used > self.session_timeout:
+                return False
+            self._sessions[session_id] = time.time()
+            return True
+
+    def login(self, session_id: str, username: str, password: str) -> bool:
+        if username != self.username or password != self.password:
+            return False
+        with self._lock:
+            self._sessions[session_id] = time.time()
+        return True
+
+    def logout(self, session_id: str | None):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def send_sms(self, phones: List[str], content: str) -> bool:
+        if self.send_latency:
+            time.sleep(self.send_latency)
+        if self._random.random() < self.failure_rate:
+            return False
+
+        now = time.time()
+        with self._lock:
+            for phone in phones:
+                self._store(BOX_SENT, phone, content, now)
+                self.sent_log.append((now, phone, content))
+                reply = self.replies.reply_to(content) if self.replies else None
+                if reply is not None:
+                    heapq.heappush(self._incoming, (now + self.reply_delay, next(self._indexes), phone, reply))
+        return True
+
+    def list_messages(self, box: int, page: int, read_count: int, ascending: bool) -> List[dict]:
+        with self._lock:
+            self._deliver_due_replies()
+            messages = sorted(
+                self._boxes.get(box, {}).values(),
+                key=lambda msg: (msg["Date"], int(msg["Index"])),
+                reverse=not ascending,
+            )
+        start = (max(page, 1) - 1) * read_count
+        return messages[start : start + read_count]
+
+    def delete_sms(self, index: int) -> bool:
+        with self._lock:
+            return any(box.pop(index, None) is not None for box in self._boxes.values())
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "name": self.name,
+                "requests": dict(self.requests),
+                "sent": len(self.sent_log),
+                "inbox": len(self._boxes[BOX_INBOX]),
+                "replies_pending": len(self._incoming),
+            }
+
+
+class FakeModemRequestHandler(BaseHTTPRequestHandler):
+    server: "FakeModemServer"
+
+    def log_message(self, format: str, *args):
+        logger.debug("%s %s", self.server.modem.name, format % args)
+
+    @property
+    def modem(self) -> FakeModem:
+        return self.server.modem
+
+    def _session_id(self) -> str | None:
+        for cookie in self.headers.get("Cookie", "").split(";"):
+            name, _, value = cookie.strip().partition("=")
+            if name == "SessionID":
+                return value
+        return None
+
+    def _reply(self, body: str, content_type: str = "text/xml", session_id: str | None = None):
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", f"{content_type}; charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("__RequestVerificationToken", secrets.token_hex(16))
+        if session_id:
+            self.send_header("Set-Cookie", f"SessionID={session_id}; path=/; HttpOnly")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _response(self, data, session_id: str | None = None):
+        self._reply(xmltodict.unparse({"response": data}), session_id=session_id)
+
+    def _error(self, code: int):
+        self._reply(xmltodict.unparse({"error": {"code": code, "message": ""}}))
+
+    def _read_request(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        return (xmltodict.parse(body).get("request") or {}) if body else {}
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        self.modem.count_request(path)
+
+        if path == "/":
+            session_id = self.modem.open_session()
+            token = secrets.token_hex(16)
+            html = f'<html><head><meta name="csrf_token" content="{token}"/></head><body></body></html>'
+            self._reply(html, content_type="text/html", session_id=session_id)
+        elif path == "/api/webserver/SesTokInfo":
+            self._response({"SesInfo": f"SessionID={self.modem.open_session()}", "TokInfo": secrets.token_hex(16)})
+        elif path == "/api/user/state-login":
+            state = 0 if self.modem.is_logged_in(self._session_id()) else -1
+            self._response({"State": state, "Username": self.modem.username, "password_type": 0})
+        else:
+            self._error(ERROR_NO_SUPPORT)
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        self.modem.count_request(path)
+        request = self._read_request()
+        session_id = self._session_id()
+
+        if path == "/api/user/login":
+            session_id = session_id or self.modem.open_session()
+            password = base64.b64decode(request.get("Password") or "").decode("utf-8")
+            if self.modem.login(session_id, request.get("Username"), password):
+                self._response("OK", session_id=session_id)
+            else:
+                self._error(ERROR_USERNAME_PWD_WRONG)
+            return
+        if path == "/api/user/logout":
+            self.modem.logout(session_id)
+            self._response("OK")
+            return
+
+        if not self.modem.is_logged_in(session_id):
+            self._error(ERROR_NO_RIGHTS)
+        elif path == "/api/sms/send-sms":
+            phones = (request.get("Phones") or {}).get("Phone") or []
+            phones = [phones] if isinstance(phones, str) else phones
+            if self.modem.send_sms(phones, request.get("Content") or ""):
+                self._response("OK")
+            else:
+                self._error(ERROR_SYSTEM_BUSY)
+        elif path == "/api/sms/sms-list":
+            messages = self.modem.list_messages(
+                int(request.get("BoxType", BOX_INBOX)),
+                int(request.get("PageIndex", 1)),
+                int(request.get("ReadCount", 20)),
+                request.get("Ascending") == "1",
+            )
+            # Like the real modem, Count is the number of messages on the requested page
+            self._response({"Count": len(messages), "Messages": {"Message": messages} if messages else None})
+        elif path == "/api/sms/delete-sms":
+            if self.modem.delete_sms(int(request.get("Index", -1))):
+                self._response("OK")
+            else:
+                self._error(ERROR_SMS_NOT_FOUND)
+        else:
+            self._error(ERROR_NO_SUPPORT)
+
+
+class FakeModemServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, modem: FakeModem, host: str = "127.0.0.1", port: int = 0):
+        super().__init__((host, port), FakeModemRequestHandler)
+        self.modem = modem
+        self._thread: threading.Thread | None = None
+
+    @property
+    def address(self) -> str:
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name=f"FakeModem-{self.modem.name}", daemon=True)
+        self._thread.start()
+        logger.info("Fake modem %s listening on %s", self.modem.name, self.address)
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread:
+            self._thread.join()
+
+
+def add_modem_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--modems", type=int, default=1, help="number of fake modems")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080, help="port of the first modem, the others follow it")
+    parser.add_argument("--username", default=os.getenv("MODEM_USERNAME", "admin"))
+    parser.add_argument("--password", default=os.getenv("MODEM_PASSWORD", "password"))
+    parser.add_argument("--send-latency", type=float, default=0.5, help="seconds the modem takes to send an SMS")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="share of sends refused by the modem")
+    parser.add_argument("--reply-delay", type=float, default=2.0, help="seconds until a device answers a command")
+    parser.add_argument("--inbox-size", type=int, default=0, help="unrelated messages already in every inbox")
+    parser.add_argument("--commands", default=DEFAULT_COMMANDS_PATH, help="path to phone_commands.json")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def start_modems(args: argparse.Namespace) -> List[FakeModemServer]:
+    replies = CommandReplies.from_file(args.commands)
+    servers = []
+    for index in range(args.modems):
+        modem = FakeModem(
+            name=f"modem{index}",
+            username=args.username,
+            password=args.password,
+            send_latency=args.send_latency,
+            failure_rate=args.failure_rate,
+            reply_delay=args.reply_delay,
+            inbox_size=args.inbox_size,
+            replies=replies,
+            seed=None if args.seed is None else args.seed + index,
+        )
+        server = FakeModemServer(modem, args.host, args.port + index)
+        server.start()
+        servers.append(server)
+    return servers
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_modem_arguments(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    servers = start_modems(args)
+    print("MODEM_HOSTS=" + ",".join(server.address for server in servers))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            server.stop()
+            print(json.dumps(server.modem.stats()))
+
+
+if __name__ == "__main__":
+    main()
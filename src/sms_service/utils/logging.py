@@ -1,12 +1,121 @@
+import atexit
+import copy
+import json
 import logging
 import os
+import queue
 import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
 
+# The backend and sms_service are built as separate images from their own directories, so they cannot import
+# a common package. src/backend/core/logging.py holds the same filter, queue handler and level helpers,
+# a change to one of them must be made in both files. Only the JSON keys and the setup function differ.
 
-def setup_logging():
-    log_formatter = logging.Formatter(
-        "%(asctime)s | %(levelname)s | %(name)s | [%(threadName)s] | %(message)s", datefmt="%Y-%m-%d %H:%M:%S"
-    )
+TEXT_FORMAT = "%(asctime)s | %(levelname)s | %(name)s | [%(threadName)s] | %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for Promtail to parse without a regex."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets a record logged with extra={"rate_limit": seconds} through at most once per interval for every
+    logger and message template. The next record let through tells how many were dropped meanwhile.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._seen: dict[tuple[str, str], tuple[float, int]] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        interval = getattr(record, "rate_limit", None)
+        if not interval:
+            return True
+
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            last, dropped = self._seen.get(key, (None, 0))
+            if last is not None and now - last < interval:
+                self._seen[key] = (last, dropped + 1)
+                return False
+            self._seen[key] = (now, 0)
+
+        if dropped:
+            record.msg = f"{record.msg} ({dropped} similar messages suppressed)"
+        return True
+
+
+class LogQueueHandler(QueueHandler):
+    """Hands records to the listener thread, only merging the message arguments in the logging thread."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg, record.args = record.message, None
+        if record.exc_info:
+            # Traceback objects keep whole frames alive, the listener only needs the text
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def apply_log_levels(spec: str):
+    """Set logger levels from "name=LEVEL" pairs separated by commas or new lines, "root" names the root logger."""
+
+    for item in spec.replace("\n", ",").split(","):
+        item = item.split("#", 1)[0].strip()
+        if not item:
+            continue
+        name, _, level = item.partition("=")
+        name = name.strip()
+        try:
+            logging.getLogger(None if name == "root" else name).setLevel(level.strip().upper())
+        except ValueError:
+            logging.getLogger(__name__).warning("Unknown log level in %r", item)
+
+
+def reload_log_levels(*args):
+    """Apply the levels of LOG_LEVELS_FILE, called on SIGHUP so levels can be changed without a restart."""
+
+    path = os.getenv("LOG_LEVELS_FILE", "log_levels.conf")
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            apply_log_levels(f.read())
+    except FileNotFoundError:
+        return
+    logging.getLogger(__name__).info("Log levels reloaded from %s", path)
+
+
+def setup_logging() -> QueueListener:
+    """
+    Log through a queue, so threads on the send path never wait for stdout or the log file.
+    A single listener thread formats the records, as JSON unless LOG_FORMAT=text.
+    """
+
+    if os.getenv("LOG_FORMAT", "json") == "text":
+        log_formatter = logging.Formatter(TEXT_FORMAT, datefmt=DATE_FORMAT)
+    else:
+        log_formatter = JsonFormatter(datefmt=DATE_FORMAT)
 
     os.makedirs("logs", exist_ok=True)
 
@@ -16,7 +125,16 @@ def setup_logging():
     file_handler = logging.FileHandler("logs/service.log", encoding="utf-8")
     file_handler.setFormatter(log_formatter)
 
+    queue_handler = LogQueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(RateLimitFilter())
+    listener = QueueListener(queue_handler.queue, console_handler, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
     logging.basicConfig(
-        level=logging.DEBUG if os.getenv("LOGLEVEL", "debug") == "debug" else logging.INFO,
-        handlers=[console_handler, file_handler],
+        level=logging.DEBUG if os.getenv("LOGLEVEL", "info") == "debug" else logging.INFO,
+        handlers=[queue_handler],
     )
+    apply_log_levels(os.getenv("LOG_LEVELS", ""))
+    reload_log_levels()
+    return listener
@@ -0,0 +1,58 @@
+import logging
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+logger = logging.getLogger(__name__)
+
+SEND_SECONDS = Histogram(
+    "sms_send_seconds",
+    "Time the modem took to accept an SMS",
+    ["modem", "result"],
+    buckets=(0.1, 0.25, 0.5, 1, 2, 5, 10, 30, 60),
+)
+SEND_RETRIES = Counter("sms_send_retries_total", "Send attempts repeated after a failed attempt", ["lane"])
+REPLY_WAIT_SECONDS = Histogram(
+    "sms_reply_wait_seconds",
+    "Time from sending a configuration command until its reply was matched or it expired",
+    ["outcome"],
+    buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1200),
+)
+REPLIES = Counter(
+    "sms_replies_total",
+    "Configuration commands by device model and outcome (replied, expired)",
+    ["device_model", "outcome"],
+)
+MESSAGES_IN_FLIGHT = Gauge(
+    "kafka_messages_in_flight", "Messages taken from a partition and not yet committed", ["topic", "partition"]
+)
+CONSUMER_LAG = Gauge(
+    "kafka_consumer_lag",
+    "Messages behind the end of the partition as of the last fetched message",
+    ["topic", "partition"],
+)
+RETRIED_MESSAGES = Counter("kafka_retried_messages_total", "Failed messages published to a retry topic", ["topic"])
+DEAD_LETTER_MESSAGES = Counter("kafka_dead_letter_messages_total", "Messages moved to a dead letter topic", ["topic"])
+FAILED_MESSAGES = Counter("sms_failed_messages_total", "Messages published to the failed messages topic")
+MODEM_REQUESTS = Counter(
+    "modem_http_requests_total", "HTTP requests to the modem web API", ["modem", "endpoint", "status"]
+)
+MODEM_CIRCUIT_OPEN = Gauge("modem_circuit_open", "1 while every modem is down and consumption is paused")
+
+
+def forget_partition(topic: str, partition: int):
+    """Drop the series of a partition which is no longer consumed here."""
+
+    for gauge in (MESSAGES_IN_FLIGHT, CONSUMER_LAG):
+        try:
+            gauge.remove(topic, str(partition))
+        except KeyError:
+            pass
+
+
+def start_metrics_server(port: int):
+    """Serve the metrics for Prometheus on the given port, 0 disables the endpoint."""
+
+    if not port:
+        return
+    start_http_server(port)
+    logger.info("Metrics available on port %d", port)